@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the SPCrime pipeline.
+
+generate.py makes synthetic SSP crime workbooks and patient tables from the
+bundled CEP and population data; run.py times each stage of the pipeline,
+tracks its peak memory and saves the results as JSON. Everything runs
+offline.
+
+    python -m benchmarks.run --patients 1000 100000 --crimes 100000
+"""
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic inputs for the benchmarks.
+
+crime_workbook() writes an SSP-like crime workbook: cities drawn in
+proportion to their population, neighbourhoods of each city taken from the
+bundled CEP tables, crime types with SSP-like frequencies, and the usual
+spelling noise (abbreviations, typos, case, missing values).
+patient_table() draws patients' postal codes from the bundled CEP tables,
+formatted the way real patient tables have them.
+
+    python -m benchmarks.generate crimes 100000 crimes.xlsx
+    python -m benchmarks.generate patients 100000 patients.tsv
+"""
+
+# Standard libraries
+import argparse
+from functools import lru_cache
+
+# Matrices and dataframes
+import pandas as pd
+import numpy as np
+
+from openpyxl import Workbook
+
+from SPCrime.cepindex import load_cep_index
+from SPCrime.crime import district_lookup, prepare_pop_data
+from SPCrime.normalize import normalize_cities
+
+
+# Maximum number of data rows in an Excel sheet.
+MAX_SHEET_ROWS = 1_048_575
+
+# Approximate share of each NATUREZA_APURADA in the SSP files.
+CRIME_FREQUENCIES = {
+    'FURTO - OUTROS': 0.38,
+    'ROUBO - OUTROS': 0.22,
+    'FURTO DE VEÍCULO': 0.09,
+    'LESÃO CORPORAL DOLOSA': 0.12,
+    'ROUBO DE VEÍCULO': 0.05,
+    'LESÃO CORPORAL CULPOSA POR ACIDENTE DE TRÂNSITO': 0.05,
+    'LESÃO CORPORAL CULPOSA – OUTRAS': 0.01,
+    'TRAFICO DE ENTORPECENTES': 0.03,
+    'ESTUPRO DE VULNERÁVEL': 0.015,
+    'ESTUPRO': 0.006,
+    'TENTATIVA DE HOMICIDIO': 0.006,
+    'HOMICÍDIO DOLOSO': 0.004,
+    'HOMICIDIO CULPOSO POR ACIDENTE DE TRANSITO': 0.004,
+    'HOMICIDIO CULPOSO OUTROS': 0.001,
+    'ROUBO DE CARGA': 0.004,
+    'FURTO DE CARGA': 0.001,
+    'ROUBO A BANCO': 0.0002,
+    'LATROCÍNIO': 0.0003,
+    'LESÃO CORPORAL SEGUIDA DE MORTE': 0.0002,
+    'EXTORSÃO MEDIANTE SEQUESTRO': 0.0001,
+    'HOMICÍDIO DOLOSO POR ACIDENTE DE TRÂNSITO': 0.0002}
+
+# Columns of the synthetic sheets, as in the SSP files.
+HEADER = ['NUM_BO', 'ANO_BO', 'DELEGACIA', 'CIDADE', 'BAIRRO',
+          'LOGRADOURO', 'NUMERO_LOGRADOURO', 'LATITUDE', 'LONGITUDE',
+          'DATA_OCORRENCIA_BO', 'HORA_OCORRENCIA_BO', 'NATUREZA_APURADA',
+          'DESCR_CONDUTA']
+
+
+@lru_cache(maxsize=None)
+def places():
+    """
+    Distinct (bairro, cidade) pairs of the bundled CEP tables, with the
+    weight of each pair: city population split evenly among its bairros.
+    """
+    index = load_cep_index()
+    pairs = pd.DataFrame({'bairro': index.codes('bairro'),
+                          'cidade': index.codes('cidade')})
+    pairs = pairs[(pairs['bairro'] >= 0) & (pairs['cidade'] >= 0)]
+    pairs = pairs.drop_duplicates(ignore_index=True)
+    pairs['bairro'] = index.decode('bairro', pairs['bairro'])
+    pairs['cidade'] = index.decode('cidade', pairs['cidade'])
+
+    pop = prepare_pop_data()['population']
+    city = normalize_cities(pairs['cidade'])
+    population = city.map(pop)
+    # São Paulo City is split in districts in the population table.
+    districts = set(district_lookup().values())
+    population[city == 'sao paulo'] = pop[pop.index.isin(districts)].sum()
+    pairs['weight'] = population.fillna(population.min())
+    pairs['weight'] /= pairs.groupby('cidade')['weight'].transform('size')
+    pairs['weight'] /= pairs['weight'].sum()
+    return pairs
+
+
+def _ssp_city(names, rng):
+    """City names as written by the SSP: upper case, 'S.' for 'São'."""
+    names = pd.Series(names, dtype=object).str.upper()
+    short = rng.random(len(names)) < 0.8
+    names[short] = names[short].str.replace('SÃO ', 'S.', regex=False)
+    return names
+
+
+def _misspell(names, rng, rate=0.1):
+    """Typos, abbreviations, case changes and missing values."""
+    names = pd.Series(names, dtype=object).str.upper()
+    names = names.to_numpy(dtype=object, copy=True)
+    draw = rng.random(len(names))
+    for i in np.flatnonzero(draw < rate):
+        name = names[i]
+        kind = rng.integers(4)
+        if kind == 0 and len(name) > 4:
+            j = rng.integers(len(name))
+            names[i] = name[:j] + name[j + 1:]
+        elif kind == 1 and len(name) > 4:
+            j = rng.integers(len(name) - 1)
+            names[i] = name[:j] + name[j + 1] + name[j] + name[j + 2:]
+        elif kind == 2:
+            names[i] = (name.replace('JARDIM ', 'J ')
+                            .replace('VILA ', 'VL. '))
+        else:
+            names[i] = name.lower()
+    names[draw > 1 - rate / 5] = None
+    return names
+
+
+def crime_records(n_rows, year=2022, seed=0):
+    """Table of n_rows synthetic SSP crime records."""
+    rng = np.random.default_rng(seed)
+    pairs = places()
+    chosen = pairs.iloc[rng.choice(len(pairs), n_rows, p=pairs['weight'])]
+
+    types = list(CRIME_FREQUENCIES)
+    frequency = np.array(list(CRIME_FREQUENCIES.values()))
+    days = rng.integers(0, 365, n_rows)
+    records = pd.DataFrame({
+        'NUM_BO': rng.integers(1, 999999, n_rows),
+        'ANO_BO': year,
+        'DELEGACIA': rng.choice([f'{i:03d} D.P. METROPOLITANO'
+                                 for i in range(1, 100)], n_rows),
+        'CIDADE': _ssp_city(chosen['cidade'], rng),
+        'BAIRRO': _misspell(chosen['bairro'], rng),
+        'LOGRADOURO': rng.choice(['RUA A', 'AVENIDA B', 'PRAÇA C',
+                                  'ESTRADA D'], n_rows),
+        'NUMERO_LOGRADOURO': rng.integers(1, 3000, n_rows),
+        'LATITUDE': rng.uniform(-25, -20, n_rows).round(6),
+        'LONGITUDE': rng.uniform(-53, -44, n_rows).round(6),
+        'DATA_OCORRENCIA_BO': (pd.Timestamp(f'{year}-01-01')
+                               + pd.to_timedelta(days, unit='D')),
+        'HORA_OCORRENCIA_BO': [f'{h:02d}:{m:02d}' for h, m in
+                               zip(rng.integers(0, 24, n_rows),
+                                   rng.integers(0, 60, n_rows))],
+        'NATUREZA_APURADA': rng.choice(types, n_rows,
+                                       p=frequency / frequency.sum()),
+        'DESCR_CONDUTA': rng.choice(['TRANSEUNTE', 'VEICULO', None],
+                                    n_rows)})
+    return records[HEADER]
+
+
+def crime_workbook(path, n_rows, sheets=2, year=2022, seed=0,
+                   chunk_size=100_000):
+    """
+    Writes a synthetic SSP crime workbook with n_rows records split among
+    at least `sheets` sheets (more if a sheet would pass the Excel limit).
+    """
+    sheets = max(sheets, -(-n_rows // MAX_SHEET_ROWS))
+    per_sheet = np.diff(np.linspace(0, n_rows, sheets + 1).astype(int))
+    workbook = Workbook(write_only=True)
+    written = 0
+    for s, size in enumerate(per_sheet):
+        sheet = workbook.create_sheet(f'Plan{s + 1}')
+        sheet.append(HEADER)
+        for start in range(0, size, chunk_size):
+            records = crime_records(min(chunk_size, size - start), year,
+                                    seed=seed + written)
+            written += len(records)
+            for row in records.itertuples(index=False):
+                sheet.append([None if pd.isna(value) else value
+                              for value in row])
+    workbook.save(path)
+    return path
+
+
+def patient_table(n_rows, seed=0):
+    """
+    Table of n_rows patients with postal codes of the bundled CEP tables:
+    most as numbers (leading zero lost), some as text with a hyphen, some
+    missing or invalid, plus a date column.
+    """
+    rng = np.random.default_rng(seed)
+    ceps = np.asarray(load_cep_index().cep)
+    chosen = ceps[rng.integers(0, len(ceps), n_rows)].astype(np.int64)
+
+    zip_code = pd.Series(chosen, dtype=object)
+    draw = rng.random(n_rows)
+    hyphen = draw < 0.1
+    text = pd.Series(chosen[hyphen]).astype(str).str.zfill(8)
+    zip_code[hyphen] = (text.str[:5] + '-' + text.str[5:]).to_numpy()
+    zip_code[(draw >= 0.1) & (draw < 0.12)] = np.nan
+    invalid = (draw >= 0.12) & (draw < 0.13)
+    zip_code[invalid] = rng.integers(10**8, 10**9, invalid.sum())
+
+    days = rng.integers(0, 365, n_rows)
+    return pd.DataFrame({
+        'patient_id': np.arange(n_rows),
+        'zip_code': zip_code,
+        'admission_date': (pd.Timestamp('2022-01-01')
+                           + pd.to_timedelta(days, unit='D'))})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.generate')
+    parser.add_argument('kind', choices=['crimes', 'patients'])
+    parser.add_argument('rows', type=int)
+    parser.add_argument('path')
+    parser.add_argument('--sheets', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.kind == 'crimes':
+        crime_workbook(args.path, args.rows, sheets=args.sheets,
+                       seed=args.seed)
+    else:
+        patients = patient_table(args.rows, seed=args.seed)
+        patients.to_csv(args.path, sep='\t', index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Times each stage of the SPCrime pipeline on synthetic inputs.
+
+For every crime workbook size and patient table size, each stage is run
+once and its wall time and peak traced memory (tracemalloc) are recorded.
+The results are saved as JSON, with the versions and machine they were
+measured on. With --compare, the run is checked against earlier results
+and the command fails if a stage became slower than allowed.
+
+    python -m benchmarks.run --patients 1000 100000 --crimes 100000
+    python -m benchmarks.run --compare benchmarks/results.json
+"""
+
+# Standard libraries
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Matrices and dataframes
+import pandas as pd
+import numpy as np
+
+import SPCrime
+from SPCrime import SPCrime as spc
+from SPCrime import registry
+
+from benchmarks.generate import crime_workbook, patient_table
+
+
+CRIME_TYPES = ['THEFT', 'CVLI', 'CVNLI', 'CVI']
+
+# Stages, in pipeline order. Each one takes and updates the state dict.
+STAGES = ['check_cep', 'validate_cep', 'build_cepDB', 'mapCEP',
+          'build_crimeDB', 'build_crime_counts', 'multiple_crime_rates',
+          'CEP2crime']
+
+# Stages that run per patient table, the others per crime workbook.
+PATIENT_STAGES = ['check_cep', 'validate_cep', 'mapCEP', 'CEP2crime']
+
+# Results of earlier stages that a stage needs.
+REQUIRES = {'multiple_crime_rates': ['crime'],
+            'CEP2crime': ['mapped', 'rates']}
+
+
+def stage_check_cep(state):
+    # The row by row check only takes numbers.
+    patients = state['patients'][['zip_code']].copy()
+    patients['zip_code'] = pd.to_numeric(
+        patients['zip_code'].astype(str).str.replace('-', ''),
+        errors='coerce')
+    patients.apply(spc.check_cep,
+                   zip_code_col='zip_code',
+                   autocorrect=0,
+                   axis=1,
+                   result_type='expand')
+
+
+def stage_validate_cep(state):
+    spc.validate_cep(state['patients']['zip_code'], autocorrect=0)
+
+
+def stage_build_cepDB(state):
+    spc.build_cepDB()
+
+
+def stage_mapCEP(state):
+    _, state['mapped'] = spc.mapCEP(state['patients'].copy(),
+                                    'zip_code',
+                                    autocorrect=0,
+                                    cache=state['cache'])
+
+
+def stage_build_crimeDB(state):
+    state['crime'] = spc.build_crimeDB(state['workbook'],
+                                       cache=state['cache'],
+                                       workers=state['workers'])
+
+
+def stage_build_crime_counts(state):
+    spc.build_crime_counts(state['workbook'],
+                           cache=state['cache'],
+                           workers=state['workers'])
+
+
+def stage_multiple_crime_rates(state):
+    state['rates'] = spc.multiple_crime_rates(CRIME_TYPES,
+                                              state['crime'],
+                                              cache=state['cache'])
+
+
+def stage_CEP2crime(state):
+    spc.CEP2crime(state['mapped'].copy(), CRIME_TYPES, state['rates'])
+
+
+def measure(stage, state, memory=True):
+    """
+    Runs a stage. Returns its wall time (s) and peak memory (bytes).
+    Tracing memory slows Python code down a lot, so with memory=True the
+    stage is run a second time, traced, for the peak.
+    """
+    func = globals()[f'stage_{stage}']
+    if not state['cache']:
+        # Cold runs load the bundled tables again (see SPCrime.registry).
+        registry.clear()
+    start = time.perf_counter()
+    func(state)
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        if not state['cache']:
+            registry.clear()
+        tracemalloc.start()
+        func(state)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def environment():
+    """Versions and machine of the run."""
+    return {'spcrime': SPCrime.__version__,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run(patients=(1000,), crimes=(10000,), stages=STAGES, workdir=None,
+        cache=False, workers=1, memory=True, seed=0, log=sys.stderr):
+    """
+    Runs the benchmarks. Returns a list of results, one per stage and
+    size: {'stage', 'crime_rows', 'patient_rows', 'seconds', 'peak_bytes'}.
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix='SPCrime-bench-') as tmp:
+        workdir = workdir or tmp
+        for crime_rows in crimes:
+            workbook = os.path.join(workdir, f'crimes_{crime_rows}.xlsx')
+            if not os.path.exists(workbook):
+                print(f'generating {workbook}', file=log)
+                crime_workbook(workbook, crime_rows, seed=seed)
+            state = {'workbook': workbook, 'cache': cache,
+                     'workers': workers}
+
+            for patient_rows in patients:
+                state['patients'] = patient_table(patient_rows, seed=seed)
+                for stage in stages:
+                    per_patient = stage in PATIENT_STAGES
+                    if not per_patient and patient_rows != patients[0]:
+                        continue
+                    if any(key not in state
+                           for key in REQUIRES.get(stage, [])):
+                        print(f'{stage}: skipped, needs '
+                              f'{REQUIRES[stage]}', file=log)
+                        continue
+                    seconds, peak = measure(stage, state, memory)
+                    result = {'stage': stage,
+                              'crime_rows': crime_rows,
+                              'patient_rows': (patient_rows if per_patient
+                                               else None),
+                              'seconds': round(seconds, 4),
+                              'peak_bytes': peak}
+                    results.append(result)
+                    print(_format(result), file=log)
+    return results
+
+
+def _format(result):
+    peak = result['peak_bytes']
+    peak = '' if peak is None else f'{peak / 2**20:10.1f} MiB'
+    rows = result['patient_rows'] or result['crime_rows']
+    return f"{result['stage']:22} {rows:>10} rows {result['seconds']:10.3f} s{peak}"
+
+
+def _key(result):
+    return (result['stage'], result['crime_rows'], result['patient_rows'])
+
+
+def compare(results, baseline, tolerance=1.25, log=sys.stderr):
+    """
+    Stages slower than tolerance times their time in baseline (and by more
+    than 50 ms). Returns the list of (result, baseline time).
+    """
+    before = {_key(result): result for result in baseline}
+    slower = []
+    for result in results:
+        old = before.get(_key(result))
+        if old is None:
+            continue
+        ratio = result['seconds'] / max(old['seconds'], 1e-9)
+        print(f'{_format(result)}  x{ratio:.2f}', file=log)
+        if (ratio > tolerance
+                and result['seconds'] - old['seconds'] > 0.05):
+            slower.append((result, old['seconds']))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run')
+    parser.add_argument('--patients', type=int, nargs='+', default=[1000],
+                        help='patient table sizes')
+    parser.add_argument('--crimes', type=int, nargs='+', default=[10000],
+                        help='crime workbook sizes')
+    parser.add_argument('--stages', nargs='+', default=STAGES,
+                        choices=STAGES)
+    parser.add_argument('--workdir', default=None,
+                        help='folder to keep the generated workbooks')
+    parser.add_argument('--cache', action='store_true',
+                        help='use the SPCrime cache (default: cold runs)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='do not trace memory (faster)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None,
+                        help='JSON file of a previous run')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    if not args.cache:
+        # Cold runs also match every name again (see SPCrime.resolutions).
+        os.environ['SPCRIME_RESOLUTIONS'] = '0'
+    stages = [stage for stage in STAGES if stage in args.stages]
+    results = run(patients=args.patients,
+                  crimes=args.crimes,
+                  stages=stages,
+                  workdir=args.workdir,
+                  cache=args.cache,
+                  workers=args.workers,
+                  memory=not args.no_memory,
+                  seed=args.seed)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(),
+                   'parameters': vars(args),
+                   'results': results}, f, indent=1)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        slower = compare(results, baseline, args.tolerance)
+        for result, old in slower:
+            print(f"slower: {result['stage']} {old:.3f} s -> "
+                  f"{result['seconds']:.3f} s", file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
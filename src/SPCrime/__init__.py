@@ -1 +1,19 @@
 __version__ = "0.1.1"
+
+# Submodules are only imported when used: `import SPCrime` does not load
+# pandas, and SPCrime.cache (for instance) works without importing it first.
+_SUBMODULES = ['SPCrime', 'arrow', 'cache', 'cep', 'cepindex', 'columnar',
+               'crime', 'cube', 'exposure', 'ingest', 'lookup', 'matching',
+               'normalize', 'output', 'patients', 'pipeline', 'registry',
+               'report', 'resolutions', 'stream']
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        import importlib
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Arrow engine for counting crime records.
+
+With engine='arrow', the functions that count crime records
+(build_crime_counts(), count_crimes(), filter_crime_type() and the rate
+functions that use them) keep the records in pyarrow tables and count them
+with Arrow's grouping and filtering kernels, which work on dictionary
+encoded text and do not hold the GIL. The results are pandas tables, the
+same as with the default engine ('pandas').
+
+The SSP file is counted by distinct (CIDADE, BAIRRO, NATUREZA_APURADA)
+while it is read; only these combinations, a few thousand, are normalized
+and matched to their location. Arrow has no kernel to remove accents, so
+the names are still normalized by SPCrime.normalize, once per distinct
+name, as in the default engine.
+
+pyarrow is optional: it is only imported when engine='arrow' is used.
+"""
+
+# Matrices and dataframes
+import pandas as pd
+
+
+ENGINES = ('pandas', 'arrow')
+
+
+def check_engine(engine):
+    """Raises ValueError if engine is not one of ENGINES."""
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown engine: {engine!r}. Use one of {ENGINES}')
+
+
+def import_pyarrow():
+    """
+    pyarrow, with the modules SPCrime uses (compute, Parquet and Feather).
+    Used by engine='arrow' and by the Parquet and Feather files of
+    SPCrime.output and SPCrime.stream.
+    """
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.feather
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as error:
+        raise ImportError("engine='arrow', Parquet and Feather files need "
+                          'pyarrow: pip install pyarrow') from error
+    return pyarrow
+
+
+def text_array(values):
+    """
+    Arrow string array of a list of cell values. Missing values are null;
+    other values that are not text (numbers, dates) are written as text.
+    """
+    pa = import_pyarrow()
+    try:
+        return pa.array(values, type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if pd.isna(value) else str(value)
+                         for value in values],
+                        type=pa.string())
+
+
+def rows_table(rows, columns):
+    """Arrow table of a batch of rows from iter_crime_rows()."""
+    pa = import_pyarrow()
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return pa.table({column: text_array(list(column_values))
+                     for column, column_values in zip(columns, values)})
+
+
+def frame_table(df, columns):
+    """Arrow table of columns of a pandas table. Categoricals stay encoded."""
+    pa = import_pyarrow()
+    return pa.Table.from_pandas(df[columns], preserve_index=False)
+
+
+def group_counts(tables, keys):
+    """
+    Number of rows of each combination of the keys in a sequence of Arrow
+    tables. Each table is grouped as it comes, so only the groups are kept.
+    Missing values are grouped as a value of their own.
+    Returns a pandas table with the keys and a count column.
+    """
+    pa = import_pyarrow()
+    parts = [table.group_by(keys).aggregate([([], 'count_all')])
+             for table in tables]
+    if not parts:
+        return pd.DataFrame({**{key: pd.Series([], dtype=object)
+                                for key in keys},
+                             'count': pd.Series([], dtype='int64')})
+    if len(parts) > 1:
+        groups = pa.concat_tables(parts, promote_options='permissive')
+        groups = groups.group_by(keys).aggregate([('count_all', 'sum')])
+        groups = groups.rename_columns(keys + ['count_all'])
+    else:
+        groups = parts[0]
+    groups = groups.to_pandas()
+    return groups.rename(columns={'count_all': 'count'})
+
+
+def count_matching(table, column, values, key):
+    """
+    Number of rows of the Arrow table whose column is one of values, by
+    key. Rows with a missing key are left out.
+    Returns a pandas Series indexed by key.
+    """
+    pa = import_pyarrow()
+    mask = pa.compute.is_in(table[column],
+                            value_set=pa.array(list(values), type=pa.string()))
+    selected = table.filter(mask)
+    counts = selected.group_by(key).aggregate([([], 'count_all')])
+    counts = counts.to_pandas().dropna(subset=[key])
+    return counts.set_index(key)['count_all']
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of processed tables.
+
+Every processed table (crime database, CEP index, population, crime rates)
+is stored under a key made from:
+- the contents of its source files (SHA-256);
+- NORM_RULES_VERSION, the version of the name normalization rules;
+- TABLE_LAYOUT_VERSION, the version of the columns and dtypes of the
+  processed tables;
+- the package version;
+- the parameters used to build it.
+A changed source file, rule or version gives a new key, so stale tables are
+never used. Tables are stored with SPCrime.columnar.
+
+The cache directory is ~/.cache/SPCrime, or the SPCRIME_CACHE_DIR
+environment variable. Set SPCRIME_CACHE=0 to disable the cache, and
+SPCRIME_CACHE_MAX_BYTES to change its size limit (default 5 GB). The least
+recently used entries are removed when the limit is exceeded.
+"""
+
+# Standard libraries
+import hashlib
+import json
+import os
+import shutil
+import time
+from importlib import resources
+
+# Matrices and dataframes
+import pandas as pd
+
+import SPCrime
+from SPCrime.columnar import is_frame, read_frame, write_frame
+from SPCrime.normalize import NORM_RULES_VERSION
+
+
+# Change when the columns or dtypes of the processed tables change.
+# 2: text columns of the crime and patient tables, and of the daily crime
+#    counts, are categorical.
+TABLE_LAYOUT_VERSION = 2
+
+DEFAULT_MAX_BYTES = 5 * 1024**3
+ENTRY_NAME = 'entry.json'
+TABLE_NAME = 'table'
+
+# Digests of files already hashed in this process, by (path, size, mtime).
+_digests = {}
+
+
+def cache_dir():
+    """
+    Directory for files generated by SPCrime.
+    Set the SPCRIME_CACHE_DIR environment variable to change it.
+    """
+    default = os.path.join(os.path.expanduser('~'), '.cache', 'SPCrime')
+    return os.environ.get('SPCRIME_CACHE_DIR', default)
+
+
+def cache_enabled(cache=True):
+    """False if cache is False or the SPCRIME_CACHE variable is 0."""
+    if not cache:
+        return False
+    return os.environ.get('SPCRIME_CACHE', '1').lower() not in ('0', 'false',
+                                                                'no', 'off')
+
+
+def max_cache_bytes():
+    """Size limit of the cache directory."""
+    return int(os.environ.get('SPCRIME_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+
+
+#%% KEYS
+
+
+def _digest_memo_path():
+    return os.path.join(cache_dir(), 'digests.json')
+
+
+def _read_digest_memo():
+    try:
+        with open(_digest_memo_path(), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def file_digest(path):
+    """
+    SHA-256 of the contents of a file. The digest is remembered (also
+    across runs) until the file size or modification time changes.
+    """
+    path = os.path.realpath(os.fspath(path))
+    stat = os.stat(path)
+    signature = [stat.st_size, stat.st_mtime_ns]
+    try:
+        return _digests[(path, *signature)]
+    except KeyError:
+        pass
+
+    memo = _read_digest_memo()
+    known = memo.get(path)
+    if known is not None and known[:2] == signature:
+        digest = known[2]
+    else:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        memo[path] = [*signature, digest]
+        try:
+            os.makedirs(cache_dir(), exist_ok=True)
+            tmp_path = f'{_digest_memo_path()}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(memo, f)
+            os.replace(tmp_path, _digest_memo_path())
+        except OSError:
+            pass
+
+    _digests[(path, *signature)] = digest
+    return digest
+
+
+def resource_digest(package, name):
+    """SHA-256 of a data file bundled with the package."""
+    with resources.path(package, name) as path:
+        return file_digest(path)
+
+
+def frame_digest(df):
+    """SHA-256 of the contents of a table."""
+    hashed = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    sha = hashlib.sha256(hashed.tobytes())
+    sha.update(json.dumps([str(column) for column in df.columns]).encode())
+    return sha.hexdigest()
+
+
+def source_digest(source):
+    """
+    Digest of a source: a file path, a (package, name) pair of a bundled
+    data file, a table, or None.
+    Returns None for sources that cannot be hashed (like open files).
+    """
+    if source is None:
+        return 'none'
+    if isinstance(source, tuple):
+        return resource_digest(*source)
+    if isinstance(source, pd.DataFrame):
+        try:
+            return frame_digest(source)
+        except TypeError:
+            # Columns of lists, dictionaries or other unhashable values.
+            return None
+    if isinstance(source, (str, os.PathLike)) and os.path.isfile(source):
+        return file_digest(source)
+    return None
+
+
+def cache_key(kind, sources=(), **params):
+    """
+    Key of a processed table. Returns None if a source cannot be hashed.
+    Inputs:
+        kind = name of the table type, like 'crime' or 'population'.
+        sources = digests of the inputs (see file_digest()).
+        params = other values that change the table.
+    """
+    if any(source is None for source in sources):
+        return None
+    description = {'kind': kind,
+                   'sources': list(sources),
+                   'rules': NORM_RULES_VERSION,
+                   'layout': TABLE_LAYOUT_VERSION,
+                   'package': SPCrime.__version__,
+                   'params': params}
+    text = json.dumps(description, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+#%% ENTRIES
+
+
+def entry_path(kind, key):
+    """Folder of a cache entry."""
+    return os.path.join(cache_dir(), f'{kind}-{key}')
+
+
+def _read_entry(path):
+    with open(os.path.join(path, ENTRY_NAME), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_entry(path, entry):
+    tmp_path = os.path.join(path, f'{ENTRY_NAME}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entry, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(path, ENTRY_NAME))
+
+
+def _touch(path):
+    """Marks an entry as recently used."""
+    try:
+        entry = _read_entry(path)
+        entry['last_used'] = time.time()
+        _write_entry(path, entry)
+    except (OSError, ValueError):
+        pass
+
+
+def entry_folder(kind, key):
+    """
+    Folder of an existing cache entry, marked as recently used, or None.
+    Use it for entries that are not tables, like the CEP index.
+    """
+    if key is None:
+        return None
+    path = entry_path(kind, key)
+    if not os.path.isfile(os.path.join(path, ENTRY_NAME)):
+        return None
+    _touch(path)
+    return path
+
+
+def _describe(source):
+    """Short text naming a source, for list_cache()."""
+    if isinstance(source, pd.DataFrame):
+        return f'<table {source.shape[0]}x{source.shape[1]}>'
+    if isinstance(source, tuple):
+        return '/'.join(source)
+    return str(source)
+
+
+def new_entry(kind, key, sources=(), **params):
+    """
+    Creates an empty cache entry and returns its folder.
+    Files written there are counted in the cache size.
+    """
+    path = entry_path(kind, key)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    now = time.time()
+    _write_entry(path, {'kind': kind,
+                        'key': key,
+                        'sources': [_describe(source) for source in sources],
+                        'params': {name: str(value)
+                                   for name, value in params.items()},
+                        'package': SPCrime.__version__,
+                        'rules': NORM_RULES_VERSION,
+                        'created': now,
+                        'last_used': now})
+    return path
+
+
+def load_table(kind, key):
+    """Cached table, or None."""
+    path = entry_folder(kind, key)
+    if path is None or not is_frame(os.path.join(path, TABLE_NAME)):
+        return None
+    try:
+        return read_frame(os.path.join(path, TABLE_NAME))
+    except (OSError, ValueError):
+        return None
+
+
+def store_table(kind, key, df, sources=(), **params):
+    """Saves a table in the cache and evicts old entries if needed."""
+    if key is None:
+        return None
+    path = new_entry(kind, key, sources, **params)
+    write_frame(df, os.path.join(path, TABLE_NAME))
+    evict()
+    return path
+
+
+def cached_table(kind, build, sources=(), cache=True, **params):
+    """
+    Returns the cached table of this kind, sources and params, or calls
+    build() and caches its result.
+    Inputs:
+        sources = files or tables the result depends on.
+        cache = False to always call build().
+    """
+    if not cache_enabled(cache):
+        return build()
+    key = cache_key(kind, [source_digest(source) for source in sources],
+                    **params)
+    df = load_table(kind, key)
+    if df is None:
+        df = build()
+        try:
+            store_table(kind, key, df, sources, **params)
+        except OSError:
+            pass
+    return df
+
+
+#%% MAINTENANCE
+
+
+def list_cache():
+    """Table of cache entries, most recently used first."""
+    rows = []
+    folder = cache_dir()
+    if os.path.isdir(folder):
+        for item in os.scandir(folder):
+            if not item.is_dir():
+                continue
+            try:
+                entry = _read_entry(item.path)
+            except (OSError, ValueError):
+                continue
+            entry['size'] = _folder_size(item.path)
+            entry['path'] = item.path
+            rows.append(entry)
+    columns = ['kind', 'key', 'sources', 'params', 'package', 'rules',
+               'created', 'last_used', 'size', 'path']
+    table = pd.DataFrame(rows, columns=columns)
+    for col in ['created', 'last_used']:
+        table[col] = pd.to_datetime(table[col], unit='s')
+    return table.sort_values('last_used', ascending=False,
+                             ignore_index=True)
+
+
+def _folder_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def invalidate(kind=None, key=None):
+    """
+    Removes cache entries. Without arguments, removes all of them.
+    Returns the number of removed entries.
+    """
+    removed = 0
+    for _, entry in list_cache().iterrows():
+        if kind is not None and entry['kind'] != kind:
+            continue
+        if key is not None and entry['key'] != key:
+            continue
+        shutil.rmtree(entry['path'], ignore_errors=True)
+        removed += 1
+    return removed
+
+
+def evict(max_bytes=None):
+    """
+    Removes the least recently used entries until the cache fits in
+    max_bytes (default: max_cache_bytes()). Returns the number of removed
+    entries.
+    """
+    if max_bytes is None:
+        max_bytes = max_cache_bytes()
+    entries = list_cache()
+    total = entries['size'].sum()
+    removed = 0
+    # The most recently used entry is always kept.
+    for _, entry in entries.iloc[1:][::-1].iterrows():
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry['path'], ignore_errors=True)
+        total -= entry['size']
+        removed += 1
+    return removed
@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+"""
+PART 1 of SPCrime: address and São Paulo City district of each patient,
+from their postal code (CEP).
+"""
+
+# Standard libraries
+import logging
+from importlib import resources
+
+# Matrices and dataframes
+import pandas as pd
+import numpy as np
+
+# Local modules
+from SPCrime.cache import cache_enabled
+from SPCrime.cepindex import CEPIndex, is_cep_index, load_cep_index
+from SPCrime.cepindex import PrefixResolver, read_cep_sources
+from SPCrime.normalize import factorize_pairs, normalize_hoods, take_codes
+from SPCrime.registry import shared
+from SPCrime.report import count_match, current_report, stage
+
+
+# Messages about single records go to this logger, at DEBUG level.
+logger = logging.getLogger('SPCrime')
+
+
+#%% PART 1 - RETRIEVE PATIENT'S ADRESS: CHECK CEP
+
+
+def check_cep(series,
+              zip_code_col = 'zip_code',
+              start=[0, 1],
+              autocorrect=False):
+    """
+    Brazilian zip code has 8 digits and the first digit indicates region.
+    - First digit is 1: São Paulo state.
+    - First digit is 0: São Paulo city.
+    https://www.correios.com.br/enviar/precisa-de-ajuda/tudo-sobre-cep
+    """
+    ID = series.name
+    
+    if pd.notna(series[ zip_code_col]):
+        cep = str(int(series[ zip_code_col]))
+    else:
+        logger.debug(f'No CEP for patient {ID}')
+        count_match('cep', 'missing')
+        return np.nan, np.nan
+
+    dig_num = len(cep)
+    if dig_num != 8:
+        logger.debug(f'incorrect number of digits for patient {ID}: {cep}')
+        wrong_dig_num = True
+    else:
+        wrong_dig_num = False
+
+    if cep[0] not in [str(digit) for digit in start]:
+        logger.debug(f'incorrect first digit for patient {ID}: {cep}')
+        wrong_1st_dig = True
+    else:
+        wrong_1st_dig = False
+
+    if (wrong_dig_num == False) & (wrong_1st_dig == False):
+        something_wrong = False
+        count_match('cep', 'ok')
+    else:
+        something_wrong = True
+        if (dig_num == 7) & (type(autocorrect) == int):
+            cep = str(autocorrect) + cep
+            something_wrong = "Corrected"
+            logger.debug(f'autocorrected CEP for patient {ID}. New cep: {cep}')
+            count_match('cep', 'corrected')
+        else:
+            count_match('cep', 'wrong')
+
+    return cep, something_wrong
+
+
+# Status of each postal code after validate_cep().
+CEP_STATUS = pd.CategoricalDtype(['ok', 'corrected', 'wrong length',
+                                  'wrong region', 'missing'])
+
+# wrong_zip of check_cep() for each status: False, True or 'Corrected'.
+WRONG_ZIP = {'ok': False, 'corrected': 'Corrected', 'wrong length': True,
+             'wrong region': True, 'missing': np.nan}
+
+
+def _cep_to_text(value):
+    """Postal code as a string of digits, or NaN."""
+    if isinstance(value, str):
+        text = value.strip().replace('-', '')
+        # Numbers saved as text by spreadsheets, like '3558060.0'.
+        if text.endswith('.0') and text[:-2].isdigit():
+            text = text[:-2]
+        return text if text else np.nan
+    try:
+        if float(value) == int(value):
+            return str(int(value))
+    except (TypeError, ValueError, OverflowError):
+        pass
+    return str(value)
+
+
+def validate_cep(zip_codes, start=[0, 1], autocorrect=False):
+    """
+    Vectorized version of check_cep() for a whole column of postal codes.
+    Each distinct code is checked only once.
+    Inputs:
+        zip_codes = Series of postal codes, as numbers or strings. Leading
+                    and trailing white space and hyphens are removed.
+        start = accepted first digits.
+        autocorrect = False, 0 or 1. Digit added to the start of seven-digit
+                      codes, usually lost when the code was read as a number.
+    Returns a table aligned with zip_codes with the columns:
+        cep = corrected postal code (string), NaN if missing.
+        status = 'ok', 'corrected', 'wrong length', 'wrong region' or
+                 'missing' (categorical).
+    """
+    zip_codes = pd.Series(zip_codes)
+    codes, uniques = pd.factorize(zip_codes)
+
+    if pd.api.types.is_numeric_dtype(uniques.dtype):
+        integral = np.asarray(uniques) == np.round(uniques)
+        text = np.where(integral,
+                        pd.Series(uniques).round().astype(np.int64).astype(str),
+                        pd.Series(uniques).astype(str))
+        text = pd.Series(text, dtype=object)
+    else:
+        text = pd.Series([_cep_to_text(value) for value in uniques],
+                         dtype=object)
+
+    missing = text.isna().to_numpy()
+    text = text.fillna('')
+    length = text.str.len().to_numpy(dtype=np.int64, copy=True)
+    digits = text.str.isdigit().to_numpy(dtype=bool)
+
+    status = np.full(len(text), 'ok', dtype=object)
+    if isinstance(autocorrect, int) and not isinstance(autocorrect, bool):
+        fix = (length == 7) & digits
+        text[fix] = str(autocorrect) + text[fix]
+        length[fix] = 8
+        status[fix] = 'corrected'
+
+    first = text.str[:1].to_numpy()
+    status[~np.isin(first, [str(digit) for digit in start])] = 'wrong region'
+    status[(length != 8) | ~digits] = 'wrong length'
+    status[missing] = 'missing'
+    text[missing] = np.nan
+
+    cep = take_codes(text, codes)
+    status = take_codes(status, codes)
+    status[codes == -1] = 'missing'
+    status = pd.Categorical(status, dtype=CEP_STATUS)
+    if current_report() is not None:
+        for outcome, n in pd.Series(status).value_counts().items():
+            if n:
+                count_match('cep', outcome, int(n))
+    return pd.DataFrame({'cep': cep, 'status': status},
+                        index=zip_codes.index)
+
+
+def wrong_zip(status):
+    """
+    wrong_zip column of mapCEP(), as check_cep() gives it (False, True,
+    'Corrected', or NaN if missing), from the status column of
+    validate_cep().
+    """
+    status = pd.Series(status)
+    return status.astype(object).map(WRONG_ZIP).astype(object)
+
+
+def validate_one_cep(zip_code, start=[0, 1], autocorrect=False):
+    """
+    Scalar version of validate_cep(), for a single postal code.
+    Returns the corrected postal code (or NaN) and its status.
+    """
+    if pd.isna(zip_code):
+        return np.nan, 'missing'
+    text = _cep_to_text(zip_code)
+    if pd.isna(text):
+        return np.nan, 'missing'
+
+    status = 'ok'
+    if (isinstance(autocorrect, int) and not isinstance(autocorrect, bool)
+            and len(text) == 7 and text.isdigit()):
+        text = str(autocorrect) + text
+        status = 'corrected'
+    if text[:1] not in [str(digit) for digit in start]:
+        status = 'wrong region'
+    if len(text) != 8 or not text.isdigit():
+        status = 'wrong length'
+    return text, status
+
+
+#%% PART 1 - RETRIEVE PATIENT'S ADRESS: PREPARE CEP TABLE (FROM SOURCE)
+# Source: https://www.cepaberto.com/downloads/new
+
+
+def build_cepDB():
+    """
+    Concatanates the tables from CEP Aberto database and add city names.
+    For repeated lookups, prefer load_cep_index(), which compiles the same
+    table into a memory-mapped index once.
+    """
+    return read_cep_sources()
+
+
+#%% PART 1 - RETRIEVE PATIENT'S ADRESS: CEP TO STREET AND NEIGHBOURHOOD
+
+
+def cep2neighbourhood(df, zip_code_col, CEP):
+    """
+    Inputs:
+        df = Table with postal code data on the column named by the 
+             zip_code_col argument
+        CEP = database built by the build_cepDB() function, or a CEPIndex
+              opened by load_cep_index().
+    """
+    if isinstance(CEP, CEPIndex):
+        adress = CEP.lookup(df[zip_code_col], categorical=True)
+        right_adress = pd.concat([df, adress], axis=1)
+    else:
+        right_adress = pd.merge(df,
+                                CEP,
+                                left_on=zip_code_col,
+                                right_index=True,
+                                how='left')
+    
+    right_adress = right_adress.rename(columns={'rua':'street',
+                                                'bairro':'neighbourhood',
+                                                'cidade':'city',
+                                                'estado':'state'})
+    return right_adress
+
+#%% PART 1 - RETRIEVE PATIENT'S ADRESS: NORMALIZE NEIGHBOURHOOD
+# norm_hood(), replace_abb() and the abbreviation rules are in normalize.py.
+
+
+#%% PART 1 - RETRIEVE PATIENT'S ADRESS: MATCH SÃO PAULO DISTRICTS
+# São Paulo has 96 official districts.
+# Each district comprises a varying number of neighbourhoods.
+# I made a table based on the website https://www.saopaulobairros.com.br/.
+
+
+def open_dist_dict():
+    """
+    Loads database of neighbourhoods --> district. 
+    The table is read once per process (see SPCrime.registry); later calls
+    return a copy.
+    """
+    return shared('districts', _read_dist_dict).copy()
+
+
+def _read_dist_dict():
+    with resources.open_text('SPCrime.data', 'districts.tsv') as f:
+        dist = pd.read_csv(f, sep='\t', dtype=str)
+    dist = dist.set_index('Unnamed: 0')
+    
+    # Create a simplified neighbourhood > district table.
+    dist_dict = dist[['district', 'neighbourhood']]
+    dist_dict = dist_dict.drop_duplicates(subset='neighbourhood', keep='first')
+    
+    return dist_dict
+
+
+def neighbourhood2dist(df, dist_dict):
+    """
+   Inputs:
+       df = Table with postal code data on the column neighbourhood'.
+       dist_dict = dictionary opened by the the open_dist_dict() function.
+        
+    """
+    hoods = df['neighbourhood'].dtype
+    if isinstance(hoods, pd.CategoricalDtype):
+        # Same categories on both sides, so the column stays categorical.
+        known = (dist_dict['neighbourhood'].isin(hoods.categories)
+                 | dist_dict['neighbourhood'].isna())
+        dist_dict = dist_dict[known].astype({'neighbourhood': hoods})
+    
+    try:
+        df_dist = pd.merge(df,
+                           dist_dict,
+                           left_on='neighbourhood',
+                           right_on='neighbourhood',
+                           how='left')
+    except ValueError:
+        logger.error('This error happens when we found no valid postal '
+                     'code. Check if your codes are from SP State (start '
+                     'with 0 or 1). Try to turn on the option autocorrect!')
+        raise
+    
+    df_dist.loc[df_dist['city'] != 'São Paulo', 'district'] = np.nan
+    df_dist['district'] = df_dist['district'].astype('category')
+    
+    return df_dist
+
+#%% PART 1 - RETRIEVE PATIENT'S ADRESS: CEPS MISSING FROM THE INDEX
+# New and generic postal codes (ending in 000, for instance) are often
+# missing from CEP Aberto. Their first digits still tell the region:
+# 5 digits are a sector and 3 digits a subregion of the Correios.
+
+
+def cep_places(CEP, districts):
+    """
+    City and district of every CEP of the index, as mapCEP() finds them.
+    Inputs:
+        CEP = CEPIndex.
+        districts = table opened by the open_dist_dict() function.
+    Returns the place code of each CEP and a table with the city and
+    district of each place. The code is -1 when the place is unknown: no
+    city, or a São Paulo City neighbourhood without district.
+    """
+    codes, pairs = factorize_pairs(pd.Series(CEP.codes('bairro'),
+                                             name='bairro'),
+                                   pd.Series(CEP.codes('cidade'),
+                                             name='cidade'))
+    hood = CEP.decode('bairro', pairs['bairro'].to_numpy(dtype=np.int64))
+    city = pd.Series(CEP.decode('cidade',
+                                pairs['cidade'].to_numpy(dtype=np.int64)),
+                     name='city')
+    dist_map = districts.drop_duplicates(subset='neighbourhood')
+    dist_map = dist_map.set_index('neighbourhood')['district']
+    district = normalize_hoods(pd.Series(hood)).map(dist_map)
+    district = district.where(city == 'São Paulo').rename('district')
+
+    pair_place, places = factorize_pairs(city, district)
+    unknown = places['city'].isna() | ((places['city'] == 'São Paulo')
+                                       & places['district'].isna())
+    pair_place = np.where(unknown.to_numpy()[pair_place], -1, pair_place)
+    return pair_place[codes], places
+
+
+def fill_by_prefix(df, zip_code_col, CEP, districts):
+    """
+    Fills the city and district of the postal codes missing from the CEP
+    index with the most common city and district of the CEPs that share
+    their first 5 digits or, failing that, their first 3 digits (see
+    PrefixResolver). Street and neighbourhood stay empty.
+    Adds the column cep_match: 'exact', 'sector' (5 digits), 'subregion'
+    (3 digits) or 'none'.
+    Inputs:
+        df = table made by neighbourhood2dist().
+        CEP = CEPIndex.
+        districts = table opened by the open_dist_dict() function.
+    """
+    rows = CEP.positions(df[zip_code_col])
+    level = np.where(rows >= 0, 'exact', 'none')
+    lost = (rows < 0) & df[zip_code_col].notna().to_numpy()
+    match = pd.Categorical(level, categories=['exact', 'sector',
+                                              'subregion', 'none'])
+    if lost.any():
+        values, places = cep_places(CEP, districts)
+        place, match_lost = PrefixResolver(CEP, values).resolve(
+            df.loc[lost, zip_code_col])
+        match[lost] = match_lost
+        filled = np.flatnonzero(lost)[place >= 0]
+        place = place[place >= 0]
+        for column in ['city', 'district']:
+            df[column] = _set_values(df[column], filled,
+                                     places[column].to_numpy()[place])
+
+    df['cep_match'] = match
+    counts = pd.Series(match).value_counts()
+    for outcome, n in counts[counts > 0].items():
+        count_match('cep_match', outcome, int(n))
+    return df
+
+
+def _set_values(series, positions, values):
+    """series with values at positions, adding categories if needed."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        new = pd.Index(pd.unique(values)).dropna()
+        series = series.cat.add_categories(
+            new.difference(series.cat.categories))
+    else:
+        series = series.copy()
+    series.iloc[positions] = values
+    return series
+
+
+#%% PART 1 - RETRIEVE PATIENT'S ADRESS: ADDRESS AND DISTRICT OF EACH PATIENT
+
+
+def open_cep(cep_path=np.nan, cache=True):
+    """
+    CEP table for mapCEP(): the bundled CEP index if cep_path is missing,
+    else the CEP index folder or the TSV saved from build_cepDB().
+    The bundled index is opened once per process (see SPCrime.registry).
+    """
+    with stage('load_cep_index'):
+        if pd.isna(cep_path):
+            return shared(('cep index', cache_enabled(cache)),
+                          lambda: load_cep_index(cache=cache))
+        if is_cep_index(cep_path):
+            return load_cep_index(cep_path)
+        CEP = pd.read_csv(cep_path, sep='\t', dtype=str)
+        return CEP.set_index('Unnamed: 0')
+
+
+def mapCEP(df,
+           zip_code_col,
+           cep_path=np.nan,
+           autocorrect=False,
+           cache=True,
+           cep_fallback=False,
+           CEP=None,
+           districts=None):
+    """
+    Adds the address and São Paulo City district of each patient.
+    CEP = CEP table already opened by open_cep(). Default: open the one
+          given by cep_path.
+    districts = table opened by the open_dist_dict() function. Default:
+                open it.
+    Returns the district table and the patient table.
+    """
+    with stage('validate_cep'):
+        checked = validate_cep(df[zip_code_col], autocorrect=autocorrect)
+        df['zip_code_correct'] = checked['cep']
+        df['wrong_zip'] = wrong_zip(checked['status'])
+        df['cep_status'] = checked['status']
+    if CEP is None:
+        CEP = open_cep(cep_path, cache=cache)
+
+    with stage('cep2neighbourhood'):
+        df = cep2neighbourhood(df, 'zip_code_correct', CEP)
+        df['neighbourhood'] = normalize_hoods(df['neighbourhood'])
+        if districts is None:
+            districts = open_dist_dict()
+        df= neighbourhood2dist(df, districts)
+
+    if cep_fallback and isinstance(CEP, CEPIndex):
+        with stage('fill_by_prefix'):
+            df = fill_by_prefix(df, 'zip_code_correct', CEP, districts)
+    
+    return districts, df
+
@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled CEP index.
+
+The CEP Aberto tables are compiled once into a single binary file:
+- a sorted uint32 array with the CEP numbers;
+- one integer code array per address column (street, complement,
+  neighbourhood, city, state);
+- one dictionary per address column, stored as UTF-8 bytes plus offsets.
+
+All arrays are memory-mapped when the file is opened, so loading the index
+does not parse anything. Lookups are vectorized with numpy.searchsorted and
+only the dictionary entries actually needed are decoded.
+
+CEPs missing from the index (new codes, generic codes ending in 000) can be
+resolved by their first digits with a PrefixResolver.
+"""
+
+# Standard libraries
+import json
+import os
+import tempfile
+from importlib import resources
+
+# Matrices and dataframes
+import pandas as pd
+import numpy as np
+
+# Local modules
+from SPCrime.cache import cache_enabled, cache_key, entry_folder, evict
+from SPCrime.cache import new_entry, resource_digest
+
+
+MAGIC = b'SPCEPIDX'
+FORMAT_VERSION = 1
+INDEX_NAME = 'cep_index.bin'
+
+# Address columns, in the same order as the build_cepDB() table.
+COLUMNS = ('rua', 'cep_info', 'bairro', 'cidade', 'estado')
+CODE_DTYPES = {'rua': np.int32,
+               'cep_info': np.int32,
+               'bairro': np.int32,
+               'cidade': np.int16,
+               'estado': np.int8}
+
+CEP_PARTS = [f'sp.cepaberto_parte_{i}.csv' for i in [1, 2, 3, 4, 5]]
+
+# Fallback levels for CEPs missing from the index: name and number of
+# leading digits, from the most specific.
+PREFIX_LEVELS = (('sector', 5), ('subregion', 3))
+
+
+def read_cep_sources():
+    """
+    Reads the CEP Aberto tables bundled with the package in a single pass.
+    Returns a table indexed by CEP, with the city names in the 'cidade'
+    column.
+    """
+    parts = []
+    for csv_filename in CEP_PARTS:
+        with resources.open_text('SPCrime.data.cep', csv_filename) as f:
+            parts.append(pd.read_csv(f,
+                                     header=None,
+                                     names=['cep', *COLUMNS],
+                                     index_col=0,
+                                     dtype=str))
+    CEP = pd.concat(parts)
+
+    # Na tabela de ceps, as cidades estão representadas por números.
+    with resources.open_text('SPCrime.data.cep', 'cities.csv') as f:
+        cities = pd.read_csv(f,
+                             index_col='id',
+                             usecols=[0, 1],
+                             names=['id', 'cidade'],
+                             dtype=str)
+    CEP['cidade'] = CEP['cidade'].map(cities['cidade'])
+    CEP.index.name = None
+    return CEP
+
+
+def _encode_dictionary(values):
+    """Concatenates strings as UTF-8 bytes. Returns (data, offsets)."""
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return data, offsets
+
+
+def _index_arrays(CEP):
+    """Sorted CEP numbers, code arrays and dictionaries of a CEP table."""
+    keys = pd.to_numeric(pd.Series(CEP.index), errors='coerce')
+    valid = keys.notna().to_numpy()
+    keys = keys[valid].to_numpy(dtype=np.uint32)
+    order = np.argsort(keys, kind='stable')
+
+    arrays = {'cep': keys[order]}
+    for col in COLUMNS:
+        codes, uniques = pd.factorize(CEP[col].to_numpy()[valid])
+        arrays[col] = codes[order].astype(CODE_DTYPES[col])
+        data, offsets = _encode_dictionary(uniques)
+        arrays[f'{col}.data'] = data
+        arrays[f'{col}.offsets'] = offsets
+    return arrays
+
+
+def compile_cep_index(path, CEP=None):
+    """
+    Compiles the CEP table into a binary index file and returns its path.
+    Inputs:
+        path = output file.
+        CEP = table indexed by 8-digit CEP strings, with the COLUMNS.
+              Default: the bundled CEP Aberto tables.
+    """
+    if CEP is None:
+        CEP = read_cep_sources()
+    arrays = _index_arrays(CEP)
+
+    # Header, then every array aligned to 64 bytes.
+    specs = {}
+    position = 0
+    for name, array in arrays.items():
+        specs[name] = {'dtype': array.dtype.str,
+                       'shape': list(array.shape),
+                       'offset': position}
+        position += -(-array.nbytes // 64) * 64
+    header = json.dumps({'version': FORMAT_VERSION,
+                         'arrays': specs}).encode('utf-8')
+    start = -(-(len(MAGIC) + 8 + len(header)) // 64) * 64
+
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.array([FORMAT_VERSION, len(header)],
+                             dtype='<u4').tobytes())
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(start + specs[name]['offset'])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(start + position)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+
+def is_cep_index(path):
+    """True if path is a file made by compile_cep_index()."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (OSError, TypeError):
+        return False
+
+
+class CEPIndex:
+    """
+    Read-only view of a compiled CEP index file.
+    Use CEPIndex.from_table() for an index kept only in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'Not a compiled CEP index: {path}')
+            version, size = np.frombuffer(f.read(8), dtype='<u4')
+            header = json.loads(f.read(int(size)).decode('utf-8'))
+        if version != FORMAT_VERSION:
+            raise ValueError(f'Unsupported CEP index version {version}: '
+                             f'{path}')
+        start = -(-(len(MAGIC) + 8 + int(size)) // 64) * 64
+
+        # One read-only mapping of the file; every array is a view of it.
+        buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        self._arrays = {}
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            shape = tuple(spec['shape'])
+            offset = start + spec['offset']
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            view = buffer[offset:offset + nbytes].view(dtype)
+            # Plain arrays are faster to index than np.memmap objects.
+            self._arrays[name] = view.reshape(shape).view(np.ndarray)
+        self.cep = self._arrays['cep']
+        self._decoded = {}
+
+    @classmethod
+    def from_table(cls, CEP):
+        """In-memory index of a table like the one from build_cepDB()."""
+        index = cls.__new__(cls)
+        index.path = None
+        index._arrays = _index_arrays(CEP)
+        index.cep = index._arrays['cep']
+        index._decoded = {}
+        return index
+
+    def __len__(self):
+        return len(self.cep)
+
+    def codes(self, column):
+        """Integer code of each CEP in column."""
+        return self._arrays[column]
+
+    def decode(self, column, codes):
+        """Dictionary entries of column for the given codes (-1 is NaN)."""
+        codes = np.asarray(codes)
+        size = len(self._arrays[f'{column}.offsets']) - 1
+        if column in self._decoded or len(codes) > size // 10:
+            # Large lookups: decode the whole dictionary once.
+            values = np.append(self.dictionary(column), np.nan)
+            return values[codes]
+
+        uniques, inverse = np.unique(codes, return_inverse=True)
+        data = self._arrays[f'{column}.data']
+        offsets = self._arrays[f'{column}.offsets']
+        values = np.empty(len(uniques), dtype=object)
+        for i, code in enumerate(uniques):
+            if code < 0:
+                values[i] = np.nan
+            else:
+                raw = data[offsets[code]:offsets[code + 1]]
+                values[i] = raw.tobytes().decode('utf-8')
+        return values[inverse.reshape(-1)]
+
+    def entry(self, column, code):
+        """Dictionary entry of column for a single code (-1 is NaN)."""
+        if code < 0:
+            return np.nan
+        offsets = self._arrays[f'{column}.offsets']
+        raw = self._arrays[f'{column}.data'][offsets[code]:offsets[code + 1]]
+        return raw.tobytes().decode('utf-8')
+
+    def dictionary(self, column):
+        """All entries of the dictionary of column."""
+        try:
+            return self._decoded[column]
+        except KeyError:
+            pass
+        data = self._arrays[f'{column}.data'].tobytes()
+        offsets = self._arrays[f'{column}.offsets'].tolist()
+        values = np.empty(len(offsets) - 1, dtype=object)
+        values[:] = [data[start:end].decode('utf-8')
+                     for start, end in zip(offsets[:-1], offsets[1:])]
+        self._decoded[column] = values
+        return values
+
+    def _unique_keys(self, ceps):
+        """
+        Converts CEPs to numbers. Strings must have exactly 8 digits.
+        Returns the code of each CEP and the number of each distinct CEP
+        (-1 if invalid; the last entry is for missing values).
+        """
+        codes, uniques = pd.factorize(pd.Series(ceps))
+        uniques = pd.Series(np.asarray(uniques, dtype=object))
+        keys = np.full(len(uniques) + 1, -1, dtype=np.int64)
+
+        is_text = uniques.map(type) == str
+        text = uniques[is_text].astype(str)
+        text = text[(text.str.len() == 8) & text.str.isdigit()]
+        keys[text.index] = text.astype(np.int64)
+
+        numbers = pd.to_numeric(uniques[~is_text], errors='coerce')
+        numbers = numbers[(numbers >= 0) & (numbers < 10**8)
+                          & (numbers == numbers.round())]
+        keys[numbers.index] = numbers.astype(np.int64)
+        return codes, keys
+
+    def keys(self, ceps):
+        """CEPs as numbers, -1 if invalid."""
+        codes, keys = self._unique_keys(ceps)
+        return keys[codes]
+
+    def _find(self, keys):
+        """Row of each key in the index, or -1 if absent."""
+        if len(self.cep) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        rows = np.searchsorted(self.cep, keys.clip(0).astype(np.uint32))
+        rows = rows.clip(0, len(self.cep) - 1)
+        found = (keys >= 0) & (self.cep[rows] == keys)
+        return np.where(found, rows, -1)
+
+    def find_one(self, key):
+        """Row of a single CEP number in the index, or -1 if absent."""
+        if not 0 <= key < 10**8 or len(self.cep) == 0:
+            return -1
+        row = int(np.searchsorted(self.cep, np.uint32(key)))
+        if row < len(self.cep) and self.cep[row] == key:
+            return row
+        return -1
+
+    def positions(self, ceps):
+        """Row of each CEP in the index, or -1 if absent."""
+        codes, keys = self._unique_keys(ceps)
+        return self._find(keys)[codes]
+
+    def categorical(self, column, codes):
+        """
+        decode() as a Categorical, with only the entries used as
+        categories. Each entry is decoded once.
+        """
+        used, inverse = np.unique(np.asarray(codes), return_inverse=True)
+        inverse = inverse.reshape(-1)
+        if len(used) and used[0] < 0:
+            used = used[1:]
+            inverse = inverse - 1
+        return pd.Categorical.from_codes(inverse,
+                                         categories=self.decode(column, used))
+
+    def lookup(self, ceps, columns=COLUMNS, categorical=False):
+        """
+        Address of each CEP, in a table aligned with the input.
+        CEPs absent from the index get NaN.
+        categorical = return categorical columns.
+        """
+        index = ceps.index if isinstance(ceps, pd.Series) else None
+        rows = self.positions(ceps)
+        found = rows >= 0
+        decode = self.categorical if categorical else self.decode
+        table = {}
+        for col in columns:
+            codes = np.full(len(rows), -1, dtype=np.int64)
+            codes[found] = self._arrays[col][rows[found]]
+            table[col] = decode(col, codes)
+        return pd.DataFrame(table, index=index)
+
+    def to_frame(self):
+        """The whole index as a table like the one from build_cepDB()."""
+        table = {col: self.decode(col, self._arrays[col]) for col in COLUMNS}
+        index = pd.Index(np.char.zfill(self.cep.astype(str), 8), dtype=object)
+        return pd.DataFrame(table, index=index)
+
+
+def majority_by_prefix(prefixes, values):
+    """
+    Most common value of each prefix.
+    Inputs:
+        prefixes = sorted integer prefixes, one per CEP.
+        values = integer value of each CEP. -1 (missing) is not counted.
+    Returns the distinct prefixes and their most common value (the
+    smallest one in a tie, -1 if the prefix has no value).
+    """
+    prefixes = np.asarray(prefixes, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    unique_prefixes, group = np.unique(prefixes, return_inverse=True)
+    majority = np.full(len(unique_prefixes), -1, dtype=np.int64)
+    keep = values >= 0
+    if not keep.any():
+        return unique_prefixes, majority
+
+    n_values = int(values.max()) + 1
+    cells, counts = np.unique(group.reshape(-1)[keep] * n_values
+                              + values[keep], return_counts=True)
+    cell_group = cells // n_values
+    cell_value = cells % n_values
+    # By prefix, then most CEPs first, then smallest value.
+    order = np.lexsort((cell_value, -counts, cell_group))
+    cell_group = cell_group[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = cell_group[1:] != cell_group[:-1]
+    majority[cell_group[first]] = cell_value[order][first]
+    return unique_prefixes, majority
+
+
+class PrefixResolver:
+    """
+    Value of each CEP, with a fallback for CEPs missing from the index.
+    Inputs:
+        index = CEPIndex.
+        values = integer value of each CEP of the index, like a district
+                 code (-1 for missing).
+        levels = fallback levels, as (name, number of leading digits).
+    A CEP of the index gets its own value. Other CEPs get the most common
+    value of the index CEPs that share their first 5 digits (sector) or,
+    failing that, their first 3 digits (subregion). Each level is a sorted
+    array searched with numpy.searchsorted.
+    """
+
+    def __init__(self, index, values, levels=PREFIX_LEVELS):
+        self.index = index
+        self.values = np.asarray(values, dtype=np.int64)
+        self.levels = list(levels)
+        self.level_names = (['exact'] + [name for name, _ in self.levels]
+                            + ['none'])
+        keys = np.asarray(index.cep, dtype=np.int64)
+        self._tables = [majority_by_prefix(keys // 10**(8 - digits),
+                                           self.values)
+                        for _, digits in self.levels]
+
+    def resolve(self, ceps):
+        """
+        Returns the value of each CEP (-1 if not resolved) and the level
+        that resolved it: 'exact', a level name or 'none' (categorical).
+        """
+        codes, keys = self.index._unique_keys(ceps)
+        rows = self.index._find(keys)
+        found = rows >= 0
+        value = np.full(len(keys), -1, dtype=np.int64)
+        value[found] = self.values[rows[found]]
+        level = np.where(found, 0, len(self.levels) + 1)
+
+        for i, ((_, digits), (prefixes, majority)) in enumerate(
+                zip(self.levels, self._tables), start=1):
+            todo = np.flatnonzero((level > i) & (keys >= 0))
+            if not len(todo) or not len(prefixes):
+                continue
+            prefix = keys[todo] // 10**(8 - digits)
+            position = np.searchsorted(prefixes, prefix)
+            position = position.clip(0, len(prefixes) - 1)
+            hit = (prefixes[position] == prefix) & (majority[position] >= 0)
+            value[todo[hit]] = majority[position[hit]]
+            level[todo[hit]] = i
+
+        level = pd.Categorical.from_codes(level[codes],
+                                          categories=self.level_names)
+        return value[codes], level
+
+    def resolve_one(self, key):
+        """
+        Scalar version of resolve() for a CEP number missing from the index.
+        Returns its value (-1 if not resolved) and the level name.
+        """
+        for (name, digits), (prefixes, majority) in zip(self.levels,
+                                                        self._tables):
+            prefix = key // 10**(8 - digits)
+            position = int(np.searchsorted(prefixes, prefix))
+            if (position < len(prefixes) and prefixes[position] == prefix
+                    and majority[position] >= 0):
+                return int(majority[position]), name
+        return -1, 'none'
+
+
+def load_cep_index(path=None, cache=True):
+    """
+    Opens a compiled CEP index.
+    Without a path, the index of the bundled CEP Aberto tables is compiled
+    into the SPCrime cache the first time it is needed, and again when the
+    package data changes. With cache=False, it is built in memory.
+    """
+    if path is not None:
+        return CEPIndex(path)
+    if not cache_enabled(cache):
+        return CEPIndex.from_table(read_cep_sources())
+
+    sources = [('SPCrime.data.cep', name) for name in CEP_PARTS + ['cities.csv']]
+    key = cache_key('cep_index', [resource_digest(*source)
+                                  for source in sources])
+    folder = entry_folder('cep_index', key)
+    if folder is not None:
+        try:
+            return CEPIndex(os.path.join(folder, INDEX_NAME))
+        except (OSError, ValueError):
+            pass
+
+    folder = new_entry('cep_index', key, sources)
+    compile_cep_index(os.path.join(folder, INDEX_NAME))
+    evict()
+    return CEPIndex(os.path.join(folder, INDEX_NAME))
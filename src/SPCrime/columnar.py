@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar storage of tables.
+
+A table is saved as a folder with one .npy file per column and a meta.json
+file describing the columns. Text columns are dictionary-encoded: integer
+codes plus the list of distinct values. Files are memory-mapped when read,
+so opening a saved table costs little more than decoding its dictionaries.
+
+Only pandas and numpy are needed.
+"""
+
+# Standard libraries
+import json
+import os
+import shutil
+import tempfile
+
+# Matrices and dataframes
+import pandas as pd
+import numpy as np
+
+
+FORMAT_VERSION = 1
+META_NAME = 'meta.json'
+
+# Name given to an unnamed index when it is saved as a column.
+_INDEX_NAME = '__index_level_{}__'
+
+
+def _to_json(values):
+    """Values as JSON-compatible Python objects."""
+    return [value.item() if isinstance(value, np.generic) else value
+            for value in values]
+
+
+def _save_column(folder, i, series):
+    """Saves one column and returns its description."""
+    name = f'c{i}'
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        np.save(os.path.join(folder, f'{name}.npy'), series.cat.codes.to_numpy())
+        return {'kind': 'category',
+                'categories': _to_json(dtype.categories.tolist()),
+                'ordered': bool(dtype.ordered)}
+    if (pd.api.types.is_bool_dtype(dtype)
+            or pd.api.types.is_datetime64_dtype(dtype)
+            or (pd.api.types.is_numeric_dtype(dtype)
+                and not pd.api.types.is_extension_array_dtype(dtype))):
+        values = series.to_numpy()
+        np.save(os.path.join(folder, f'{name}.npy'), values)
+        return {'kind': 'array'}
+    # Text and everything else: dictionary encoding.
+    codes, uniques = pd.factorize(series)
+    np.save(os.path.join(folder, f'{name}.npy'), codes.astype(np.int32))
+    return {'kind': 'dictionary',
+            'categories': _to_json(list(uniques))}
+
+
+def _load_column(folder, i, spec, mmap_mode):
+    values = np.load(os.path.join(folder, f'c{i}.npy'), mmap_mode=mmap_mode)
+    if spec['kind'] == 'array':
+        return values
+    if spec['kind'] == 'category':
+        dtype = pd.CategoricalDtype(spec['categories'], ordered=spec['ordered'])
+        return pd.Categorical.from_codes(np.asarray(values), dtype=dtype)
+    table = np.empty(len(spec['categories']) + 1, dtype=object)
+    table[:-1] = spec['categories']
+    table[-1] = np.nan
+    return table[values]
+
+
+def write_frame(df, path):
+    """
+    Saves df in the folder path (replaced if it exists).
+    Column names must be strings. The index is saved as columns unless it
+    is a default RangeIndex.
+    """
+    index_names = None
+    default_index = (isinstance(df.index, pd.RangeIndex)
+                     and df.index.start == 0 and df.index.step == 1
+                     and df.index.name is None)
+    if not default_index:
+        index_names = [name if name is not None else _INDEX_NAME.format(i)
+                       for i, name in enumerate(df.index.names)]
+        df = df.copy()
+        df.index = df.index.set_names(index_names)
+        df = df.reset_index()
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    folder = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    try:
+        columns = []
+        for i, column in enumerate(df.columns):
+            spec = _save_column(folder, i, df.iloc[:, i])
+            spec['name'] = column
+            columns.append(spec)
+        meta = {'version': FORMAT_VERSION,
+                'rows': len(df),
+                'columns': columns,
+                'index': index_names,
+                'columns_name': df.columns.name}
+        with open(os.path.join(folder, META_NAME), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(folder, path)
+    except BaseException:
+        shutil.rmtree(folder, ignore_errors=True)
+        raise
+    return path
+
+
+def read_frame(path, columns=None, mmap=True):
+    """
+    Opens a table saved by write_frame().
+    Inputs:
+        columns = names of the columns to read. Default: all.
+        mmap = memory-map the numeric columns instead of reading them.
+    """
+    with open(os.path.join(path, META_NAME), encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta['version'] != FORMAT_VERSION:
+        raise ValueError(f'Unsupported table version {meta["version"]}: '
+                         f'{path}')
+
+    index_names = meta['index'] or []
+    wanted = None
+    if columns is not None:
+        wanted = set(columns) | set(index_names)
+
+    data = {}
+    for i, spec in enumerate(meta['columns']):
+        if wanted is None or spec['name'] in wanted:
+            data[spec['name']] = _load_column(path, i, spec,
+                                              'r' if mmap else None)
+    df = pd.DataFrame(data, index=pd.RangeIndex(meta['rows']))
+
+    if index_names:
+        df = df.set_index(index_names)
+        names = [None if name == _INDEX_NAME.format(i) else name
+                 for i, name in enumerate(index_names)]
+        df.index = df.index.set_names(names)
+    df.columns.name = meta['columns_name']
+    return df
+
+
+def is_frame(path):
+    """True if path is a folder made by write_frame()."""
+    return os.path.isfile(os.path.join(path, META_NAME))
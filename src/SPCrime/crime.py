@@ -0,0 +1,1044 @@
+# -*- coding: utf-8 -*-
+"""
+PART 2 of SPCrime: crime records of the SSP files, their location and the
+per capita crime rates of each location.
+"""
+
+# Standard libraries
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from importlib import resources
+from itertools import repeat
+
+# Matrices and dataframes
+import pandas as pd
+import numpy as np
+
+# Local modules
+from SPCrime import arrow
+from SPCrime.cache import cache_enabled, cached_table
+from SPCrime.cep import open_dist_dict
+from SPCrime.columnar import read_frame, write_frame
+from SPCrime.ingest import BATCH_SIZE, CRIME_COLUMNS, DATE_COLUMN
+from SPCrime.ingest import concat_batches, encode_batch, iter_crime_batches
+from SPCrime.ingest import iter_crime_rows, sheet_names, start_batches
+from SPCrime.normalize import factorize_pairs, take_categorical
+from SPCrime.normalize import (normalize_cities, normalize_crime_hoods,
+                               normalize_hoods)
+from SPCrime.output import output_path, split_extension, write_table
+from SPCrime.registry import shared
+from SPCrime.report import count_match, current_report, stage
+from SPCrime.resolutions import (manual_resolutions, name_matcher,
+                                 save_resolutions)
+
+
+# Messages about single records go to this logger, at DEBUG level.
+logger = logging.getLogger('SPCrime')
+
+
+#%% PART 2 - CRIMINAL DATA: LOAD DATA
+# Dados de 2022: https://www.ssp.sp.gov.br/estatistica/consultas
+
+
+def open_crime_file(file, batch_size=BATCH_SIZE):
+    """
+    Opens the SSP crime database. 
+    All the sheets are read in streaming mode and only the CRIME_COLUMNS
+    are kept, as categorical columns (see SPCrime.ingest).
+    """
+    batches = iter_crime_batches(file,
+                                 columns=CRIME_COLUMNS,
+                                 batch_size=batch_size)
+    return concat_batches(batches, columns=CRIME_COLUMNS)
+
+
+#%% PART 2 - CRIMINAL DATA: STANDARDIZE NAMES
+# norm_city() and the city aliases are in normalize.py.
+
+
+def standardize_crime(crime):
+    crime['BAIRRO'] = normalize_crime_hoods(crime['BAIRRO'])
+    crime['CIDADE'] = normalize_cities(crime['CIDADE'])
+    return crime
+
+#%% PART 2 - CRIMINAL DATA: NEIGHBOURHOOD --> DISTRICT
+
+
+def find_closest_district(hood, district_dict, matcher=None):
+    '''
+    hood = string with neighbourhood name
+    district_dict = dictionary neighbourhood--> district
+    matcher = NameMatcher (or LearnedMatcher) built from the district_dict
+              keys. Pass it when calling this function many times.
+    A manual resolution (see SPCrime.resolutions) can also give a district
+    name instead of a neighbourhood.
+    '''
+    if pd.isna(hood):
+        count_match('district', 'missing')
+        return np.nan
+    try:
+        district = district_dict[hood]
+        count_match('district', 'exact')
+    except KeyError:
+        if matcher is None:
+            matcher = name_matcher('district', district_dict.keys())
+        best_match = matcher.match(hood)
+        if best_match in district_dict:
+            district = district_dict[best_match]
+            count_match('district', 'close')
+        elif best_match is not None and best_match in district_dict.values():
+            district = best_match
+            count_match('district', 'close')
+        else:
+            district = np.nan
+            logger.debug(f'Neighbourhood not found: {hood}')
+            count_match('district', 'unmatched', name=hood)
+    return district
+
+
+def city_sp_districts(series, district_dict, matcher=None):
+    """
+    I only have district data for São Paulo.
+    So if not São Paulo City, consider the whole town as its district.
+
+    It works only if you have applied norm_city().
+    """
+    if series['CIDADE'] == 'sao paulo':
+        district = find_closest_district(series['BAIRRO'],
+                                         district_dict,
+                                         matcher=matcher)
+    else:
+        count_match('district', 'not São Paulo')
+        district = series['CIDADE']
+
+    series['LOCATION'] = district
+    return series
+
+
+def resolve_locations(crime, district_dict, matcher=None, memo=None):
+    """
+    Finds the LOCATION of every crime record: the district for São Paulo City,
+    the city for the rest of the state.
+    Each distinct (CIDADE, BAIRRO) pair is resolved only once.
+    Inputs:
+        matcher = NameMatcher built from the district_dict keys. Default:
+                  name_matcher('district', ...), which uses the resolution
+                  table (see SPCrime.resolutions).
+        memo = dictionary neighbourhood --> district of the São Paulo City
+               names already resolved. Pass the same one to resolve several
+               batches of records.
+    New resolutions are not saved here: call save_resolutions() once all
+    the batches are resolved.
+
+    It works only if you have applied standardize_crime().
+    """
+    codes, pairs = factorize_pairs(crime['CIDADE'], crime['BAIRRO'])
+    if matcher is None:
+        matcher = name_matcher('district', district_dict.keys())
+    if memo is None:
+        memo = {}
+
+    # Same rule as city_sp_districts(), without building a Series per pair.
+    location = pairs['CIDADE'].to_numpy(dtype=object).copy()
+    in_sp = (pairs['CIDADE'] == 'sao paulo').to_numpy()
+    districts = []
+    for hood in pairs.loc[in_sp, 'BAIRRO']:
+        if pd.isna(hood):
+            districts.append(find_closest_district(hood, district_dict))
+            continue
+        if hood not in memo:
+            memo[hood] = find_closest_district(hood, district_dict, matcher)
+        districts.append(memo[hood])
+    location[in_sp] = districts
+    location = take_categorical(location, codes,
+                                dtype=location_dtype(location))
+    return pd.Series(location, index=crime.index, name='LOCATION')
+
+
+def location_dtype(names=()):
+    """
+    Categorical dtype of the LOCATION columns: the locations of the
+    population table (cities and São Paulo City districts) plus names, in
+    alphabetical order. Crime and patient tables that only have known
+    locations share the same categories, so their codes can be compared
+    directly.
+    """
+    known, dtype = shared('locations', _known_locations)
+    extra = {name for name in names if isinstance(name, str)} - known
+    if not extra:
+        return dtype
+    return pd.CategoricalDtype(sorted(known | extra))
+
+
+def _known_locations():
+    known = frozenset(str(name) for name in prepare_pop_data().index)
+    return known, pd.CategoricalDtype(sorted(known))
+
+
+# Bundled tables that processed tables depend on.
+DISTRICTS_SOURCE = ('SPCrime.data', 'districts.tsv')
+POP_SOURCES = [('SPCrime.data.pop', 'state.xlsx'),
+               ('SPCrime.data.pop', 'district.xlsx')]
+
+
+def build_crimeDB(file,
+                  districts=None,
+                  cache=True,
+                  workers=1):
+    """
+    Returns a database with all the crimes that were registered in São Paulo
+    state in a given year, and where they occured.
+    Input:
+        crime_db = Year to calculate crime rates.
+        dist_dict = dictionary opened by the the open_dist_dict() function.
+        cache = reuse the database built from the same file in a previous
+                run (see SPCrime.cache).
+        workers = number of processes. With more than one, the sheets of
+                  the file are processed in parallel. The result is the
+                  same.
+    """
+    sources = [file, DISTRICTS_SOURCE if districts is None else districts,
+               manual_resolutions('district')]
+    return cached_table('crime',
+                        lambda: _build_crimeDB(file, districts, workers),
+                        sources=sources,
+                        cache=cache)
+
+
+def _build_crimeDB(file, districts, workers=1):
+    dist_dict = district_lookup(districts)
+    with stage('build_crimeDB'):
+        if workers > 1:
+            parts = map_sheets(_crime_sheet, file, workers,
+                               dist_dict=dist_dict, batch_size=BATCH_SIZE)
+            return concat_batches(parts, columns=parts[0].columns)
+
+        with stage('open_crime_file'):
+            crime = open_crime_file(file)
+        with stage('resolve_locations'):
+            crime = standardize_crime(crime)
+            crime['LOCATION'] = resolve_locations(crime, dist_dict)
+            save_resolutions()
+        # Text columns are categorical, also those with numbers in them.
+        return encode_batch(crime)
+
+
+def district_lookup(districts=None):
+    """
+    Dictionary neighbourhood --> normalized district name.
+    districts = table opened by the open_dist_dict() function. Default: the
+                bundled table.
+    """
+    if districts is None:
+        # The bundled table gives the same dictionary every time.
+        return dict(shared('district lookup',
+                           lambda: district_lookup(open_dist_dict())))
+    districts = districts.copy()
+    districts['district'] = normalize_hoods(districts['district'])
+    return districts.set_index('neighbourhood')['district'].to_dict()
+
+
+def map_sheets(func, file, workers, **kwargs):
+    """
+    Processes each sheet of the SSP file in a pool of worker processes.
+    func(file, sheet, path, **kwargs) saves its result in the folder path
+    with write_frame() and returns True, or returns False if the sheet has
+    no crime records. Results are passed through disk, not pickled. Each
+    worker saves the names it resolved with save_resolutions().
+    Returns the results of the sheets with crime records, in sheet order.
+    """
+    sheets = sheet_names(file)
+    workers = max(1, min(workers, len(sheets)))
+    with tempfile.TemporaryDirectory(prefix='SPCrime-') as folder:
+        paths = [os.path.join(folder, f'sheet{i}')
+                 for i in range(len(sheets))]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            found = list(pool.map(partial(func, **kwargs),
+                                  repeat(file), sheets, paths))
+        parts = [read_frame(path, mmap=False)
+                 for path, ok in zip(paths, found) if ok]
+    if not parts:
+        raise ValueError(f'No sheet of {file} has the columns '
+                         f'{CRIME_COLUMNS}')
+    return parts
+
+
+def _crime_sheet(file, sheet, path, dist_dict, batch_size):
+    """Crime database of one sheet, for map_sheets()."""
+    batches = iter_crime_batches(file,
+                                 columns=CRIME_COLUMNS,
+                                 batch_size=batch_size,
+                                 sheets=[sheet])
+    try:
+        crime = concat_batches(batches, columns=CRIME_COLUMNS)
+    except ValueError:
+        return False
+    if crime.empty:
+        return False
+    crime = standardize_crime(crime)
+    crime['LOCATION'] = resolve_locations(crime, dist_dict)
+    save_resolutions()
+    write_frame(crime, path)
+    return True
+
+
+def build_crime_counts(file,
+                       districts=None,
+                       batch_size=BATCH_SIZE,
+                       cache=True,
+                       workers=1,
+                       engine='pandas'):
+    """
+    Counts the crimes of the SSP file by LOCATION and NATUREZA_APURADA while
+    the file is read, without keeping the records. Memory use depends on the
+    number of locations and crime types, not on the number of records.
+    Returns the same table as count_crimes(build_crimeDB(file)).
+    Input:
+        file = SSP crime database (.xlsx).
+        districts = table opened by the open_dist_dict() function.
+        batch_size = number of records read at a time.
+        cache = reuse the table built from the same file in a previous run
+                (see SPCrime.cache).
+        workers = number of processes, as in build_crimeDB().
+        engine = 'pandas', or 'arrow' to count the records with pyarrow
+                 (see SPCrime.arrow). The table is the same.
+    """
+    arrow.check_engine(engine)
+    sources = [file, DISTRICTS_SOURCE if districts is None else districts,
+               manual_resolutions('district')]
+    return cached_table('crime_counts',
+                        lambda: _build_crime_counts(file, districts,
+                                                    batch_size, workers,
+                                                    engine),
+                        sources=sources,
+                        cache=cache)
+
+
+def _build_crime_counts(file, districts, batch_size, workers=1,
+                        engine='pandas'):
+    dist_dict = district_lookup(districts)
+    with stage('build_crime_counts'):
+        if workers > 1:
+            parts = map_sheets(_counts_sheet, file, workers,
+                               dist_dict=dist_dict, batch_size=batch_size,
+                               engine=engine)
+            return _sum_counts(parts)
+
+        if engine == 'arrow':
+            rows = iter_crime_rows(file,
+                                   columns=CRIME_COLUMNS,
+                                   batch_size=batch_size)
+            return _count_rows_arrow(rows, dist_dict)
+        batches = iter_crime_batches(file,
+                                     columns=CRIME_COLUMNS,
+                                     batch_size=batch_size)
+        return _count_batches(batches, dist_dict)
+
+
+def _count_batches(batches, dist_dict):
+    matcher = name_matcher('district', dist_dict.keys())
+    memo = {}
+
+    counts = []
+    for batch in batches:
+        batch = standardize_crime(batch)
+        batch['LOCATION'] = resolve_locations(batch, dist_dict,
+                                              matcher=matcher, memo=memo)
+        counts.append(count_crimes(batch))
+    save_resolutions()
+    return _sum_counts(counts)
+
+
+def _count_rows_arrow(rows, dist_dict):
+    """
+    build_crime_counts() with engine='arrow': the batches of rows from
+    iter_crime_rows() are counted by (CIDADE, BAIRRO, NATUREZA_APURADA) as
+    they are read, and only the distinct combinations are normalized and
+    resolved.
+    """
+    groups = arrow.group_counts((arrow.rows_table(batch, CRIME_COLUMNS)
+                                 for batch in rows),
+                                CRIME_COLUMNS)
+    groups = standardize_crime(groups)
+    groups['LOCATION'] = resolve_locations(groups, dist_dict)
+    save_resolutions()
+    return count_table(groups['LOCATION'], groups['NATUREZA_APURADA'],
+                       groups['count'])
+
+
+def _sum_counts(tables):
+    """Sum of tables made by count_crimes()."""
+    counts = count_crimes(pd.DataFrame({'LOCATION': [],
+                                        'NATUREZA_APURADA': []}))
+    for table in tables:
+        counts = counts.add(table, fill_value=0)
+    counts = counts.fillna(0).astype(np.int64)
+    return counts.sort_index().sort_index(axis=1)
+
+
+def _counts_sheet(file, sheet, path, dist_dict, batch_size,
+                  engine='pandas'):
+    """Crime counts of one sheet, for map_sheets()."""
+    if engine == 'arrow':
+        batches = iter_crime_rows(file,
+                                  columns=CRIME_COLUMNS,
+                                  batch_size=batch_size,
+                                  sheets=[sheet])
+    else:
+        batches = iter_crime_batches(file,
+                                     columns=CRIME_COLUMNS,
+                                     batch_size=batch_size,
+                                     sheets=[sheet])
+    try:
+        batches = start_batches(batches)
+    except ValueError:
+        return False
+    if engine == 'arrow':
+        counts = _count_rows_arrow(batches, dist_dict)
+    else:
+        counts = _count_batches(batches, dist_dict)
+    write_frame(counts, path)
+    return True
+
+#%% PART 2 - CRIMINAL DATA: DAILY COUNTS
+
+
+def parse_dates(values):
+    """
+    Dates of the SSP file as datetime64. Accepts date cells and texts like
+    '31/12/2022'. Invalid dates are NaT.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values
+    return pd.to_datetime(values, errors='coerce', dayfirst=True,
+                          format='mixed')
+
+
+def build_daily_counts(file,
+                       districts=None,
+                       batch_size=BATCH_SIZE,
+                       cache=True,
+                       workers=1):
+    """
+    Counts the crimes of the SSP file by LOCATION, NATUREZA_APURADA and day
+    of occurrence (DATE_COLUMN), without keeping the records.
+    Returns a table with the columns LOCATION, NATUREZA_APURADA, DATE and
+    count, with a row per non-zero count. Records without a valid date are
+    left out. See SPCrime.exposure for the use of this table.
+    Input:
+        file = SSP crime database (.xlsx).
+        districts = table opened by the open_dist_dict() function.
+        batch_size = number of records read at a time.
+        cache = reuse the table built from the same file in a previous run
+                (see SPCrime.cache).
+        workers = number of processes, as in build_crimeDB().
+    """
+    sources = [file, DISTRICTS_SOURCE if districts is None else districts,
+               manual_resolutions('district')]
+    return cached_table('crime_daily',
+                        lambda: _build_daily_counts(file, districts,
+                                                    batch_size, workers),
+                        sources=sources,
+                        cache=cache,
+                        date_column=DATE_COLUMN)
+
+
+def _build_daily_counts(file, districts, batch_size, workers=1):
+    dist_dict = district_lookup(districts)
+    with stage('build_daily_counts'):
+        if workers > 1:
+            parts = map_sheets(_daily_sheet, file, workers,
+                               dist_dict=dist_dict, batch_size=batch_size)
+            return _sum_daily_counts(parts)
+
+        batches = iter_crime_batches(file,
+                                     columns=CRIME_COLUMNS + [DATE_COLUMN],
+                                     batch_size=batch_size)
+        return _daily_batches(batches, dist_dict)
+
+
+def _daily_batches(batches, dist_dict):
+    matcher = name_matcher('district', dist_dict.keys())
+    memo = {}
+
+    counts = []
+    for batch in batches:
+        batch = standardize_crime(batch)
+        batch['LOCATION'] = resolve_locations(batch, dist_dict,
+                                              matcher=matcher, memo=memo)
+        batch['DATE'] = parse_dates(batch[DATE_COLUMN]).dt.normalize()
+        counts.append(batch.groupby(['LOCATION', 'NATUREZA_APURADA', 'DATE'],
+                                    observed=True)
+                           .size()
+                           .rename('count'))
+    save_resolutions()
+    return _sum_daily_counts(counts)
+
+
+def _sum_daily_counts(tables):
+    """Sum of tables made by _daily_batches()."""
+    tables = [table.set_index(['LOCATION', 'NATUREZA_APURADA', 'DATE'])
+              ['count'] if isinstance(table, pd.DataFrame) else table
+              for table in tables]
+    if not tables:
+        return pd.DataFrame({'LOCATION': pd.Series([], dtype=location_dtype()),
+                             'NATUREZA_APURADA': pd.Series([],
+                                                           dtype='category'),
+                             'DATE': pd.Series([], dtype='datetime64[ns]'),
+                             'count': pd.Series([], dtype=np.int64)})
+    counts = pd.concat(tables).groupby(level=[0, 1, 2], observed=True).sum()
+    counts = counts.astype(np.int64).reset_index()
+    # The index levels of the concatenated tables are plain text again.
+    location = counts['LOCATION'].to_numpy(dtype=object)
+    counts['LOCATION'] = pd.Categorical(location,
+                                        dtype=location_dtype(location))
+    counts['NATUREZA_APURADA'] = counts['NATUREZA_APURADA'].astype('category')
+    counts['DATE'] = counts['DATE'].astype('datetime64[ns]')
+    return counts
+
+
+def _daily_sheet(file, sheet, path, dist_dict, batch_size):
+    """Daily crime counts of one sheet, for map_sheets()."""
+    batches = iter_crime_batches(file,
+                                 columns=CRIME_COLUMNS + [DATE_COLUMN],
+                                 batch_size=batch_size,
+                                 sheets=[sheet])
+    try:
+        batches = start_batches(batches)
+    except ValueError:
+        return False
+    counts = _daily_batches(batches, dist_dict)
+    write_frame(counts, path)
+    return True
+
+#%% PART 2 - CRIMINAL DATA: ABSOLUTE CRIMINAL FREQUENCY BY DISTRICT
+
+# Vou contar duas categorias de crime:
+    # Roubos/furtos
+    # Crimes violentos intencionais.
+
+# Crimes violentos letais intencionais:
+    # Homicídios dolosos,
+    # Latrocínio,
+    # Lesão corporal seguida de morte.
+# Crimes violentos não-letais intencionais:
+    # Estupro (incluí o de vulnerável), 
+    # Lesão corporal dolosa,
+    # Tentativa de homicídio.
+
+# Definições de crimes violentos descritos pela SSP de Goiás:
+# https://www.seguranca.go.gov.br/wp-content/uploads/2019/04/portaria-n-0236-19-ssp-de-auditoria-abril-2019-2.pdf
+
+
+CRIME_CATEGORIES = {
+    'THEFT' : ['FURTO - OUTROS', 'FURTO DE CARGA',
+               'FURTO DE VEÍCULO', 'LATROCÍNIO', 'ROUBO - OUTROS',
+               'ROUBO A BANCO', 'ROUBO DE CARGA', 'ROUBO DE VEÍCULO'],
+
+    'CVLI' : ['HOMICIDIO CULPOSO OUTROS', 
+              'HOMICIDIO CULPOSO POR ACIDENTE DE TRANSITO',
+              'LATROCÍNIO', 'LESÃO CORPORAL SEGUIDA DE MORTE'],
+
+    'CVNLI' : ['ESTUPRO', 'ESTUPRO DE VULNERÁVEL', 'LESÃO CORPORAL DOLOSA',
+               'TENTATIVA DE HOMICIDIO'],
+
+    'CVI' : ['ESTUPRO', 'ESTUPRO DE VULNERÁVEL', 'HOMICIDIO CULPOSO OUTROS',
+             'HOMICIDIO CULPOSO POR ACIDENTE DE TRANSITO', 'LATROCÍNIO', 
+             'LESÃO CORPORAL DOLOSA', 'LESÃO CORPORAL SEGUIDA DE MORTE',
+             'TENTATIVA DE HOMICIDIO']}
+
+
+def filter_crime_type(crime, crime_type, engine='pandas'):
+    """
+    Input:
+        crime = database created by the build_crimeDB() function.
+        engine = 'pandas' or 'arrow' (see SPCrime.arrow).
+        crime_type:
+            'ESTUPRO'
+            'FURTO - OUTROS',
+            'FURTO DE VEÍCULO',
+            'HOMICÍDIO DOLOSO',
+            'LESÃO CORPORAL CULPOSA POR ACIDENTE DE TRÂNSITO',
+            'LESÃO CORPORAL DOLOSA',
+            'ROUBO - OUTROS',
+            'ROUBO DE CARGA',
+            'ROUBO DE VEÍCULO',
+            'TENTATIVA DE HOMICIDIO',
+            'TRAFICO DE ENTORPECENTES',
+            'LESÃO CORPORAL CULPOSA – OUTRAS',
+            'ESTUPRO DE VULNERÁVEL',
+            'FURTO DE CARGA',
+            'HOMICIDIO CULPOSO POR ACIDENTE DE TRANSITO',
+            'EXTORSÃO MEDIANTE SEQUESTRO',
+            'LATROCÍNIO',
+            'LESÃO CORPORAL SEGUIDA DE MORTE',
+            'HOMICIDIO CULPOSO OUTROS',
+            'ROUBO A BANCO',
+            'HOMICÍDIO DOLOSO POR ACIDENTE DE TRÂNSITO'
+            
+            'THEFT' (includes 'FURTO - OUTROS', 'FURTO DE CARGA',
+                     'FURTO DE VEÍCULO', 'LATROCÍNIO', 'ROUBO - OUTROS',
+                     'ROUBO A BANCO', 'ROUBO DE CARGA', 'ROUBO DE VEÍCULO')
+            
+            'CVLI' (Violent intentional lethal crimes:
+                    'HOMICIDIO CULPOSO OUTROS', 
+                    'HOMICIDIO CULPOSO POR ACIDENTE DE TRANSITO',
+                    'LATROCÍNIO', 'LESÃO CORPORAL SEGUIDA DE MORTE'),
+
+            'CVNLI' (Violent intentional non-lethal crimes:
+                     'ESTUPRO', 'ESTUPRO DE VULNERÁVEL',
+                     'LESÃO CORPORAL DOLOSA','TENTATIVA DE HOMICIDIO'),
+                
+           'CVI' (violent intentional crimes)
+    """
+    arrow.check_engine(engine)
+    if engine == 'arrow':
+        return _filter_crime_type_arrow(crime, crime_type)
+
+    if crime_type in CRIME_CATEGORIES.keys():
+        crime = crime[crime['NATUREZA_APURADA'].isin(CRIME_CATEGORIES[crime_type])]
+    else:
+        crime = crime[crime['NATUREZA_APURADA'] == crime_type]
+ 
+    crime_freq = crime.groupby('LOCATION', observed=True)
+    crime_freq = crime_freq['NATUREZA_APURADA'].count()
+    crime_freq = crime_freq.reset_index()
+    crime_freq = crime_freq.rename(columns={'NATUREZA_APURADA':crime_type})
+    
+    return crime_freq
+
+
+def _filter_crime_type_arrow(crime, crime_type):
+    table = arrow.frame_table(crime, ['LOCATION', 'NATUREZA_APURADA'])
+    members = CRIME_CATEGORIES.get(crime_type, [crime_type])
+    counts = arrow.count_matching(table, 'NATUREZA_APURADA', members,
+                                  'LOCATION')
+    # Same order and dtypes as the groupby of the pandas engine.
+    location = pd.Series(counts.index.tolist())
+    if isinstance(crime['LOCATION'].dtype, pd.CategoricalDtype):
+        location = location.astype(crime['LOCATION'].dtype)
+    crime_freq = pd.DataFrame({'LOCATION': location,
+                               crime_type: counts.to_numpy(dtype=np.int64)})
+    crime_freq = crime_freq.sort_values('LOCATION', kind='stable')
+    return crime_freq.reset_index(drop=True)
+
+
+def count_crimes(crime, engine='pandas'):
+    """
+    Counts all crime types in a single pass.
+    Input:
+        crime = database created by the build_crimeDB() function.
+        engine = 'pandas' or 'arrow' (see SPCrime.arrow).
+    Returns a LOCATION x NATUREZA_APURADA table with the number of crimes.
+    """
+    arrow.check_engine(engine)
+    if engine == 'arrow':
+        columns = ['LOCATION', 'NATUREZA_APURADA']
+        groups = arrow.group_counts([arrow.frame_table(crime, columns)],
+                                    columns)
+        return count_table(groups['LOCATION'], groups['NATUREZA_APURADA'],
+                           groups['count'])
+    return count_table(crime['LOCATION'], crime['NATUREZA_APURADA'])
+
+
+def count_table(location, crime_type, weights=None):
+    """
+    LOCATION x NATUREZA_APURADA table with the number of rows (or the sum
+    of weights) of each pair of values. Rows with a missing value are left
+    out.
+    """
+    loc_codes, locations = pd.factorize(location, sort=True)
+    type_codes, types = pd.factorize(crime_type, sort=True)
+    valid = (loc_codes >= 0) & (type_codes >= 0)
+
+    cells = loc_codes[valid].astype(np.int64) * len(types) + type_codes[valid]
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)[valid]
+    counts = np.bincount(cells, weights=weights,
+                         minlength=len(locations) * len(types))
+    counts = counts.astype(np.int64).reshape(len(locations), len(types))
+
+    # Categorical LOCATION is sorted by category; the table by name.
+    locations = pd.Index(np.asarray(locations, dtype=object), name='LOCATION')
+    counts = pd.DataFrame(counts,
+                          index=locations,
+                          columns=pd.Index(types, name='NATUREZA_APURADA'))
+    return counts.sort_index()
+
+
+def select_crime_types(counts, crime_types):
+    """
+    Columns of the table made by count_crimes() for the crime types.
+    The categories of CRIME_CATEGORIES are the sum of their crime types.
+    """
+    selected = {}
+    for crime_type in crime_types:
+        members = CRIME_CATEGORIES.get(crime_type, [crime_type])
+        members = counts.columns.intersection(members)
+        selected[crime_type] = counts[members].sum(axis=1)
+    return pd.DataFrame(selected, index=counts.index)
+
+#%% PART 2 - CRIMINAL DATA: RELATIVE CRIMINAL FREQUENCY BY DISTRICT
+
+# Prepare city population data
+# Source: https://www.ibge.gov.br/estatisticas/sociais/populacao/22827-censo-demografico-2022.html?edicao=37225&t=resultados
+
+
+def prepare_pop_data(cache=True):
+    """
+    Prepare population data for calculating the per capita rate.
+    The table is built once per process (and saved in the SPCrime cache
+    unless cache is False, see SPCrime.registry); later calls return a
+    copy.
+    """
+    cache = cache_enabled(cache)
+    return shared(('population', cache), lambda: _pop_data(cache)).copy()
+
+
+def _pop_data(cache):
+    with stage('prepare_pop_data'):
+        return cached_table('population',
+                            _build_pop_data,
+                            sources=POP_SOURCES,
+                            cache=cache)
+
+
+def _build_pop_data():
+    with resources.open_binary('SPCrime.data.pop', 'state.xlsx') as f:
+        pop_cities = pd.read_excel(f,
+                                   sheet_name='Tabela',
+                                   header=0,
+                                   usecols=['Unidade da Federação e Município',
+                                            'População residente (Pessoas)'])
+
+    new_names = {'Unidade da Federação e Município':'CITY',
+                 'População residente (Pessoas)':'population'}
+    pop_cities = pop_cities.rename(columns=new_names)
+    pop_cities['CITY'] = normalize_cities(pop_cities['CITY'])
+    pop_cities = pop_cities.set_index('CITY').drop('sao paulo')
+
+    # Prepare district population data
+    # Source: https://www.nossasaopaulo.org.br/campanhas/#13
+    with resources.open_binary('SPCrime.data.pop', 'district.xlsx') as f:
+        pop_dist = pd.read_excel(f,
+                                 header=0)
+    pop_dist = pop_dist.rename(columns={'DISTRITO': 'district',
+                                        'População total': 'population'})
+    pop_dist['district'] = normalize_hoods(pop_dist['district'])
+    # I multiply by 1000 due to a formatting error with ',' or '.' as decimal.
+    pop_dist['population'] = pop_dist['population'] * 1000
+    pop_dist = pop_dist.set_index('district')
+
+    # Put them all together
+    pop = pd.concat([pop_cities, pop_dist])
+    
+    return pop
+
+
+def population_report(locations, pop, matcher=None):
+    """
+    Finds the population of each location with one join against pop.
+    Locations missing from pop are matched together to their close match.
+    Inputs:
+        locations = location names.
+        pop = table made by the prepare_pop_data() function.
+        matcher = NameMatcher built from pop.index. Default:
+                  name_matcher('population', pop.index), which uses the
+                  resolution table (see SPCrime.resolutions).
+    Returns a table indexed by LOCATION with the columns:
+        matched = name of the location in pop, or NaN;
+        method = 'exact', 'close' or 'unmatched';
+        population = population of the location, or NaN.
+    """
+    locations = pd.Index(locations, name='LOCATION')
+    population = pop['population'].reindex(locations)
+    matched = np.asarray(locations, dtype=object).copy()
+    method = np.full(len(locations), 'exact', dtype=object)
+
+    missing = population.isna().to_numpy()
+    if missing.any():
+        if matcher is None:
+            matcher = name_matcher('population', pop.index)
+        best_match = matcher.match_many(str(location) for location
+                                        in locations[missing])
+        best_match = np.array(best_match, dtype=object)
+        found = np.array([match is not None for match in best_match],
+                         dtype=bool)
+        matched[missing] = np.where(found, best_match, np.nan)
+        method[missing] = np.where(found, 'close', 'unmatched')
+        population[missing] = pop['population'].reindex(
+            best_match).to_numpy()
+        save_resolutions()
+
+    if current_report() is not None:
+        for outcome, n in pd.Series(method).value_counts().items():
+            count_match('population', outcome, int(n))
+        for location in locations[method == 'unmatched']:
+            count_match('population', 'unmatched', 0, name=location)
+
+    return pd.DataFrame({'matched': matched,
+                         'method': method,
+                         'population': population.to_numpy()},
+                        index=locations)
+
+
+def population_for(locations, pop, matcher=None):
+    """
+    Population of each location. Locations missing from pop get the
+    population of their close match, or NaN (see population_report()).
+    """
+    return population_report(locations, pop, matcher)['population']
+
+
+def rates_from_counts(counts, crime_types, pop, n=10000):
+    """
+    Per capita rates of several crime types.
+    Input:
+        counts = table made by the count_crimes() function.
+        crime_types = list of crime types or CRIME_CATEGORIES.
+        pop = table made by the prepare_pop_data() function.
+    Returns a LOCATION x crime type table. As in single_crime_rates(),
+    locations without crimes of a type have NaN for that type.
+    The population_report() of the locations is kept in
+    rates.attrs['population_report'].
+    """
+    selected = select_crime_types(counts, crime_types)
+    selected = selected[(selected > 0).any(axis=1)]
+    report = population_report(selected.index, pop)
+
+    rates = selected.div(report['population'], axis=0) * n
+    rates = rates.where(selected > 0)
+    rates.attrs['population_report'] = report
+    return rates
+
+
+def rate_calc(series, var_name, pop, n=10000, matcher=None):
+    """
+    Calculate per capita rate of a single Pandas Series.
+    The rate is NaN if the population of the location is unavailable.
+    matcher = NameMatcher built from pop.index. Pass it when calling this
+              function many times.
+    """
+    location = str(series['LOCATION'])
+    population = population_for([location], pop, matcher).iloc[0]
+    absolute = series[var_name]
+    rate = n * (absolute / population)
+    return rate
+
+#%% PART 2 - CRIMINAL DATA: CRIME RATES OF A CRIME FILE
+
+
+def load_crimeDB(crime_db,
+                 districts=None,
+                 premade=False,
+                 cache=True,
+                 workers=1,
+                 save_to=None):
+    """
+    Builds the crime database of the SSP file crime_db, or opens the one
+    saved by a previous run when premade is True.
+    save_to = file to save the database to, when it is missing or older
+              than crime_db: TSV, CSV, Parquet or Feather, by extension
+              (see SPCrime.output). crime_db_file(crime_db) gives the name
+              used by older versions, which always saved it. Default: not
+              saved; the SPCrime cache keeps it for later runs.
+    """
+    if premade == False:
+        crime = build_crimeDB(crime_db,
+                              districts=districts,
+                              cache=cache,
+                              workers=workers)
+        if save_to is not None and (
+                not os.path.exists(save_to)
+                or os.path.getmtime(save_to) < os.path.getmtime(crime_db)):
+            write_table(crime, save_to)
+    else:
+        crime = cached_table('crime_tsv',
+                             lambda: _read_crime_file(crime_db),
+                             sources=[crime_db],
+                             cache=cache)
+    return crime
+
+
+def crime_db_file(crime_db, format='tsv'):
+    """
+    File for the crime database of the SSP file crime_db, next to it:
+    2022.xlsx --> 2022_crimes.tsv.
+    """
+    return output_path(f'{os.path.splitext(crime_db)[0]}_crimes', format)
+
+
+def excel_file(crime_type, crime_db, folder=''):
+    """
+    File for the xlsx copy of a crime rate table in folder (default: the
+    working directory): {crime_type}_{crime_db}.xlsx for a single crime
+    type, multiple_crimes_SP.xlsx for a list of them. Only the file name
+    of crime_db is used, not its folders.
+    """
+    if not isinstance(crime_type, str):
+        return os.path.join(folder, 'multiple_crimes_SP.xlsx')
+    name = os.path.basename(crime_db) if isinstance(crime_db, str) \
+        else 'crimes'
+    return os.path.join(folder, f'{crime_type}_{name}.xlsx')
+
+
+def _read_crime_file(crime_db):
+    file_format = split_extension(crime_db)[0]
+    if file_format == 'parquet':
+        return pd.read_parquet(crime_db)
+    if file_format == 'feather':
+        return pd.read_feather(crime_db)
+    crime = pd.read_csv(crime_db, sep=',' if file_format == 'csv' else '\t')
+    crime = crime.set_index('Unnamed: 0')
+    return crime
+
+
+def load_crime_counts(crime_db,
+                      districts=None,
+                      premade=False,
+                      aggregate=False,
+                      cache=True,
+                      workers=1,
+                      engine='pandas',
+                      save_crime_db=None):
+    """
+    Table of crimes by LOCATION and NATUREZA_APURADA (see count_crimes()).
+    Inputs:
+        crime_db = one of:
+            - the SSP file, or the crime database saved by a previous run
+              if premade is True (see load_crimeDB());
+            - a crime database made by build_crimeDB();
+            - a table made by count_crimes() or build_crime_counts().
+        aggregate = count the SSP file while reading it
+                    (build_crime_counts()). The crime database is neither
+                    built nor saved.
+        workers = number of processes used to read the SSP file.
+        engine = 'pandas' or 'arrow': how the records are counted (see
+                 SPCrime.arrow).
+        save_crime_db = file to save the crime database to, as save_to in
+                        load_crimeDB().
+    """
+    if isinstance(crime_db, pd.DataFrame):
+        if 'NATUREZA_APURADA' in crime_db.columns:
+            return count_crimes(crime_db, engine=engine)
+        if 'LOCATION' in crime_db.columns:
+            return crime_db.set_index('LOCATION')
+        return crime_db
+    if aggregate and not premade:
+        return build_crime_counts(crime_db,
+                                  districts=districts,
+                                  cache=cache,
+                                  workers=workers,
+                                  engine=engine)
+    crime = load_crimeDB(crime_db,
+                         districts=districts,
+                         premade=premade,
+                         cache=cache,
+                         workers=workers,
+                         save_to=save_crime_db)
+    return count_crimes(crime, engine=engine)
+
+
+def single_crime_rates(crime_type,
+                       crime_db,
+                       districts=None,
+                       n_percapita=10000,
+                       premade=False,
+                       save_excel=False,
+                       aggregate=False,
+                       cache=True,
+                       workers=1,
+                       counts=None,
+                       engine='pandas',
+                       save_to=None):
+    """
+    Per capita rate of crime_type, with the crime counts of each location.
+    counts = table made by load_crime_counts(crime_db), if already counted.
+    engine = 'pandas' or 'arrow', as in load_crime_counts().
+    save_to = file to save the table to (see SPCrime.output).
+    save_excel = also save it in the working directory, as
+                 excel_file(crime_type, crime_db).
+    """
+    if counts is None:
+        counts = load_crime_counts(crime_db,
+                                   districts=districts,
+                                   premade=premade,
+                                   aggregate=aggregate,
+                                   cache=cache,
+                                   workers=workers,
+                                   engine=engine)
+    pop = prepare_pop_data(cache=cache)
+
+    rates = rates_from_counts(counts, [crime_type], pop, n=n_percapita)
+    crime_freq = select_crime_types(counts, [crime_type]).loc[rates.index]
+    crime_freq[f'{crime_type}_rate'] = rates[crime_type]
+    crime_freq = crime_freq.reset_index()
+    crime_freq.attrs['population_report'] = rates.attrs['population_report']
+
+    if save_excel == True:
+        write_table(crime_freq, excel_file(crime_type, crime_db))
+    write_table(crime_freq, save_to)
+    return crime_freq
+
+
+def multiple_crime_rates(crime_types,
+                         crime_db,
+                         districts=None,
+                         n_percapita=10000,
+                         premade=False,
+                         save_excel=False,
+                         aggregate=False,
+                         cache=True,
+                         workers=1,
+                         counts=None,
+                         engine='pandas',
+                         save_to=None):
+    """
+    Per capita rates of all crime_types, computed from a single count of
+    the crime database. crime_db can be any input of load_crime_counts().
+    counts = table made by load_crime_counts(crime_db), if already counted.
+    engine = 'pandas' or 'arrow', as in load_crime_counts().
+    save_to = file to save the table to (see SPCrime.output).
+    save_excel = also save it in the working directory, as
+                 excel_file(crime_types, crime_db).
+    """
+    def build():
+        if counts is None:
+            crime_counts = load_crime_counts(crime_db,
+                                             districts=districts,
+                                             premade=premade,
+                                             aggregate=aggregate,
+                                             cache=cache,
+                                             workers=workers,
+                                             engine=engine)
+        else:
+            crime_counts = counts
+        pop = prepare_pop_data(cache=cache)
+        return rates_from_counts(crime_counts,
+                                 crime_types,
+                                 pop,
+                                 n=n_percapita)
+
+    crime_table = cached_table('rates',
+                               build,
+                               sources=[crime_db, districts, DISTRICTS_SOURCE,
+                                        *POP_SOURCES, manual_resolutions(),
+                                        counts],
+                               cache=cache,
+                               crime_types=list(crime_types),
+                               n_percapita=n_percapita,
+                               premade=premade)
+    if 'population_report' not in crime_table.attrs:
+        # Tables read from the cache have no attrs.
+        crime_table.attrs['population_report'] = population_report(
+            crime_table.index, prepare_pop_data(cache=cache))
+
+    if save_excel == True:
+        write_table(crime_table, excel_file(crime_types, crime_db))
+    write_table(crime_table, save_to)
+
+    return crime_table
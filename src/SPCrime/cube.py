@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Crime counts and rates of several SSP years.
+
+A CrimeCube keeps, in a folder, the table of crimes by LOCATION and
+NATUREZA_APURADA of each year (see build_crime_counts()), plus a manifest
+with the digest of the file each year was built from. When the cube is
+updated, only the years whose file, district table, normalization rules or
+package version changed are processed again.
+
+Rates are computed from the counts when asked for, with the population of
+each year (default: the bundled population table).
+"""
+
+# Standard libraries
+import json
+import os
+import shutil
+import time
+
+# Matrices and dataframes
+import pandas as pd
+
+import SPCrime
+from SPCrime.cache import source_digest
+from SPCrime.columnar import is_frame, read_frame, write_frame
+from SPCrime.normalize import NORM_RULES_VERSION
+from SPCrime.resolutions import manual_resolutions
+from SPCrime.crime import (DISTRICTS_SOURCE, build_crime_counts,
+                           prepare_pop_data, rates_from_counts,
+                           select_crime_types)
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+class CrimeCube:
+    """
+    Location x year x crime type counts, saved in the folder path.
+    Usage:
+        cube = CrimeCube('crime_cube')
+        cube.update({2022: 'SPDadosCriminais_2022.xlsx',
+                     2023: 'SPDadosCriminais_2023.xlsx'})
+        cube.rates(['THEFT', 'CVI'])
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = self._read_manifest()
+
+    def __repr__(self):
+        return f'CrimeCube({self.path!r}, years={self.years})'
+
+    @property
+    def years(self):
+        """Years in the cube, in order."""
+        return sorted(int(year) for year in self.manifest['years'])
+
+    def _manifest_path(self):
+        return os.path.join(self.path, MANIFEST_NAME)
+
+    def _counts_path(self, year):
+        return os.path.join(self.path, 'counts', str(year))
+
+    def _pop_path(self, year):
+        return os.path.join(self.path, 'population', str(year))
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path(), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'years': {}}
+
+    def _write_manifest(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f'{self._manifest_path()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self._manifest_path())
+
+    def _signature(self, file, districts):
+        """What the counts of a year depend on."""
+        return {'source': source_digest(file),
+                'districts': source_digest(DISTRICTS_SOURCE
+                                           if districts is None
+                                           else districts),
+                'resolutions': source_digest(
+                    manual_resolutions('district')),
+                'rules': NORM_RULES_VERSION,
+                'package': SPCrime.__version__}
+
+    def update(self,
+               files,
+               populations=None,
+               districts=None,
+               workers=1,
+               cache=True,
+               engine='pandas'):
+        """
+        Adds years to the cube, or updates them.
+        Inputs:
+            files = dictionary year --> SSP crime database (.xlsx).
+            populations = dictionary year --> population table, as made by
+                          prepare_pop_data(). Years without one use the
+                          bundled population table.
+            districts = table opened by the open_dist_dict() function.
+            workers = number of processes used to read each file.
+            cache = also use the SPCrime cache (see build_crime_counts()).
+            engine = 'pandas' or 'arrow', as in build_crime_counts().
+        Returns the list of years whose counts were built.
+        """
+        populations = populations or {}
+        built = []
+        for year, file in sorted(files.items()):
+            year = int(year)
+            signature = self._signature(file, districts)
+            if signature['source'] is None:
+                raise ValueError(f'Cannot read the crime file of {year}: '
+                                 f'{file}')
+            entry = self.manifest['years'].get(str(year), {})
+
+            if (entry.get('signature') != signature
+                    or not is_frame(self._counts_path(year))):
+                counts = build_crime_counts(file,
+                                            districts=districts,
+                                            cache=cache,
+                                            workers=workers,
+                                            engine=engine)
+                write_frame(counts, self._counts_path(year))
+                entry = {'file': str(file),
+                         'signature': signature,
+                         'built': time.time()}
+                built.append(year)
+
+            entry['population'] = self._set_population(year,
+                                                       populations.get(year))
+            self.manifest['years'][str(year)] = entry
+            self._write_manifest()
+        return built
+
+    def _set_population(self, year, pop):
+        """Saves the population table of a year. Returns its digest."""
+        if pop is None:
+            shutil.rmtree(self._pop_path(year), ignore_errors=True)
+            return 'bundled'
+        digest = source_digest(pop)
+        entry = self.manifest['years'].get(str(year), {})
+        if (entry.get('population') != digest
+                or not is_frame(self._pop_path(year))):
+            write_frame(pop, self._pop_path(year))
+        return digest
+
+    def remove(self, year):
+        """Removes a year from the cube."""
+        self.manifest['years'].pop(str(year), None)
+        self._write_manifest()
+        shutil.rmtree(self._counts_path(year), ignore_errors=True)
+        shutil.rmtree(self._pop_path(year), ignore_errors=True)
+
+    def _check_years(self, years):
+        if years is None:
+            return self.years
+        missing = set(years) - set(self.years)
+        if missing:
+            raise KeyError(f'Years not in the cube: {sorted(missing)}')
+        return list(years)
+
+    def year_counts(self, year):
+        """Table of crimes by LOCATION and NATUREZA_APURADA of a year."""
+        self._check_years([year])
+        return read_frame(self._counts_path(year))
+
+    def population(self, year):
+        """Population table used for the rates of a year."""
+        self._check_years([year])
+        if self.manifest['years'][str(year)]['population'] == 'bundled':
+            return prepare_pop_data()
+        return read_frame(self._pop_path(year))
+
+    def counts(self, crime_types=None, years=None):
+        """
+        Crime counts of all years, indexed by (LOCATION, YEAR).
+        Inputs:
+            crime_types = list of crime types or CRIME_CATEGORIES. Default:
+                          every NATUREZA_APURADA.
+            years = years to include. Default: all.
+        """
+        years = self._check_years(years)
+        tables = []
+        for year in years:
+            counts = self.year_counts(year)
+            if crime_types is not None:
+                counts = select_crime_types(counts, crime_types)
+            tables.append(counts)
+        return _stack_years(tables, years).fillna(0).astype('int64')
+
+    def rates(self, crime_types, n_percapita=10000, years=None):
+        """
+        Per capita rates of crime_types, indexed by (LOCATION, YEAR). Each
+        year uses its own population table. As in multiple_crime_rates(),
+        locations without crimes of a type in a year have NaN.
+        The population reports are kept in rates.attrs['population_report'].
+        """
+        years = self._check_years(years)
+        tables = []
+        reports = []
+        for year in years:
+            rates = rates_from_counts(self.year_counts(year),
+                                      crime_types,
+                                      self.population(year),
+                                      n=n_percapita)
+            tables.append(rates)
+            reports.append(rates.attrs['population_report'])
+        rates = _stack_years(tables, years)
+        rates.attrs['population_report'] = _stack_years(reports, years)
+        return rates
+
+
+def _stack_years(tables, years):
+    """Tables indexed by LOCATION as one table indexed by (LOCATION, YEAR)."""
+    if not tables:
+        index = pd.MultiIndex.from_arrays([[], []], names=['LOCATION', 'YEAR'])
+        return pd.DataFrame(index=index)
+    for table in tables:
+        table.attrs = {}
+    stacked = pd.concat(tables, keys=years, names=['YEAR'])
+    stacked = stacked.reorder_levels(['LOCATION', 'YEAR'])
+    return stacked.sort_index()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Crime exposure in a time window around each patient's date.
+
+The daily counts made by build_daily_counts() are turned into cumulative
+counts per location and day (one array per crime type). The number of
+crimes of a location between two days is then the difference of two array
+values, so millions of patient windows are counted without filtering the
+crime table.
+"""
+
+# Matrices and dataframes
+import pandas as pd
+import numpy as np
+
+from SPCrime.crime import CRIME_CATEGORIES
+from SPCrime.patients import patient_locations
+
+
+class CrimeWindows:
+    """
+    Number of crimes of each location in windows of days.
+    Inputs:
+        daily = table made by the build_daily_counts() function.
+        crime_types = list of crime types or CRIME_CATEGORIES.
+    """
+
+    def __init__(self, daily, crime_types):
+        self.crime_types = list(crime_types)
+        self.locations = pd.Index(sorted(daily['LOCATION'].dropna().unique()),
+                                  name='LOCATION')
+
+        days = daily['DATE'].to_numpy(dtype='datetime64[D]')
+        if len(days):
+            self.first_day = days.min()
+            n_days = int((days.max() - self.first_day).astype(np.int64)) + 1
+        else:
+            self.first_day = np.datetime64('NaT', 'D')
+            n_days = 0
+        self.n_days = n_days
+
+        loc_codes = self.locations.get_indexer(daily['LOCATION'])
+        day_codes = (days - self.first_day).astype(np.int64)
+        counts = daily['count'].to_numpy(dtype=np.int64)
+        cells = loc_codes.astype(np.int64) * n_days + day_codes
+
+        # cumulative[k, location, day] = crimes of type k before that day.
+        shape = (len(self.crime_types), len(self.locations), n_days + 1)
+        self.cumulative = np.zeros(shape, dtype=np.int64)
+        for k, crime_type in enumerate(self.crime_types):
+            members = CRIME_CATEGORIES.get(crime_type, [crime_type])
+            keep = daily['NATUREZA_APURADA'].isin(members).to_numpy()
+            keep = keep & (loc_codes >= 0)
+            per_day = np.bincount(cells[keep],
+                                  weights=counts[keep],
+                                  minlength=len(self.locations) * n_days)
+            per_day = per_day.astype(np.int64).reshape(len(self.locations),
+                                                       n_days)
+            np.cumsum(per_day, axis=1, out=self.cumulative[k, :, 1:])
+
+    def __repr__(self):
+        return (f'CrimeWindows({len(self.locations)} locations, '
+                f'{self.n_days} days, {self.crime_types})')
+
+    def _day_codes(self, dates):
+        days = pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[D]')
+        missing = np.isnat(days)
+        codes = np.zeros(len(days), dtype=np.int64)
+        codes[~missing] = (days[~missing] - self.first_day).astype(np.int64)
+        return codes, missing
+
+    def count(self, locations, dates, days=90, offset=0):
+        """
+        Number of crimes of each location in the days before each date.
+        Inputs:
+            locations = LOCATION of each query.
+            dates = date of each query.
+            days = length of the window.
+            offset = days between the end of the window and the date. With
+                     0, the window is [date - days, date), not including
+                     the date itself.
+        Returns a table with a column per crime type. Queries with an
+        unknown location or a missing date give NaN, as do windows entirely
+        outside the period of the crime data (no data is not the same as
+        no crimes). Other windows are cut at the first and last days of the
+        crime data.
+        """
+        loc_codes = self.locations.get_indexer(pd.Index(locations))
+        day_codes, missing = self._day_codes(dates)
+
+        end = day_codes - offset
+        start = end - days
+        covered = (end > 0) & (start < self.n_days)
+        end = np.clip(end, 0, self.n_days)
+        start = np.clip(start, 0, self.n_days)
+        valid = (loc_codes >= 0) & ~missing & covered
+        loc_codes = np.where(valid, loc_codes, 0)
+        end = np.where(valid, end, 0)
+        start = np.where(valid, start, 0)
+
+        table = {}
+        for k, crime_type in enumerate(self.crime_types):
+            if len(self.locations):
+                cumulative = self.cumulative[k]
+                counts = (cumulative[loc_codes, end]
+                          - cumulative[loc_codes, start]).astype(float)
+            else:
+                counts = np.zeros(len(loc_codes))
+            counts[~valid] = np.nan
+            table[crime_type] = counts
+        return pd.DataFrame(table)
+
+
+def add_crime_exposure(df, date_col, crime_types, daily, days=90, offset=0):
+    """
+    Adds to the patient table the number of crimes in the patient's
+    location in the days before the patient's date, with a column
+    '{crime type}_{days}d' per crime type.
+    Inputs:
+        df = table made by the mapCEP() function, after prepare_patientDB().
+        date_col = name of the column with the patients' dates.
+        crime_types = list of crime types or CRIME_CATEGORIES.
+        daily = table made by build_daily_counts(), or a CrimeWindows.
+        days, offset = see CrimeWindows.count().
+    """
+    windows = daily
+    if not isinstance(windows, CrimeWindows):
+        windows = CrimeWindows(daily, crime_types)
+    counts = windows.count(patient_locations(df),
+                           df[date_col],
+                           days=days,
+                           offset=offset)
+    counts = counts[list(crime_types)]
+    counts.columns = [f'{crime_type}_{days}d' for crime_type in crime_types]
+    counts.index = df.index
+
+    df = df.drop(columns=counts.columns, errors='ignore')
+    return pd.concat([df, counts], axis=1)
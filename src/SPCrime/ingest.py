@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming reader of the SSP crime workbooks.
+
+The SSP files have about a million records split in several sheets, with
+dozens of columns. Instead of loading whole sheets, the workbook is read
+row by row (openpyxl read-only mode), only the needed columns are kept,
+and records are handed over in batches of fixed size. The batches are
+dictionary-encoded (categorical) as they arrive, so the memory used does
+not depend on the number of columns of the workbook.
+"""
+
+# Standard libraries
+from itertools import chain
+from operator import itemgetter
+
+# Matrices and dataframes
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+# Columns used by SPCrime.
+CRIME_COLUMNS = ['CIDADE', 'BAIRRO', 'NATUREZA_APURADA']
+
+# Date of occurrence, used for the daily counts.
+DATE_COLUMN = 'DATA_OCORRENCIA_BO'
+
+# Number of records per batch.
+BATCH_SIZE = 100_000
+
+
+def _header_positions(header, columns):
+    """Position of each column in the header row, or None if one is absent."""
+    names = {}
+    for i, name in enumerate(header):
+        if name is not None:
+            names.setdefault(str(name).strip().upper(), i)
+    try:
+        return [names[column.upper()] for column in columns]
+    except KeyError:
+        return None
+
+
+def open_workbook(file):
+    """
+    Opens the workbook in read-only mode. openpyxl is imported the first
+    time a workbook is opened.
+    """
+    from openpyxl import load_workbook
+    return load_workbook(file, read_only=True, data_only=True)
+
+
+def sheet_names(file):
+    """Names of the sheets of the workbook, in order."""
+    workbook = open_workbook(file)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def iter_crime_rows(file,
+                    columns=CRIME_COLUMNS,
+                    batch_size=BATCH_SIZE,
+                    sheets=None):
+    """
+    Reads the SSP crime workbook in batches of rows.
+    Inputs:
+        file = path or file object of the .xlsx workbook.
+        columns = names of the columns to keep (first row of each sheet).
+        batch_size = maximum number of records per batch.
+        sheets = names of the sheets to read. Default: all.
+    Yields lists of tuples with the values of the requested columns. Every
+    sheet that has these columns is read; the others are skipped. A batch
+    never spans two sheets.
+    """
+    workbook = open_workbook(file)
+    try:
+        found = False
+        worksheets = workbook.worksheets
+        if sheets is not None:
+            worksheets = [workbook[name] for name in sheets]
+        for sheet in worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            positions = _header_positions(header or (), columns)
+            if positions is None:
+                continue
+            found = True
+
+            if len(positions) == 1:
+                position = positions[0]
+                project = lambda row: (row[position],)  # noqa: E731
+            else:
+                project = itemgetter(*positions)
+            width = max(positions) + 1
+
+            batch = []
+            for row in rows:
+                if not any(value is not None for value in row):
+                    continue
+                if len(row) < width:
+                    row = row + (None,) * (width - len(row))
+                batch.append(project(row))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+    finally:
+        workbook.close()
+
+    if not found:
+        raise ValueError(f'No sheet of {file} has the columns {columns}')
+
+
+def iter_crime_batches(file,
+                       columns=CRIME_COLUMNS,
+                       batch_size=BATCH_SIZE,
+                       sheets=None):
+    """
+    Reads the SSP crime workbook in batches, as iter_crime_rows().
+    Yields tables with the requested columns.
+    """
+    for rows in iter_crime_rows(file, columns, batch_size, sheets):
+        yield pd.DataFrame(rows, columns=columns)
+
+
+def start_batches(batches):
+    """
+    Reads the first batch of iter_crime_batches() or iter_crime_rows(), so
+    that the ValueError of a workbook without the columns is raised here,
+    and not by an error later in the code using the batches.
+    Returns an iterator over all the batches.
+    """
+    first = next(batches, None)
+    if first is None:
+        return iter(())
+    return chain([first], batches)
+
+
+def encode_batch(batch):
+    """Batch with every text column as categorical."""
+    batch = batch.copy()
+    for column in batch.columns:
+        dtype = batch[column].dtype
+        if (pd.api.types.is_object_dtype(dtype)
+                or pd.api.types.is_string_dtype(dtype)):
+            batch[column] = batch[column].astype('category')
+    return batch
+
+
+def concat_batches(batches, columns=CRIME_COLUMNS, encode=True):
+    """
+    Joins batches from iter_crime_batches() in one table. Text columns stay
+    categorical, with categories merged across batches.
+    encode = False to keep the text columns that are not categorical as
+             they are.
+    """
+    parts = {column: [] for column in columns}
+    for batch in batches:
+        if encode:
+            batch = encode_batch(batch)
+        for column in columns:
+            parts[column].append(batch[column])
+
+    table = {}
+    for column in columns:
+        table[column] = _concat_column(parts[column])
+    return pd.DataFrame(table)
+
+
+def _concat_column(values):
+    if not values:
+        return pd.Series([], dtype=object)
+    if all(isinstance(value.dtype, pd.CategoricalDtype) for value in values):
+        try:
+            return pd.Series(union_categoricals(values))
+        except TypeError:
+            # Categories of different types, like numbers and text.
+            values = [value.astype(object) for value in values]
+            joined = pd.concat(values, ignore_index=True)
+            return joined.astype('category')
+    # Columns that were empty in some batches.
+    if any(value.dtype != values[0].dtype for value in values):
+        values = [value.astype(object) for value in values]
+    return pd.concat(values, ignore_index=True)
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Resident lookup of crime rates by postal code.
+
+A CrimeLookup loads the CEP index, the district table and a crime rate
+table once, and then answers queries without touching the disk: the
+address, district and crime rates of a postal code (lookup()) or of many
+(lookup_many()). Everything is prepared when the object is created, so
+queries only read shared data and can be made from several threads.
+
+It can also be run as a small server, so that other processes use one
+loaded instance:
+
+    python -m SPCrime.lookup SPDadosCriminais_2022.xlsx THEFT CVI
+    python -m SPCrime.lookup SPDadosCriminais_2022.xlsx THEFT --http 8000
+
+The first form reads one postal code per line from stdin and writes one
+JSON object per line to stdout. The second serves
+GET /lookup?cep=01310100 and POST /lookup (JSON list of postal codes).
+"""
+
+# Standard libraries
+import argparse
+import json
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Matrices and dataframes
+import pandas as pd
+import numpy as np
+
+from SPCrime.cepindex import (CEPIndex, PrefixResolver, is_cep_index,
+                              load_cep_index)
+from SPCrime.cep import (cep_places, open_cep, open_dist_dict, validate_cep,
+                         validate_one_cep)
+from SPCrime.crime import multiple_crime_rates
+from SPCrime.normalize import normalize_cities, normalize_hoods, take_codes
+from SPCrime.patients import rate_columns
+
+
+def _crime_types(crime_rates):
+    """Crime types of a table made by single or multiple_crime_rates()."""
+    columns = [str(column) for column in crime_rates.columns]
+    rate_names = [column[:-len('_rate')] for column in columns
+                  if column.endswith('_rate')]
+    if rate_names:
+        return rate_names
+    return [column for column in columns if column != 'LOCATION']
+
+
+class CrimeLookup:
+    """
+    Address, district and crime rates of postal codes.
+    Inputs:
+        crime_rates = table made by single_crime_rates() or
+                      multiple_crime_rates().
+        crime_types = crime types to report. Default: all in crime_rates.
+        cep = CEPIndex, path to a compiled index, or table made by
+              build_cepDB(). Default: the bundled CEP index.
+        districts = table opened by the open_dist_dict() function.
+        start, autocorrect = see validate_cep().
+        cache = use the SPCrime cache to open the CEP index.
+        cep_fallback = give the city, district and rates of the CEPs
+                       missing from the index from their first digits
+                       (see fill_by_prefix()).
+    """
+
+    def __init__(self,
+                 crime_rates,
+                 crime_types=None,
+                 cep=None,
+                 districts=None,
+                 start=[0, 1],
+                 autocorrect=False,
+                 cache=True,
+                 cep_fallback=False):
+        if crime_types is None:
+            crime_types = _crime_types(crime_rates)
+        self.crime_types = list(crime_types)
+        self.start = start
+        self.autocorrect = autocorrect
+
+        if cep is None:
+            cep = open_cep(cache=cache)
+        elif isinstance(cep, pd.DataFrame):
+            cep = CEPIndex.from_table(cep)
+        elif not isinstance(cep, CEPIndex):
+            if not is_cep_index(cep):
+                raise ValueError(f'Not a compiled CEP index: {cep}')
+            cep = load_cep_index(cep)
+        self.index = cep
+
+        if districts is None:
+            districts = open_dist_dict()
+        rates = rate_columns(crime_rates, self.crime_types)
+        self.rate_names = list(rates.columns)
+        self._prepare_places(districts, rates, cep_fallback)
+
+    @classmethod
+    def build(cls,
+              crime_types,
+              crime_db,
+              n_percapita=10000,
+              premade=False,
+              aggregate=True,
+              cache=True,
+              workers=1,
+              **kwargs):
+        """
+        CrimeLookup with the rates of crime_types computed from crime_db
+        (see multiple_crime_rates()). Other arguments go to CrimeLookup().
+        """
+        crime_rates = multiple_crime_rates(crime_types,
+                                           crime_db,
+                                           n_percapita=n_percapita,
+                                           premade=premade,
+                                           aggregate=aggregate,
+                                           cache=cache,
+                                           workers=workers)
+        return cls(crime_rates, crime_types=crime_types, cache=cache,
+                   **kwargs)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return (f'CrimeLookup({len(self.index)} CEPs, '
+                f'{len(self._places)} places, {self.crime_types})')
+
+    def _prepare_places(self, districts, rates, cep_fallback=False):
+        """
+        Resolves every (bairro, cidade) pair of the CEP index once, the way
+        mapCEP() and CEP2crime() do. With cep_fallback, also every place
+        that fill_by_prefix() can give to a CEP missing from the index;
+        these places come after the others in self._places.
+        """
+        bairro = np.asarray(self.index.codes('bairro'), dtype=np.int64)
+        cidade = np.asarray(self.index.codes('cidade'), dtype=np.int64)
+        n_cidade = int(cidade.max()) + 2 if len(cidade) else 1
+        self._place_of_row, pairs = pd.factorize((bairro + 1) * n_cidade
+                                                 + cidade + 1)
+        pair_bairro = pairs // n_cidade - 1
+        pair_cidade = pairs % n_cidade - 1
+
+        places = pd.DataFrame({
+            'neighbourhood': self.index.decode('bairro', pair_bairro),
+            'city': self.index.decode('cidade', pair_cidade)})
+        places['neighbourhood'] = normalize_hoods(places['neighbourhood'])
+
+        dist_map = districts.drop_duplicates(subset='neighbourhood')
+        dist_map = dist_map.set_index('neighbourhood')['district']
+        district = places['neighbourhood'].map(dist_map)
+        places['district'] = district.where(places['city'] == 'São Paulo')
+
+        self._n_exact = len(places)
+        self._resolver = None
+        if cep_fallback:
+            values, fallback = cep_places(self.index, districts)
+            self._resolver = PrefixResolver(self.index, values)
+            fallback = fallback.astype(object)
+            fallback.insert(0, 'neighbourhood', np.nan)
+            places = pd.concat([places, fallback], ignore_index=True)
+
+        # Names as in the output of SPCrime().
+        places['district'] = normalize_hoods(places['district'])
+        places['city'] = normalize_cities(places['city'])
+        places['LOCATION'] = np.where(places['city'] == 'sao paulo',
+                                      places['district'],
+                                      places['city'])
+        positions = rates.index.get_indexer(places['LOCATION'])
+        for name in self.rate_names:
+            values = np.append(rates[name].to_numpy(dtype=float), np.nan)
+            places[name] = values[positions]
+
+        self._places = places
+        # One dictionary per place for single queries.
+        self._place_records = places.to_dict('records')
+        self._empty = dict.fromkeys(['street'] + list(places.columns),
+                                    np.nan)
+        self._empty['cep_match'] = 'none'
+
+    def lookup(self, cep):
+        """
+        Address, district and crime rates of a single postal code.
+        Returns a dictionary with the keys cep, status (see
+        validate_cep()), street, neighbourhood, city, district, LOCATION,
+        a '{crime type}_rate' key per crime type and cep_match (see
+        fill_by_prefix()). Values are NaN if the postal code is not found.
+        """
+        text, status = validate_one_cep(cep, start=self.start,
+                                        autocorrect=self.autocorrect)
+        # Only postal codes of 8 digits can be in the index or resolved
+        # by their prefixes.
+        if status not in ('ok', 'corrected', 'wrong region'):
+            return {'cep': text, 'status': status, **self._empty}
+        key = int(text)
+        row = self.index.find_one(key)
+        if row < 0:
+            if self._resolver is not None:
+                place, match = self._resolver.resolve_one(key)
+                if place >= 0:
+                    place = self._place_records[self._n_exact + place]
+                    return {'cep': text, 'status': status, 'street': np.nan,
+                            **place, 'cep_match': match}
+            return {'cep': text, 'status': status, **self._empty}
+
+        place = self._place_records[self._place_of_row[row]]
+        street = self.index.entry('rua', int(self.index.codes('rua')[row]))
+        return {'cep': text, 'status': status, 'street': street, **place,
+                'cep_match': 'exact'}
+
+    def lookup_many(self, ceps):
+        """
+        lookup() for a list or Series of postal codes. Returns a table
+        aligned with ceps.
+        """
+        checked = validate_cep(pd.Series(ceps), start=self.start,
+                               autocorrect=self.autocorrect)
+        rows = self.index.positions(checked['cep'])
+        found = rows >= 0
+        places = np.full(len(rows), -1, dtype=np.int64)
+        places[found] = self._place_of_row[rows[found]]
+        streets = np.full(len(rows), -1, dtype=np.int64)
+        streets[found] = self.index.codes('rua')[rows[found]]
+        match = pd.Categorical(np.where(found, 'exact', 'none'),
+                               categories=['exact', 'sector', 'subregion',
+                                           'none'])
+
+        lost = ~found & checked['cep'].notna().to_numpy()
+        if self._resolver is not None and lost.any():
+            place, match_lost = self._resolver.resolve(
+                checked['cep'][lost])
+            match[lost] = match_lost
+            places[np.flatnonzero(lost)[place >= 0]] = (
+                self._n_exact + place[place >= 0])
+
+        table = {'cep': checked['cep'].to_numpy(),
+                 'status': checked['status'].to_numpy(),
+                 'street': self.index.decode('rua', streets)}
+        for column in self._places.columns:
+            values = self._places[column].to_numpy()
+            if values.dtype.kind == 'f':
+                table[column] = np.append(values, np.nan)[places]
+            else:
+                table[column] = take_codes(values, places)
+        table['cep_match'] = match
+        return pd.DataFrame(table, index=checked.index)
+
+
+#%% FRONT END
+
+
+def _to_json(record):
+    """Result of lookup() as a JSON line."""
+    record = {key: None if pd.isna(value) else value
+              for key, value in record.items()}
+    return json.dumps(record, ensure_ascii=False)
+
+
+def serve_lines(crime_lookup, lines=None, out=None):
+    """
+    Answers one postal code per line with one JSON object per line.
+    Default: reads stdin and writes stdout.
+    """
+    lines = sys.stdin if lines is None else lines
+    out = sys.stdout if out is None else out
+    for line in lines:
+        cep = line.strip()
+        if not cep:
+            continue
+        out.write(_to_json(crime_lookup.lookup(cep)) + '\n')
+        out.flush()
+
+
+def make_server(crime_lookup, host='127.0.0.1', port=8000):
+    """
+    HTTP server answering GET /lookup?cep=... with a JSON object and
+    POST /lookup, with a JSON list of postal codes, with a JSON list.
+    Call serve_forever() on the result to start it.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, code, body):
+            data = body.encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            ceps = parse_qs(url.query).get('cep')
+            if url.path != '/lookup' or not ceps:
+                self._send(404, '{"error": "use /lookup?cep=..."}')
+                return
+            self._send(200, _to_json(crime_lookup.lookup(ceps[0])))
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/lookup':
+                self._send(404, '{"error": "use /lookup"}')
+                return
+            size = int(self.headers.get('Content-Length', 0))
+            try:
+                ceps = json.loads(self.rfile.read(size) or b'[]')
+            except ValueError:
+                self._send(400, '{"error": "expected a JSON list"}')
+                return
+            table = crime_lookup.lookup_many(pd.Series(ceps, dtype=object))
+            records = [_to_json(record) for record
+                       in table.to_dict('records')]
+            self._send(200, '[' + ', '.join(records) + ']')
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m SPCrime.lookup',
+        description='Crime rates by postal code, from a loaded instance.')
+    parser.add_argument('crime_db', help='SSP crime database (.xlsx), or '
+                        'the TSV of a previous run with --premade')
+    parser.add_argument('crime_types', nargs='+')
+    parser.add_argument('--premade', action='store_true')
+    parser.add_argument('--n-percapita', type=int, default=10000)
+    parser.add_argument('--cep-path', default=None,
+                        help='compiled CEP index')
+    parser.add_argument('--autocorrect', type=int, choices=[0, 1],
+                        default=None)
+    parser.add_argument('--http', type=int, metavar='PORT', default=None,
+                        help='serve HTTP on this port instead of stdin')
+    parser.add_argument('--host', default='127.0.0.1')
+    args = parser.parse_args(argv)
+
+    crime_lookup = CrimeLookup.build(
+        args.crime_types,
+        args.crime_db,
+        n_percapita=args.n_percapita,
+        premade=args.premade,
+        cep=args.cep_path,
+        autocorrect=False if args.autocorrect is None else args.autocorrect)
+
+    if args.http is None:
+        serve_lines(crime_lookup)
+    else:
+        server = make_server(crime_lookup, args.host, args.http)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Approximate matching of location names.
+
+The matcher returns the same best match as difflib.get_close_matches(n=1),
+but it avoids a full scan of the candidates. Each candidate name is indexed
+by its length and its character counts. These two give upper bounds of the
+difflib ratio, the same ones used by real_quick_ratio() and quick_ratio().
+Candidates are compared in decreasing order of their bound, and the exact
+ratio is computed only while a candidate can still beat the best match.
+"""
+
+# Standard libraries
+from difflib import SequenceMatcher
+
+# Matrices and dataframes
+import numpy as np
+
+
+class NameMatcher:
+    """
+    Index of candidate names for approximate matching.
+
+    Inputs:
+        possibilities = iterable of candidate names (strings). Missing
+                        values and duplicates are ignored.
+        cutoff = minimum similarity score, as in difflib (0 to 1).
+    """
+
+    def __init__(self, possibilities, cutoff=0.6):
+        if not 0.0 <= cutoff <= 1.0:
+            raise ValueError(f'cutoff must be in [0.0, 1.0]: {cutoff}')
+        self.cutoff = cutoff
+
+        names = []
+        seen = set()
+        for name in possibilities:
+            if isinstance(name, str) and name not in seen:
+                seen.add(name)
+                names.append(name)
+        self.names = names
+        self._known = seen
+
+        # Character count profile of every candidate.
+        alphabet = sorted({char for name in names for char in name})
+        self._alphabet = {char: i for i, char in enumerate(alphabet)}
+        counts = np.zeros((len(names), len(alphabet)), dtype=np.int32)
+        for row, name in enumerate(names):
+            for char in name:
+                counts[row, self._alphabet[char]] += 1
+        self._counts = counts
+        self._lengths = np.array([len(name) for name in names], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._known
+
+    def _profile(self, word):
+        profile = np.zeros(len(self._alphabet), dtype=np.int32)
+        for char in word:
+            i = self._alphabet.get(char)
+            if i is not None:
+                profile[i] += 1
+        return profile
+
+    def match_score(self, word):
+        """
+        Returns (best match, score), or (None, 0.0) if no candidate reaches
+        the cutoff.
+        """
+        if not isinstance(word, str) or not self.names:
+            return None, 0.0
+        if word in self._known:
+            return word, 1.0
+
+        total = self._lengths + len(word)
+        # Same upper bounds as real_quick_ratio() and quick_ratio().
+        upper = np.minimum(self._lengths, len(word))
+        common = np.minimum(self._counts, self._profile(word)).sum(axis=1)
+        upper = np.minimum(upper, common)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bound = np.where(total > 0, 2.0 * upper / total, 1.0)
+
+        candidates = np.flatnonzero(bound >= self.cutoff)
+        candidates = candidates[np.argsort(-bound[candidates], kind='stable')]
+
+        matcher = SequenceMatcher()
+        matcher.set_seq2(word)
+        best, best_score = None, 0.0
+        for i in candidates:
+            if bound[i] < best_score:
+                break
+            name = self.names[i]
+            matcher.set_seq1(name)
+            score = matcher.ratio()
+            if score < self.cutoff:
+                continue
+            # difflib keeps the largest (score, name) tuple.
+            if (score, name) > (best_score, best or ''):
+                best, best_score = name, score
+        return best, best_score
+
+    def match(self, word):
+        """Returns the closest candidate to word, or None."""
+        return self.match_score(word)[0]
+
+    def match_many(self, words):
+        """
+        Returns the closest candidate for each word, as a list.
+        Repeated words are matched only once.
+        """
+        found = {}
+        result = []
+        for word in words:
+            try:
+                best = found[word]
+            except KeyError:
+                best = found[word] = self.match(word)
+            except TypeError:
+                best = None
+            result.append(best)
+        return result
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Normalization of neighbourhood and city names.
+
+All the rewriting rules (abbreviations and aliases) are kept in RULES.
+Change NORM_RULES_VERSION whenever a rule changes: it identifies the tables
+that were built with a given set of rules.
+
+Names repeat a lot (millions of crime records, few thousand places), so:
+- Series are normalized once per distinct value (normalize_hoods(),
+  normalize_cities()), and categorical Series stay categorical;
+- the scalar functions keep a bounded memo of recent names.
+"""
+
+# Standard libraries
+from functools import lru_cache
+
+# Matrices and dataframes
+import pandas as pd
+import numpy as np
+
+
+NORM_RULES_VERSION = 1
+
+# Number of distinct names remembered by each normalization function.
+NORM_CACHE_SIZE = 2**17
+
+RULES = {
+    # (only if the name starts with, old, new). Applied in order, after
+    # norm_hood(); every occurrence of old is replaced.
+    'hood_abbreviations': [('j ', 'j ', 'jardim '),      # Jardim
+                           (None, 'vl. ', 'vila '),      # Vila
+                           ('vl ', 'vl ', 'vila ')],
+    # Applied to the raw SSP city names, before removing accents.
+    # This gives errors because s. can stand for "sao", "santo" and "santa".
+    # But I kept like this and used close match later. It worked.
+    'city_abbreviations': [(None, 'S.', 'sao '),
+                           (None, ' (SP)', '')],
+    # There are four towns that are also the name of a São Paulo City
+    # district. Here I identify them as separate cities.
+    'city_aliases': {name: f'{name} (cidade)'
+                     for name in ['jose bonifacio', 'pedreira', 'socorro',
+                                  'tremembe']},
+    # SSP neighbourhood names that differ from the district table.
+    'crime_hood_aliases': {'centro historico de sao paulo': 'centro'},
+}
+
+
+def _compile(rules):
+    """Rules as tuples, the form used by the normalization functions."""
+    return {'hood_abbreviations': tuple(rules['hood_abbreviations']),
+            'city_abbreviations': tuple(rules['city_abbreviations']),
+            'city_aliases': dict(rules['city_aliases']),
+            'crime_hood_aliases': dict(rules['crime_hood_aliases'])}
+
+
+_RULES = _compile(RULES)
+
+
+def _rewrite(name, rules):
+    for prefix, old, new in rules:
+        if prefix is None or name.startswith(prefix):
+            name = name.replace(old, new)
+    return name
+
+
+#%% SCALAR FUNCTIONS
+
+
+def _unidecode(text):
+    # unidecode is imported the first time a name is normalized.
+    from unidecode import unidecode
+    return unidecode(text)
+
+
+def replace_abb(neighbourhood):
+    """
+    Replace abbreviations that hinder posterior database integration.
+    """
+    return _rewrite(neighbourhood, _RULES['hood_abbreviations'])
+
+
+@lru_cache(maxsize=NORM_CACHE_SIZE)
+def _norm_hood(name, abbreviation):
+    # Remove accents
+    name = _unidecode(str(name))
+    # Lower case
+    name = name.lower()
+    # Remove leading and trailing whitespace
+    name = name.strip()
+
+    # Remove abbreviations and put them as longform
+    if abbreviation == True:
+        name = replace_abb(name)
+
+    return name
+
+
+def norm_hood(name, abbreviation=False):
+    """
+    Removes trailing and leading white space, remove diacritics,
+    replace uppercase by lowercase.
+    """
+    if pd.isna(name):
+        return np.nan
+    return _norm_hood(name, abbreviation)
+
+
+@lru_cache(maxsize=NORM_CACHE_SIZE)
+def _norm_city(name):
+    # Remove abbreviations and put them as longform
+    name = _rewrite(name, _RULES['city_abbreviations'])
+    # Remove accents
+    name = _unidecode(str(name))
+    # Lower case
+    name = name.lower()
+    # Remove leading and trailing whitespace
+    name = name.strip()
+
+    return _RULES['city_aliases'].get(name, name)
+
+
+def norm_city(name):
+    """
+    Standardize city names to aid the database merging.
+    """
+    if pd.isna(name):
+        return np.nan
+    return _norm_city(name)
+
+
+def norm_crime_hood(name):
+    """
+    norm_hood() with abbreviations, plus the aliases of SSP neighbourhood
+    names.
+    """
+    name = norm_hood(name, abbreviation=True)
+    return _RULES['crime_hood_aliases'].get(name, name)
+
+
+def clear_norm_cache():
+    """Forgets the names remembered by the normalization functions."""
+    _norm_hood.cache_clear()
+    _norm_city.cache_clear()
+
+
+#%% SERIES FUNCTIONS
+
+
+def take_codes(values, codes):
+    """Gets values[codes], with NaN where the code is -1."""
+    taken = np.empty(len(values) + 1, dtype=object)
+    taken[:-1] = np.asarray(values, dtype=object)
+    taken[-1] = np.nan
+    return taken[codes]
+
+
+def take_categorical(values, codes, dtype=None):
+    """
+    Categorical with values[codes], missing where the code is -1 or the
+    value is missing. Repeated values become a single category.
+    dtype = CategoricalDtype to use. It must have all the values.
+    """
+    value_codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    if dtype is not None:
+        positions = dtype.categories.get_indexer(uniques)
+        if (positions < 0).any():
+            raise ValueError('Values missing from the categories: '
+                             f'{list(uniques[positions < 0])}')
+        value_codes = np.where(value_codes >= 0,
+                               np.append(positions, -1)[value_codes], -1)
+    else:
+        dtype = pd.CategoricalDtype(pd.Index(np.asarray(uniques)))
+    codes = np.append(value_codes, -1)[np.asarray(codes)]
+    return pd.Categorical.from_codes(codes, dtype=dtype)
+
+
+def factorize_pairs(first, second):
+    """
+    Encodes each row by its (first, second) pair of values.
+    Returns the integer code of each row and a table with one row per
+    distinct pair, in order of first appearance. Missing values count as a
+    value of their own.
+    """
+    codes_1, uniques_1 = pd.factorize(first)
+    codes_2, uniques_2 = pd.factorize(second)
+    # Shift by one so that missing values (-1) get a code too.
+    pair_codes = (codes_1 + 1).astype(np.int64) * (len(uniques_2) + 1)
+    pair_codes += codes_2 + 1
+    codes, pair_uniques = pd.factorize(pair_codes)
+
+    idx_1 = pair_uniques // (len(uniques_2) + 1) - 1
+    idx_2 = pair_uniques % (len(uniques_2) + 1) - 1
+    pairs = pd.DataFrame({first.name: take_codes(uniques_1, idx_1),
+                          second.name: take_codes(uniques_2, idx_2)})
+    return codes, pairs
+
+
+def map_unique(series, func, **kwargs):
+    """
+    Applies func once per distinct value of the series and broadcasts the
+    results back to every row. Missing values are kept as NaN.
+    A categorical series gives a categorical result.
+    """
+    codes, uniques = pd.factorize(series)
+    values = [func(value, **kwargs) for value in uniques]
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        values = take_categorical(values, codes)
+    else:
+        values = take_codes(values, codes)
+    return pd.Series(values, index=series.index, name=series.name)
+
+
+def normalize_hoods(series, abbreviation=False):
+    """norm_hood() applied to a whole Series."""
+    return map_unique(series, norm_hood, abbreviation=abbreviation)
+
+
+def normalize_cities(series):
+    """norm_city() applied to a whole Series."""
+    return map_unique(series, norm_city)
+
+
+def normalize_crime_hoods(series):
+    """norm_crime_hood() applied to a whole Series."""
+    return map_unique(series, norm_crime_hood)
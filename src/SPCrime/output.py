@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Writers of the tables made by SPCrime.
+
+write_table() writes a table as TSV, CSV (both optionally compressed),
+Parquet, Feather or an Excel workbook (xlsx), chosen by the file extension
+or by format:
+
+    write_table(df, 'patients_crime.tsv')
+    write_table(df, 'patients_crime.csv.gz')
+    write_table(df, 'patients_crime.parquet', columns=['id', 'THEFT_rate'])
+    write_table(df, 'patients_crime', format='parquet',
+                partition_by='district')
+
+With partition_by, path is a folder with one file per value of the
+partition columns, in Hive layout (path/district=se/part-0.parquet). The
+partition columns are only in the folder names; rows with a missing value
+go to the folder __HIVE_DEFAULT_PARTITION__. Hive-aware readers read the
+folder back as a single table:
+
+    import pyarrow.dataset
+    dataset = pyarrow.dataset.dataset('patients_crime', partitioning='hive')
+    df = dataset.to_table().to_pandas()
+
+Text formats need only pandas, and xlsx files openpyxl. Parquet and
+Feather need pyarrow.
+"""
+
+# Standard libraries
+import os
+import shutil
+from urllib.parse import quote
+
+from SPCrime.arrow import import_pyarrow
+
+
+FORMATS = ('tsv', 'csv', 'parquet', 'feather', 'xlsx')
+
+EXTENSIONS = {'.tsv': 'tsv', '.tab': 'tsv', '.txt': 'tsv',
+              '.csv': 'csv',
+              '.parquet': 'parquet', '.pq': 'parquet',
+              '.feather': 'feather', '.arrow': 'feather',
+              '.xlsx': 'xlsx'}
+
+# Compression of text files, by extension (as pandas infers it).
+COMPRESSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.zip': 'zip', '.xz': 'xz',
+                '.zst': 'zstd'}
+
+# Folder name of the rows with a missing partition value.
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def split_extension(path):
+    """
+    Format and text compression given by the extension of path, each one
+    None if there is none: 'out.csv.gz' --> ('csv', 'gzip').
+    """
+    name = os.fspath(path).lower()
+    compression = None
+    for extension, method in COMPRESSIONS.items():
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+            compression = method
+            break
+    found = EXTENSIONS.get(os.path.splitext(name)[1])
+    return found, compression
+
+
+def file_format(path):
+    """'parquet', 'feather', 'tsv' or 'csv', from the file extension."""
+    return split_extension(path)[0] or 'csv'
+
+
+def check_format(format):
+    """Raises ValueError if format is not one of FORMATS."""
+    if format not in FORMATS:
+        raise ValueError(f'Unknown output format: {format!r}. '
+                         f'Use one of {FORMATS}')
+
+
+def output_path(name, format=None, compression=None):
+    """
+    File name for a table: name, plus the extension of format (default
+    'tsv') and of the text compression if name has no extension.
+    """
+    if split_extension(name)[0] is not None:
+        return os.fspath(name)
+    format = format or 'tsv'
+    check_format(format)
+    path = f'{os.fspath(name)}.{format}'
+    if format in ('tsv', 'csv') and compression is not None:
+        extensions = {method: extension
+                      for extension, method in COMPRESSIONS.items()}
+        path += extensions.get(compression, '')
+    return path
+
+
+def _arrow_table(pyarrow, table, index):
+    if table.attrs:
+        # attrs (like the population report of the rate tables) are not
+        # saved.
+        table = table.copy(deep=False)
+        table.attrs = {}
+    try:
+        return pyarrow.Table.from_pandas(table, preserve_index=index)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        pass
+    # Columns that mix numbers and text (postal codes, often) are written
+    # as text.
+    return pyarrow.Table.from_pandas(text_objects(table),
+                                     preserve_index=index)
+
+
+def text_objects(table):
+    """
+    Copy of table with its object columns as text columns, so that
+    columns mixing types (like wrong_zip: False, True or 'Corrected') fit
+    in an Arrow schema, and columns with only missing values are text too.
+    Missing values are kept.
+    """
+    table = table.copy(deep=False)
+    for column in table.columns[table.dtypes == object]:
+        table[column] = table[column].astype('string')
+    return table
+
+
+def _write_file(table, path, format, compression, index):
+    if format in ('tsv', 'csv'):
+        table.to_csv(path,
+                     sep='\t' if format == 'tsv' else ',',
+                     index=index,
+                     compression=compression or 'infer')
+        return
+    if format == 'xlsx':
+        table.to_excel(path, index=index)
+        return
+    pyarrow = import_pyarrow()
+    arrow_table = _arrow_table(pyarrow, table, index)
+    if format == 'parquet':
+        pyarrow.parquet.write_table(arrow_table, path,
+                                    compression=compression or 'snappy')
+    else:
+        pyarrow.feather.write_feather(arrow_table, path,
+                                      compression=compression)
+
+
+def _partition_folder(keys, values):
+    parts = []
+    for key, value in zip(keys, values):
+        if value is None or value != value:
+            value = NULL_PARTITION
+        parts.append(f'{key}={quote(str(value), safe="")}')
+    return os.path.join(*parts)
+
+
+def _write_partitions(table, path, format, partition_by, compression, index):
+    keys = [partition_by] if isinstance(partition_by, str) \
+        else list(partition_by)
+    missing = [key for key in keys if key not in table.columns]
+    if missing:
+        raise KeyError(f'Partition columns not in the table: {missing}')
+
+    file_name = output_path('part-0', format, compression)
+    # Written next to path and moved at the end, so that a failed write
+    # does not leave half of the partitions.
+    tmp_path = f'{os.fspath(path)}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    written = []
+    for values, part in table.groupby(keys, observed=True, dropna=False,
+                                      sort=True):
+        folder = _partition_folder(keys, values)
+        os.makedirs(os.path.join(tmp_path, folder), exist_ok=True)
+        _write_file(part.drop(columns=keys),
+                    os.path.join(tmp_path, folder, file_name),
+                    format, compression, index)
+        written.append(os.path.join(path, folder, file_name))
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    os.makedirs(tmp_path, exist_ok=True)
+    os.replace(tmp_path, path)
+    return written
+
+
+def write_table(table,
+                path,
+                format=None,
+                columns=None,
+                partition_by=None,
+                compression=None,
+                index=True):
+    """
+    Writes a table to a file.
+    Inputs:
+        table = pandas DataFrame.
+        path = file to write, or folder with partition_by. None writes
+               nothing.
+        format = 'tsv', 'csv', 'parquet', 'feather' or 'xlsx'. Default:
+                 from the extension of path ('csv' if it has none).
+        columns = columns to write. Default: all.
+        partition_by = column, or list of columns, to split the table by
+                       (for instance 'city' or 'district'). An existing
+                       folder at path is replaced.
+        compression = compression of text files ('gzip', 'bz2', 'zip',
+                      'xz', 'zstd'; default: from the extension), or codec
+                      of Parquet ('snappy', 'gzip', 'zstd'...) and Feather
+                      ('lz4', 'zstd', 'uncompressed') files.
+        index = also write the index of the table.
+    Missing folders in path are created.
+    Returns the path of the file, the list of files written with
+    partition_by, or None if nothing was written.
+    """
+    if path is None:
+        return None
+    format = format or file_format(path)
+    check_format(format)
+    folder = os.path.dirname(os.fspath(path))
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    if columns is not None:
+        keys = [] if partition_by is None else (
+            [partition_by] if isinstance(partition_by, str)
+            else list(partition_by))
+        table = table[list(dict.fromkeys([*columns, *keys]))]
+    if partition_by is not None:
+        return _write_partitions(table, path, format, partition_by,
+                                 compression, index)
+    _write_file(table, path, format, compression, index)
+    return os.fspath(path)
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+PART 3 of SPCrime: crime rates of the location of each patient, and the
+SPCrime() function, which runs the three parts.
+"""
+
+# Standard libraries
+import os
+from functools import partial
+
+# Matrices and dataframes
+import pandas as pd
+import numpy as np
+
+# Local modules
+from SPCrime.cep import mapCEP, open_cep, open_dist_dict
+from SPCrime.crime import DISTRICTS_SOURCE, POP_SOURCES, location_dtype
+from SPCrime.crime import (crime_db_file, excel_file, load_crime_counts,
+                           multiple_crime_rates, prepare_pop_data,
+                           single_crime_rates)
+from SPCrime.normalize import factorize_pairs, take_categorical
+from SPCrime.normalize import normalize_cities, normalize_hoods
+from SPCrime.output import check_format, output_path, split_extension
+from SPCrime.output import write_table
+from SPCrime.pipeline import Pipeline, Stage
+from SPCrime.report import activate, stage
+from SPCrime.resolutions import manual_resolutions
+
+
+#%% PART 3: ADD CRIMINAL DATA TO MY DATASET
+
+
+def prepare_patientDB(df, crimetype=None):
+    """Standardize patient database location names"""
+    df['district'] = normalize_hoods(df['district'])
+    df['city'    ] = normalize_cities(df['city'    ])
+    return df
+
+
+def patient_locations(df):
+    """
+    LOCATION of each patient, as in the crime rate tables: the district for
+    São Paulo City, the city for the rest of the state.
+
+    It works only if you have applied prepare_patientDB().
+    """
+    codes, pairs = factorize_pairs(df['city'], df['district'])
+    location = np.where(pairs['city'] == 'sao paulo',
+                        pairs['district'].to_numpy(dtype=object),
+                        pairs['city'].to_numpy(dtype=object))
+    location = take_categorical(location, codes,
+                                dtype=location_dtype(location))
+    return pd.Series(location, index=df.index, name='LOCATION')
+
+
+def rate_columns(crime_rates, crimetype):
+    """
+    Table indexed by LOCATION with a '{crime type}_rate' column per crime
+    type. Column of NaN for crime types not in crime_rates.
+    Inputs:
+        crime_rates = table made by single_crime_rates() (LOCATION column
+                      and '{crime type}_rate' columns) or by
+                      multiple_crime_rates() (LOCATION index and a column
+                      per crime type).
+        crimetype = list of crime types.
+    """
+    if 'LOCATION' in crime_rates.columns:
+        crime_rates = crime_rates.set_index('LOCATION')
+    columns = {}
+    for crime_type in crimetype:
+        col_name = f'{crime_type}_rate'
+        if col_name in crime_rates.columns:
+            columns[col_name] = crime_rates[col_name]
+        elif crime_type in crime_rates.columns:
+            columns[col_name] = crime_rates[crime_type]
+        else:
+            columns[col_name] = np.nan
+    return pd.DataFrame(columns, index=crime_rates.index)
+
+
+def add_crime_data(series, crime_rates, crimetype):
+    """
+    Row by row version of CEP2crime(), for a single crime type.
+    crime_rates = table made by the rate_columns() function.
+    """
+    city = series['city']
+    dist = series['district']
+    col_name = f'{crimetype}_rate'
+    if city == 'sao paulo':
+        key = dist
+    else:
+        key = city
+    try:
+        series[col_name] = crime_rates.loc[key, col_name]
+    except KeyError:
+        series[col_name] = np.nan
+    return series
+
+
+def CEP2crime(df, crimetype, crime_rates):
+    """
+    Adds a '{crime type}_rate' column per crime type to the patient table.
+    Each distinct patient LOCATION is looked up once in crime_rates, and all
+    the rate columns are attached together.
+    Inputs:
+        df = table made by the mapCEP() function.
+        crimetype = crime type or list of crime types.
+        crime_rates = table made by single_crime_rates() or
+                      multiple_crime_rates().
+    """
+    if isinstance(crimetype, str):
+        crimetype = [crimetype]
+    df = prepare_patientDB(df)
+    rates = rate_columns(crime_rates, crimetype)
+
+    codes, locations = pd.factorize(patient_locations(df))
+    positions = rates.index.get_indexer(locations)
+    # Rows of rates for each patient; -1 (NaN) if no rate is available.
+    rows = np.append(positions, -1)[codes]
+
+    attached = {}
+    for col_name in rates.columns:
+        values = rates[col_name].to_numpy(dtype=float)
+        attached[col_name] = np.append(values, np.nan)[rows]
+    attached = pd.DataFrame(attached, index=df.index)
+
+    df = df.drop(columns=attached.columns, errors='ignore')
+    return pd.concat([df, attached], axis=1)
+
+
+
+#%% PART 3: STAGES OF SPCrime()
+# CEP index, crime file and population table do not depend on each other,
+# so SPCrime() loads them at the same time (see SPCrime.pipeline).
+
+
+def _stage_cep_index(inputs, cep_path, cache):
+    return open_cep(cep_path, cache=cache)
+
+
+def _stage_districts(inputs):
+    return open_dist_dict()
+
+
+def _stage_mapCEP(df, inputs, zip_code_col, autocorrect, cache,
+                  cep_fallback):
+    return mapCEP(df.copy(), zip_code_col,
+                  autocorrect=autocorrect,
+                  cache=cache,
+                  cep_fallback=cep_fallback,
+                  CEP=inputs['cep index'],
+                  districts=inputs['districts'])[1]
+
+
+def _stage_crime_counts(crime_db, inputs, premade, aggregate, cache,
+                        workers, engine, save_crime_db):
+    return load_crime_counts(crime_db,
+                             districts=inputs['districts'],
+                             premade=premade,
+                             aggregate=aggregate,
+                             cache=cache,
+                             workers=workers,
+                             engine=engine,
+                             save_crime_db=save_crime_db)
+
+
+def _stage_population(inputs, cache):
+    return prepare_pop_data(cache=cache)
+
+
+def _stage_crime_rates(crime_db, inputs, crime_type, n_percapita, premade,
+                       aggregate, cache, save_to, save_excel_to):
+    if len(crime_type) == 1:
+        rates = single_crime_rates
+        crime_type = crime_type[0]
+    else:
+        rates = multiple_crime_rates
+    crime_rates = rates(crime_type,
+                        crime_db,
+                        districts=inputs['districts'],
+                        n_percapita=n_percapita,
+                        premade=premade,
+                        aggregate=aggregate,
+                        cache=cache,
+                        counts=inputs['crime counts'],
+                        save_to=save_to)
+    write_table(crime_rates, save_excel_to)
+    return crime_rates
+
+
+def _stage_CEP2crime(inputs, crime_type):
+    return CEP2crime(inputs['mapCEP'], crime_type, inputs['crime rates'])
+
+
+def _stage_write_output(inputs, output_name, output_format, output_columns,
+                        partition_by, compression):
+    if output_name is None:
+        return None
+    if partition_by is None:
+        output_name = output_path(output_name, output_format, compression)
+    return write_table(inputs['CEP2crime'],
+                       output_name,
+                       format=output_format,
+                       columns=output_columns,
+                       partition_by=partition_by,
+                       compression=compression)
+
+
+def _intermediate_files(crime_type, crime_db, folder, output_format,
+                        premade, aggregate, save_excel):
+    """
+    Files for the crime database, the crime rates and their xlsx copy in
+    folder. None for the files not to save.
+    """
+    if folder is None:
+        return None, None, None
+    if output_format == 'xlsx':
+        # A year of crime records does not fit in an Excel sheet.
+        output_format = 'tsv'
+    crime_db_path = None
+    if isinstance(crime_db, str) and not premade and not aggregate:
+        crime_db_path = os.path.join(
+            folder, os.path.basename(crime_db_file(crime_db, output_format)))
+    rates_name = '_'.join(crime_type)
+    rates_path = output_path(os.path.join(folder, f'{rates_name}_rates'),
+                             output_format)
+    excel_path = None
+    if save_excel:
+        excel_path = excel_file(crime_type[0] if len(crime_type) == 1
+                                else crime_type,
+                                crime_db, folder)
+    return crime_db_path, rates_path, excel_path
+
+
+def SPCrime_pipeline(df,
+                     zip_code_col,
+                     crime_type,
+                     crime_db,
+                     output_name,
+                     cep_path=None,
+                     autocorrect=False,
+                     premade_crime_db=False,
+                     n_percapita=10000,
+                     save_excel=True,
+                     aggregate=False,
+                     cache=True,
+                     workers=1,
+                     cep_fallback=False,
+                     engine='pandas',
+                     output_format=None,
+                     output_columns=None,
+                     partition_by=None,
+                     compression=None,
+                     intermediates=None,
+                     max_workers=4,
+                     processes=0):
+    """
+    The stages of SPCrime() as a Pipeline, to run later:
+        'cep index', 'districts', 'crime counts', 'population' = inputs,
+            loaded at the same time;
+        'mapCEP' = patient addresses and districts;
+        'crime rates', 'CEP2crime' = rates and patient table with rates;
+        'write output' = the output file (its path, or the list of files
+            with partition_by; None if output_name is None).
+    Inputs as in SPCrime(), plus:
+        max_workers = number of stages run at the same time (threads).
+        processes = number of worker processes for reading the crime file
+                    (the 'crime counts' stage). 0: read it in a thread.
+    pipeline.run() runs it; pipeline.run('crime rates') only the stages
+    needed for the crime rates. Running it again only runs the stages whose
+    inputs changed (see SPCrime.pipeline).
+    """
+    if isinstance(crime_type, str):
+        crime_type = [crime_type]
+    if output_format is None and output_name is not None:
+        output_format = split_extension(output_name)[0]
+    output_format = output_format or 'tsv'
+    check_format(output_format)
+    save_crime_db, save_rates, save_xlsx = _intermediate_files(
+        crime_type, crime_db, intermediates, output_format, premade_crime_db,
+        aggregate, save_excel)
+    stages = [
+        Stage('cep index', _stage_cep_index,
+              sources=[cep_path],
+              params={'cep_path': cep_path, 'cache': cache}),
+        Stage('districts', _stage_districts,
+              sources=[DISTRICTS_SOURCE]),
+        Stage('crime counts', partial(_stage_crime_counts, crime_db),
+              requires=['districts'],
+              sources=[crime_db, manual_resolutions('district')],
+              params={'premade': premade_crime_db,
+                      'aggregate': aggregate,
+                      'cache': cache,
+                      'workers': workers,
+                      'engine': engine,
+                      'save_crime_db': save_crime_db},
+              process=True),
+        Stage('population', _stage_population,
+              sources=POP_SOURCES,
+              params={'cache': cache}),
+        Stage('mapCEP', partial(_stage_mapCEP, df),
+              requires=['cep index', 'districts'],
+              sources=[df],
+              params={'zip_code_col': zip_code_col,
+                      'autocorrect': autocorrect,
+                      'cache': cache,
+                      'cep_fallback': cep_fallback}),
+        Stage('crime rates', partial(_stage_crime_rates, crime_db),
+              requires=['districts', 'crime counts', 'population'],
+              sources=[manual_resolutions('population')],
+              params={'crime_type': crime_type,
+                      'n_percapita': n_percapita,
+                      'premade': premade_crime_db,
+                      'aggregate': aggregate,
+                      'cache': cache,
+                      'save_to': save_rates,
+                      'save_excel_to': save_xlsx}),
+        Stage('CEP2crime', _stage_CEP2crime,
+              requires=['mapCEP', 'crime rates'],
+              params={'crime_type': crime_type}),
+        Stage('write output', _stage_write_output,
+              requires=['CEP2crime'],
+              params={'output_name': output_name,
+                      'output_format': output_format,
+                      'output_columns': output_columns,
+                      'partition_by': partition_by,
+                      'compression': compression})]
+    return Pipeline(stages, max_workers=max_workers, processes=processes)
+
+
+
+def SPCrime(df,
+            zip_code_col,
+            crime_type,
+            crime_db,
+            output_name,
+            cep_path=None,
+            autocorrect=False,
+            premade_crime_db=False,
+            n_percapita=10000,
+            save_excel=True,
+            aggregate=False,
+            cache=True,
+            workers=1,
+            report=None,
+            cep_fallback=False,
+            concurrent=True,
+            engine='pandas',
+            output_format=None,
+            output_columns=None,
+            partition_by=None,
+            compression=None,
+            intermediates=None):
+
+    pipeline = SPCrime_pipeline(df, zip_code_col, crime_type, crime_db,
+                                output_name,
+                                cep_path=cep_path,
+                                autocorrect=autocorrect,
+                                premade_crime_db=premade_crime_db,
+                                n_percapita=n_percapita,
+                                save_excel=save_excel,
+                                aggregate=aggregate,
+                                cache=cache,
+                                workers=workers,
+                                cep_fallback=cep_fallback,
+                                engine=engine,
+                                output_format=output_format,
+                                output_columns=output_columns,
+                                partition_by=partition_by,
+                                compression=compression,
+                                intermediates=intermediates,
+                                max_workers=4 if concurrent else 1)
+    with activate(report), stage('SPCrime'):
+        pipeline.run()
+
+    return pipeline['CEP2crime']
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Stage graph: runs the steps of a pipeline as soon as their inputs are ready.
+
+Each Stage names the stages it needs. Stages that do not depend on each
+other (in SPCrime(): loading the CEP index, reading the SSP file and
+loading the population table) run at the same time, in threads, or in
+worker processes for the stages marked process=True.
+
+A Pipeline remembers the result of each stage and a signature of what it
+was computed from: its source files or tables, its parameters and the
+signatures of the stages it needs. Running the pipeline again only runs the
+stages whose signature changed:
+
+    pipeline = SPCrime_pipeline(df, 'zip_code', ['THEFT'], 'ssp_2022.xlsx',
+                                'out')
+    pipeline.run()
+    pipeline.timings                   # seconds per stage
+    pipeline.stages['crime counts'].sources = ['ssp_2023.xlsx']
+    pipeline.run()                     # reruns only what depends on it
+"""
+
+# Standard libraries
+import contextvars
+import hashlib
+import json
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+import SPCrime
+from SPCrime.cache import source_digest
+from SPCrime.report import current_report, stage
+
+
+class Stage:
+    """
+    A step of a Pipeline.
+    Inputs:
+        name = name of the stage, also used in the RunReport.
+        func = function called as func(inputs, **params), where inputs is
+               the dictionary {required stage: its result}. With
+               process=True it must be a module level function.
+        requires = names of the stages whose results func needs.
+        sources = files or tables the result depends on (as in
+                  SPCrime.cache.cached_table()).
+        params = other arguments of func, also part of the signature.
+        process = run in a worker process when the pipeline has one. For
+                  stages that take long and return small results.
+    """
+
+    def __init__(self, name, func, requires=(), sources=(), params=None,
+                 process=False):
+        self.name = name
+        self.func = func
+        self.requires = list(requires)
+        self.sources = list(sources)
+        self.params = dict(params or {})
+        self.process = process
+
+    def __repr__(self):
+        return f'Stage({self.name!r}, requires={self.requires})'
+
+
+def _run_stage(func, inputs, params):
+    """Runs a stage function. Returns its result and time (s)."""
+    start = time.perf_counter()
+    result = func(inputs, **params)
+    return result, time.perf_counter() - start
+
+
+class Pipeline:
+    """
+    Graph of stages.
+    Inputs:
+        stages = list of Stage, each one after the stages it requires.
+        max_workers = number of stages run at the same time. 1 runs them
+                      one after the other, in order.
+        processes = number of worker processes for the stages marked
+                    process=True. 0 runs them in threads too.
+    Attributes:
+        results = {stage name: result} of the last runs.
+        timings = {stage name: seconds} of the stages run by the last run.
+    """
+
+    def __init__(self, stages, max_workers=4, processes=0):
+        self.stages = {}
+        for item in stages:
+            missing = [name for name in item.requires
+                       if name not in self.stages]
+            if missing:
+                raise ValueError(f'Stage {item.name!r} requires unknown or '
+                                 f'later stages: {missing}')
+            self.stages[item.name] = item
+        self.max_workers = max(1, max_workers)
+        self.processes = processes
+        self.results = {}
+        self.timings = {}
+        self._signatures = {}
+
+    def __repr__(self):
+        return f'Pipeline({list(self.stages)})'
+
+    def __getitem__(self, name):
+        return self.results[name]
+
+    def needed(self, targets=None):
+        """
+        Names of the targets and of all the stages they need, in order.
+        Default targets: all the stages.
+        """
+        if targets is None:
+            return list(self.stages)
+        if isinstance(targets, str):
+            targets = [targets]
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in self.stages:
+                raise KeyError(f'Unknown stage: {name!r}')
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.stages[name].requires)
+        return [name for name in self.stages if name in needed]
+
+    def signatures(self, names=None):
+        """
+        Signature of each stage: a digest of its sources, parameters and
+        required stages. None if a source cannot be hashed.
+        """
+        signatures = {}
+        for name in self.needed(names):
+            item = self.stages[name]
+            parts = [source_digest(source) for source in item.sources]
+            parts += [signatures[required] for required in item.requires]
+            if any(part is None for part in parts):
+                signatures[name] = None
+                continue
+            text = json.dumps({'stage': name,
+                               'parts': parts,
+                               'params': item.params,
+                               'package': SPCrime.__version__},
+                              sort_keys=True, default=str)
+            signatures[name] = hashlib.sha256(text.encode()).hexdigest()
+        return signatures
+
+    def outdated(self, targets=None):
+        """Stages that run() would run: the changed ones and new ones."""
+        signatures = self.signatures(targets)
+        return [name for name, signature in signatures.items()
+                if signature is None
+                or name not in self.results
+                or self._signatures.get(name) != signature]
+
+    def run(self, targets=None, force=False):
+        """
+        Runs the outdated stages among the targets and the stages they
+        need (default: all), or all of them with force=True.
+        Returns self.results.
+        """
+        signatures = self.signatures(targets)
+        todo = list(signatures) if force else self.outdated(targets)
+        self.timings = {}
+        if not todo:
+            return self.results
+        for name in todo:
+            self.results.pop(name, None)
+            self._signatures.pop(name, None)
+
+        report = current_report()
+        workers = self.max_workers
+        if report is not None and (report.trace_memory or report.profile):
+            # Memory peaks and profiles are per process, not per stage.
+            workers = 1
+        if workers == 1:
+            for name in todo:
+                self._finish(name, *self._call(name), signatures)
+            return self.results
+
+        threads = ThreadPoolExecutor(max_workers=workers,
+                                     thread_name_prefix='SPCrime-stage')
+        pool = (ProcessPoolExecutor(max_workers=self.processes)
+                if self.processes > 0 else None)
+        running = {}
+        remote = set()
+        try:
+            while todo or running:
+                for name in self._ready(todo):
+                    todo.remove(name)
+                    item = self.stages[name]
+                    if item.process and pool is not None:
+                        future = pool.submit(_run_stage, item.func,
+                                             self._inputs(name), item.params)
+                        remote.add(future)
+                    else:
+                        # The thread gets the context (and RunReport) of
+                        # the caller.
+                        context = contextvars.copy_context()
+                        future = threads.submit(context.run, self._call, name)
+                    running[future] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    result, seconds = future.result()
+                    if future in remote and report is not None:
+                        # Stages run in other processes are timed here.
+                        report.add_time(name, seconds)
+                    self._finish(name, result, seconds, signatures)
+        finally:
+            for future in running:
+                future.cancel()
+            threads.shutdown(wait=True, cancel_futures=True)
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+        return self.results
+
+    def _ready(self, todo):
+        return [name for name in todo
+                if all(required in self.results
+                       for required in self.stages[name].requires)]
+
+    def _inputs(self, name):
+        return {required: self.results[required]
+                for required in self.stages[name].requires}
+
+    def _call(self, name):
+        """Runs a stage in this thread. Returns its result and time."""
+        item = self.stages[name]
+        with stage(name):
+            return _run_stage(item.func, self._inputs(name), item.params)
+
+    def _finish(self, name, result, seconds, signatures):
+        self.results[name] = result
+        self.timings[name] = seconds
+        self._signatures[name] = signatures[name]
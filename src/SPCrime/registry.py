@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide registry of the reference tables bundled with the package.
+
+The district table, the population table and the CEP index are loaded the
+first time a function needs them and kept for the rest of the process, so
+later calls (and the other stages of SPCrime(), in other threads) reuse
+them instead of reading the package data again:
+
+    from SPCrime import registry
+    registry.loaded()      # names of the tables loaded so far
+    registry.clear()       # forget them, to load them again
+
+Each table is loaded by one thread; other threads asking for the same
+table wait for it, while different tables load at the same time. Worker
+processes have a registry of their own.
+"""
+
+# Standard libraries
+import threading
+
+
+_objects = {}
+_locks = {}
+_lock = threading.Lock()
+
+
+def shared(name, load):
+    """
+    Object registered as name. The first call loads it with load(); later
+    calls return the same object, so callers must not change it.
+    Inputs:
+        name = name of the object; any hashable value, like a tuple of the
+               name and the parameters it was loaded with.
+        load = function without arguments that returns the object.
+    """
+    try:
+        return _objects[name]
+    except KeyError:
+        pass
+    with _lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        if name not in _objects:
+            _objects[name] = load()
+    return _objects[name]
+
+
+def loaded():
+    """Names of the objects in the registry."""
+    return list(_objects)
+
+
+def clear(name=None):
+    """Forgets the object registered as name, or all of them."""
+    with _lock:
+        if name is None:
+            _objects.clear()
+        else:
+            _objects.pop(name, None)
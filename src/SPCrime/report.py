@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Run reports: what happened during a run of the pipeline.
+
+SPCrime does not print anything while it works. To know how long each
+stage took, how many names were matched exactly, approximately or not at
+all, and which names were not found, activate a RunReport:
+
+    report = RunReport()
+    with report:
+        SPCrime(df, 'zip_code', ['THEFT'], 'SPDadosCriminais_2022.xlsx', 'out')
+    print(report.summary())
+
+The functions of the package add to the report active in the current
+context (see current_report()); with no active report they only skip the
+bookkeeping. Worker processes (workers > 1) keep their own counts, which
+are not added to the report, and tables read from the cache are not
+matched again, so they add no counts either.
+"""
+
+# Standard libraries
+import cProfile
+import logging
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+_current = ContextVar('SPCrime_report', default=None)
+
+
+def current_report():
+    """RunReport active in the current context, or None."""
+    return _current.get()
+
+
+def _max_rss():
+    """Largest resident set size of the process so far, in bytes."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS gives bytes, Linux kilobytes.
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class RunReport:
+    """
+    Stage timings, match counts and unresolved names of a run.
+    Inputs:
+        trace_memory = measure the peak memory allocated by each stage
+                       with tracemalloc. It slows Python code down, so it
+                       is off by default; the largest resident set size of
+                       the process is always recorded.
+        profile = run stages under cProfile: True for all stages, or a
+                  list of stage names. The statistics are kept in
+                  self.profiles.
+        sample_size = number of unresolved names kept per kind.
+        logger = logging.Logger to send the stage timings (INFO) and the
+                 unresolved names (DEBUG) to, or True for the 'SPCrime'
+                 logger. Default: no logging.
+    Attributes:
+        stages = {stage name: {'calls', 'seconds', 'peak_bytes',
+                  'max_rss'}}; nested stages are timed on their own, so
+                 their times are also part of the enclosing stage.
+                 Stages run at the same time (see SPCrime.pipeline)
+                 overlap.
+        matches = {kind: Counter of outcomes}, for instance
+                  matches['district'] = {'exact': 120, 'close': 8,
+                  'unmatched': 2, 'missing': 1}.
+        unresolved = {kind: list of names}, at most sample_size each.
+        profiles = {stage name: pstats.Stats}.
+    """
+
+    def __init__(self, trace_memory=False, profile=False, sample_size=20,
+                 logger=None):
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.sample_size = sample_size
+        if logger is True:
+            logger = logging.getLogger('SPCrime')
+        self.logger = logger
+
+        self.stages = {}
+        self.matches = {}
+        self.unresolved = {}
+        self.profiles = {}
+        self._tokens = []
+        self._traces = []
+        self._started_trace = False
+        self._profiling = False
+        # Stages of SPCrime() can run in several threads.
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (f'RunReport({len(self.stages)} stages, '
+                f'{sorted(self.matches)})')
+
+    # Activation
+
+    def __enter__(self):
+        self._tokens.append(_current.set(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._tokens.pop())
+
+    # Counts
+
+    def count(self, kind, outcome, n=1):
+        """Adds n to the count of outcome for this kind of match."""
+        with self._lock:
+            self.matches.setdefault(kind, Counter())[outcome] += n
+
+    def add_unresolved(self, kind, name):
+        """Keeps name in the sample of unresolved names of this kind."""
+        with self._lock:
+            sample = self.unresolved.setdefault(kind, [])
+            if len(sample) >= self.sample_size or name in sample:
+                return
+            sample.append(name)
+        if self.logger is not None:
+            self.logger.debug('%s not resolved: %s', kind, name)
+
+    # Stages
+
+    def _trace_start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_trace = True
+        current, peak = tracemalloc.get_traced_memory()
+        # Keep the peak of the enclosing stages before resetting it.
+        for trace in self._traces:
+            trace[1] = max(trace[1], peak)
+        tracemalloc.reset_peak()
+        self._traces.append([current, current])
+
+    def _trace_stop(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        base, stage_peak = self._traces.pop()
+        for trace in self._traces:
+            trace[1] = max(trace[1], peak)
+        if not self._traces and self._started_trace:
+            tracemalloc.stop()
+            self._started_trace = False
+        return max(stage_peak, peak) - base
+
+    def _profiles(self, name):
+        if self._profiling or not self.profile:
+            return False
+        return self.profile is True or name in self.profile
+
+    @contextmanager
+    def stage(self, name):
+        """Times the code run inside the with block as stage name."""
+        profiler = None
+        if self._profiles(name):
+            profiler = cProfile.Profile()
+            self._profiling = True
+            profiler.enable()
+        if self.trace_memory:
+            self._trace_start()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            peak = self._trace_stop() if self.trace_memory else None
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                stats = pstats.Stats(profiler)
+                if name in self.profiles:
+                    self.profiles[name].add(stats)
+                else:
+                    self.profiles[name] = stats
+
+            self.add_time(name, seconds, peak)
+
+    def add_time(self, name, seconds, peak=None):
+        """Adds a call of stage name that took seconds."""
+        with self._lock:
+            stage = self.stages.setdefault(name, {'calls': 0,
+                                                  'seconds': 0.0,
+                                                  'peak_bytes': None,
+                                                  'max_rss': None})
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+            if peak is not None:
+                stage['peak_bytes'] = max(stage['peak_bytes'] or 0, peak)
+            stage['max_rss'] = _max_rss()
+        if self.logger is not None:
+            self.logger.info('%s: %.3f s', name, seconds)
+
+    # Results
+
+    def to_dict(self):
+        """The report as plain dictionaries and lists (JSON ready)."""
+        return {'stages': {name: dict(stage)
+                           for name, stage in self.stages.items()},
+                'matches': {kind: dict(counts)
+                            for kind, counts in self.matches.items()},
+                'unresolved': {kind: list(names)
+                               for kind, names in self.unresolved.items()}}
+
+    def summary(self):
+        """The report as text."""
+        lines = []
+        for name, stage in self.stages.items():
+            line = f'{name:24} {stage["seconds"]:10.3f} s'
+            if stage['calls'] > 1:
+                line += f' ({stage["calls"]} calls)'
+            if stage['peak_bytes'] is not None:
+                line += f' {stage["peak_bytes"] / 2**20:10.1f} MiB'
+            lines.append(line)
+        for kind, counts in self.matches.items():
+            outcomes = ', '.join(f'{outcome} {n}'
+                                 for outcome, n in counts.items())
+            lines.append(f'{kind}: {outcomes}')
+        for kind, names in self.unresolved.items():
+            lines.append(f'{kind} not resolved: {", ".join(map(str, names))}')
+        return '\n'.join(lines)
+
+
+#%% HOOKS USED BY THE PIPELINE
+
+
+def stage(name):
+    """Times a stage in the active report; does nothing without one."""
+    report = _current.get()
+    if report is None:
+        return nullcontext()
+    return report.stage(name)
+
+
+def count_match(kind, outcome, n=1, name=None):
+    """
+    Counts a match outcome in the active report. With name, the name is
+    also kept in the sample of unresolved names.
+    """
+    report = _current.get()
+    if report is None:
+        return
+    report.count(kind, outcome, n)
+    if name is not None:
+        report.add_unresolved(kind, name)
+
+
+@contextmanager
+def activate(report):
+    """Activates report (if not None) inside the with block."""
+    if report is None:
+        yield None
+        return
+    with report:
+        yield report
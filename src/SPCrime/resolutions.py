@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+Learned resolutions of names that are not found as they are.
+
+Crime records name São Paulo City neighbourhoods with typos and
+abbreviations, and the same misspellings come back every year. Each name
+that needs an approximate match (NameMatcher) is resolved once and saved in
+a resolution table, with its score, the method and the time; later runs
+read the answer from the table instead of matching the name again.
+
+Two kinds of names are resolved:
+    'district' = normalized BAIRRO of São Paulo City --> neighbourhood of
+                 the district table (see find_closest_district());
+    'population' = LOCATION --> location of the population table (see
+                   population_report()).
+
+Methods:
+    'close' = best approximate match, as NameMatcher finds it;
+    'unmatched' = no candidate is close enough;
+    'manual' = resolution given by the user (import_overrides()).
+Learned resolutions ('close', 'unmatched') are only used with the same
+candidate names they were found among, so they give the same result as
+matching again. Manual resolutions are always used, and change the tables
+built from then on.
+
+To review the names that were not resolved:
+
+    table = resolution_table()
+    table.export_unresolved('unresolved.tsv')
+    # fill in the 'resolved' column, then
+    table.import_overrides('unresolved.tsv')
+    table.save()
+
+The table is the file resolutions.tsv in the cache directory (see
+SPCrime.cache). Set the SPCRIME_RESOLUTIONS environment variable to another
+file to use it instead, or to 0 to match every name again in each run. It
+is not used when the cache is disabled (SPCRIME_CACHE=0).
+"""
+
+# Standard libraries
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+# Matrices and dataframes
+import pandas as pd
+import numpy as np
+
+from SPCrime.cache import cache_dir, cache_enabled
+from SPCrime.matching import NameMatcher
+from SPCrime.report import count_match
+
+
+COLUMNS = ['kind', 'name', 'resolved', 'score', 'method', 'candidates',
+           'updated']
+KINDS = ['district', 'population']
+TABLE_NAME = 'resolutions.tsv'
+
+# Seconds to wait for the lock of the table file; a lock older than
+# LOCK_STALE is left from a process that died, and is removed.
+LOCK_TIMEOUT = 30
+LOCK_STALE = 120
+
+
+def resolutions_path():
+    """File of the resolution table, or None if it is disabled."""
+    setting = os.environ.get('SPCRIME_RESOLUTIONS', '1')
+    if setting.lower() in ('0', 'false', 'no', 'off') or not cache_enabled():
+        return None
+    if setting.lower() in ('1', 'true', 'yes', 'on'):
+        return os.path.join(cache_dir(), TABLE_NAME)
+    return setting
+
+
+def candidates_key(names, cutoff=0.6):
+    """Short digest of a set of candidate names and the matching cutoff."""
+    names = sorted({name for name in names if isinstance(name, str)})
+    sha = hashlib.sha256(f'{cutoff}\n'.encode('utf-8'))
+    sha.update('\n'.join(names).encode('utf-8'))
+    return sha.hexdigest()[:16]
+
+
+def _read_table(path):
+    table = pd.read_csv(path, sep='\t', dtype=str, keep_default_na=False)
+    missing = set(COLUMNS) - set(table.columns)
+    if missing:
+        raise ValueError(f'{path} is not a resolution table; missing '
+                         f'columns: {sorted(missing)}')
+    return table[COLUMNS]
+
+
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT):
+    """
+    Holds the lock file path + '.lock', so that only one process at a time
+    reads, merges and replaces path. Raises TimeoutError if the lock is
+    not free after timeout seconds.
+    """
+    lock_path = f'{path}.lock'
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > LOCK_STALE:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'{lock_path} is held by another process')
+            time.sleep(0.05)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        yield
+    finally:
+        os.close(fd)
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+
+class ResolutionTable:
+    """
+    Name resolutions, by (kind, name, candidates).
+    Inputs:
+        path = TSV file to load and save the table. None for a table kept
+               only in memory.
+    Resolutions can be recorded and saved from several threads, so changes
+    to the table are made under a lock. Several processes can save to the
+    same file (see save()).
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+        self._new = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            for row in _read_table(path).to_dict('records'):
+                self._entries[self._key(row)] = row
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f'ResolutionTable({self.path!r}, {len(self)} names)'
+
+    @staticmethod
+    def _key(row):
+        candidates = '' if row['method'] == 'manual' else row['candidates']
+        return (row['kind'], row['name'], candidates)
+
+    def _add(self, row):
+        key = self._key(row)
+        with self._lock:
+            self._entries[key] = row
+            self._new[key] = row
+
+    @property
+    def dirty(self):
+        """True if there are resolutions not saved yet."""
+        return bool(self._new)
+
+    def get(self, kind, name, candidates):
+        """
+        (resolved name or None, score, method) of name, or None if the
+        table does not know it. Manual resolutions come first.
+        """
+        row = (self._entries.get((kind, name, ''))
+               or self._entries.get((kind, name, candidates)))
+        if row is None:
+            return None
+        score = float(row['score']) if row['score'] else 0.0
+        return row['resolved'] or None, score, row['method']
+
+    def record(self, kind, name, resolved, score, method, candidates=''):
+        """Adds or replaces the resolution of name."""
+        self._add({'kind': kind,
+                   'name': name,
+                   'resolved': resolved or '',
+                   'score': f'{score:.6f}',
+                   'method': method,
+                   'candidates': candidates,
+                   'updated': time.strftime('%Y-%m-%dT%H:%M:%S')})
+
+    def import_overrides(self, overrides, kind=None):
+        """
+        Adds manual resolutions.
+        Inputs:
+            overrides = table, or TSV/CSV file, with the columns name and
+                        resolved (normalized names, as export_unresolved()
+                        writes them) and, unless kind is given, kind.
+                        Rows with an empty resolved are skipped.
+            kind = 'district' or 'population', for all the rows.
+        For 'district', resolved is a neighbourhood or district name of
+        the district table.
+        Returns the number of resolutions added.
+        """
+        if not isinstance(overrides, pd.DataFrame):
+            sep = '\t' if str(overrides).lower().endswith(('.tsv', '.txt')) \
+                else ','
+            overrides = pd.read_csv(overrides, sep=sep, dtype=str,
+                                    keep_default_na=False)
+        overrides = overrides.fillna('')
+        if kind is not None:
+            overrides = overrides.assign(kind=kind)
+        if 'kind' not in overrides.columns:
+            raise ValueError('The overrides need a kind column, or pass kind')
+
+        added = 0
+        for row in overrides.to_dict('records'):
+            if row['kind'] not in KINDS:
+                raise ValueError(f"Unknown kind: {row['kind']!r}. "
+                                 f'Use one of {KINDS}')
+            if not row['name'] or not row['resolved']:
+                continue
+            self.record(row['kind'], row['name'], row['resolved'], 1.0,
+                        'manual')
+            added += 1
+        return added
+
+    def to_frame(self):
+        """All the resolutions as a table, one row per name."""
+        with self._lock:
+            rows = list(self._entries.values())
+        return pd.DataFrame(rows, columns=COLUMNS)
+
+    def manual(self, kind=None):
+        """
+        Table of the manual resolutions (of one kind). Tables built with
+        the resolution table depend on it (see SPCrime.cache).
+        """
+        table = self.to_frame()
+        table = table[table['method'] == 'manual']
+        if kind is not None:
+            table = table[table['kind'] == kind]
+        return (table[['kind', 'name', 'resolved']]
+                .sort_values(['kind', 'name'], ignore_index=True))
+
+    def unresolved(self, kind=None, below=None):
+        """
+        Names without a manual resolution that were not matched, plus the
+        close matches with a score below `below`.
+        Returns a table with the columns kind, name, resolved (the close
+        match, or empty) and score.
+        """
+        table = self.to_frame()
+        if kind is not None:
+            table = table[table['kind'] == kind]
+        score = pd.to_numeric(table['score'], errors='coerce')
+        review = table['method'] == 'unmatched'
+        if below is not None:
+            review |= (table['method'] == 'close') & (score < below)
+        manual = self.manual(kind)
+        manual = set(zip(manual['kind'], manual['name']))
+        review &= np.array([pair not in manual for pair
+                            in zip(table['kind'], table['name'])], dtype=bool)
+        table = table[review].drop_duplicates(['kind', 'name'])
+        return (table[['kind', 'name', 'resolved', 'score']]
+                .sort_values(['kind', 'name'], ignore_index=True))
+
+    def export_unresolved(self, path, kind=None, below=None):
+        """
+        Writes unresolved(kind, below) to a TSV file. Fill in its resolved
+        column and pass it to import_overrides().
+        Returns the number of names written.
+        """
+        table = self.unresolved(kind, below)
+        table.to_csv(path, sep='\t', index=False)
+        return len(table)
+
+    def save(self):
+        """
+        Writes the table to its file, if there is anything new. Resolutions
+        saved by other processes in the meantime are kept: the file is read,
+        merged and replaced while holding its file_lock().
+        """
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        if self.path is None or not self._new:
+            return
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+        with file_lock(self.path):
+            entries = {}
+            if os.path.exists(self.path):
+                try:
+                    for row in _read_table(self.path).to_dict('records'):
+                        entries[self._key(row)] = row
+                except (OSError, ValueError):
+                    pass
+            entries.update(self._new)
+
+            table = pd.DataFrame(list(entries.values()), columns=COLUMNS)
+            table = table.sort_values(['kind', 'name', 'candidates'])
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            table.to_csv(tmp_path, sep='\t', index=False)
+            os.replace(tmp_path, self.path)
+        self._entries = entries
+        self._new = {}
+
+
+class LearnedMatcher:
+    """
+    NameMatcher that asks a ResolutionTable first, and records in it the
+    names it matches. The NameMatcher is only built when a name is not in
+    the table.
+    Inputs:
+        kind = 'district' or 'population'.
+        possibilities, cutoff = as in NameMatcher.
+        table = ResolutionTable.
+    """
+
+    def __init__(self, kind, possibilities, table, cutoff=0.6):
+        self.kind = kind
+        self.table = table
+        self.cutoff = cutoff
+        self.names = [name for name in dict.fromkeys(possibilities)
+                      if isinstance(name, str)]
+        self._known = set(self.names)
+        self.candidates = candidates_key(self.names, cutoff)
+        self._matcher = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._known
+
+    @property
+    def matcher(self):
+        if self._matcher is None:
+            self._matcher = NameMatcher(self.names, self.cutoff)
+        return self._matcher
+
+    def match_score(self, word):
+        """As NameMatcher.match_score()."""
+        if not isinstance(word, str) or not self.names:
+            return None, 0.0
+        known = self.table.get(self.kind, word, self.candidates)
+        if known is not None:
+            count_match('resolution',
+                        'manual' if known[2] == 'manual' else 'learned')
+            return known[0], known[1]
+        if word in self._known:
+            return word, 1.0
+
+        best, score = self.matcher.match_score(word)
+        self.table.record(self.kind, word, best, score,
+                          'close' if best is not None else 'unmatched',
+                          self.candidates)
+        count_match('resolution', 'new')
+        return best, score
+
+    def match(self, word):
+        """Returns the closest candidate to word, or None."""
+        return self.match_score(word)[0]
+
+    def match_many(self, words):
+        """As NameMatcher.match_many()."""
+        found = {}
+        result = []
+        for word in words:
+            try:
+                best = found[word]
+            except KeyError:
+                best = found[word] = self.match(word)
+            except TypeError:
+                best = None
+            result.append(best)
+        return result
+
+
+@lru_cache(maxsize=None)
+def _table(path):
+    return ResolutionTable(path)
+
+
+def resolution_table():
+    """
+    The resolution table of this process, loaded once from
+    resolutions_path(), or None if it is disabled.
+    """
+    path = resolutions_path()
+    if path is None:
+        return None
+    return _table(path)
+
+
+def name_matcher(kind, possibilities, cutoff=0.6):
+    """
+    Matcher for names of this kind: a LearnedMatcher using
+    resolution_table(), or a plain NameMatcher if the table is disabled.
+    """
+    table = resolution_table()
+    if table is None:
+        return NameMatcher(possibilities, cutoff)
+    return LearnedMatcher(kind, possibilities, table, cutoff)
+
+
+def save_resolutions():
+    """Saves the new resolutions of resolution_table()."""
+    table = resolution_table()
+    if table is None:
+        return
+    try:
+        table.save()
+    except OSError:
+        pass
+
+
+def manual_resolutions(kind=None):
+    """
+    Manual resolutions of resolution_table() (see ResolutionTable.manual()),
+    for the cache keys of the tables that use them; None if the table is
+    disabled.
+    """
+    table = resolution_table()
+    if table is None:
+        return None
+    return table.manual(kind)
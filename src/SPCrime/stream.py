@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked version of SPCrime() for patient tables that do not fit in memory.
+
+The patient file is read a chunk at a time. Each chunk gets the same
+columns as SPCrime() from a CrimeLookup loaded once, and is appended to
+the output file, so memory use depends on the chunk size and not on the
+number of patients.
+
+CSV and TSV files need only pandas. Parquet files need pyarrow, as do
+Feather files, which can be read but not written a chunk at a time.
+"""
+
+# Matrices and dataframes
+import pandas as pd
+
+from SPCrime.arrow import import_pyarrow
+from SPCrime.cep import wrong_zip
+from SPCrime.lookup import CrimeLookup
+from SPCrime.output import file_format as _file_format
+from SPCrime.output import text_objects
+from SPCrime.report import activate, stage
+
+
+# Default number of patients per chunk.
+CHUNK_SIZE = 100_000
+
+
+def read_chunks(path, zip_code_col, chunksize=CHUNK_SIZE):
+    """
+    Reads a CSV, TSV or Parquet file in tables of at most chunksize rows.
+    In text files the postal code column is read as text, so leading zeros
+    are kept.
+    """
+    file_format = _file_format(path)
+    if file_format == 'parquet':
+        pyarrow = import_pyarrow()
+        parquet = pyarrow.parquet.ParquetFile(path)
+        for batch in parquet.iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+        return
+    if file_format == 'feather':
+        pyarrow = import_pyarrow()
+        table = pyarrow.feather.read_table(path)
+        for batch in table.to_batches(max_chunksize=chunksize):
+            yield batch.to_pandas()
+        return
+
+    sep = '\t' if file_format == 'tsv' else ','
+    yield from pd.read_csv(path,
+                           sep=sep,
+                           dtype={zip_code_col: str},
+                           chunksize=chunksize)
+
+
+class ChunkWriter:
+    """
+    Appends tables to a CSV, TSV or Parquet file. The first table gives
+    the columns (and, in Parquet, the schema).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.format = _file_format(path)
+        if self.format == 'feather':
+            raise ValueError('Feather files cannot be written a chunk at a '
+                             'time; use Parquet')
+        self.rows = 0
+        self._parquet = None
+
+    def write(self, chunk):
+        if self.format == 'parquet':
+            pyarrow = import_pyarrow()
+            chunk = text_objects(chunk)
+            if self._parquet is None:
+                table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+                self._parquet = pyarrow.parquet.ParquetWriter(self.path,
+                                                              table.schema)
+            else:
+                table = pyarrow.Table.from_pandas(
+                    chunk, schema=self._parquet.schema, preserve_index=False)
+            self._parquet.write_table(table)
+        else:
+            chunk.to_csv(self.path,
+                         sep='\t' if self.format == 'tsv' else ',',
+                         index=False,
+                         mode='w' if self.rows == 0 else 'a',
+                         header=self.rows == 0)
+        self.rows += len(chunk)
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def enrich_chunk(chunk, zip_code_col, crime_lookup):
+    """
+    Adds to a patient table the columns of SPCrime(): zip_code_correct,
+    wrong_zip, cep_status, street, neighbourhood, city, district, a
+    '{crime type}_rate' column per crime type and cep_match.
+    """
+    found = crime_lookup.lookup_many(chunk[zip_code_col])
+    found = found.drop(columns='LOCATION')
+    found = found.rename(columns={'cep': 'zip_code_correct',
+                                  'status': 'cep_status'})
+    found.insert(1, 'wrong_zip', wrong_zip(found['cep_status']))
+    found.index = chunk.index
+    chunk = chunk.drop(columns=found.columns, errors='ignore')
+    return pd.concat([chunk, found], axis=1)
+
+
+def SPCrime_chunked(input_path,
+                    zip_code_col,
+                    crime_type,
+                    crime_db,
+                    output_path,
+                    chunksize=CHUNK_SIZE,
+                    cep_path=None,
+                    autocorrect=False,
+                    premade_crime_db=False,
+                    n_percapita=10000,
+                    aggregate=True,
+                    cache=True,
+                    workers=1,
+                    report=None,
+                    cep_fallback=False):
+    """
+    SPCrime() for a patient file read and written a chunk at a time.
+    Inputs:
+        input_path = CSV, TSV or Parquet file of patients (by extension;
+                     compressed text files like .tsv.gz work too).
+        output_path = CSV, TSV or Parquet file to write.
+        chunksize = number of patients per chunk.
+        Other arguments as in SPCrime(). The crime rates are computed once,
+        before reading the patients.
+    The output has the columns of SPCrime(), except cep_info and state,
+    and no index column.
+    Returns the number of patients written.
+    """
+    if isinstance(crime_type, str):
+        crime_type = [crime_type]
+    with activate(report), stage('SPCrime_chunked'):
+        with stage('CrimeLookup'):
+            crime_lookup = CrimeLookup.build(crime_type,
+                                             crime_db,
+                                             n_percapita=n_percapita,
+                                             premade=premade_crime_db,
+                                             aggregate=aggregate,
+                                             cache=cache,
+                                             workers=workers,
+                                             cep=cep_path,
+                                             autocorrect=autocorrect,
+                                             cep_fallback=cep_fallback)
+
+        with ChunkWriter(output_path) as writer:
+            for chunk in read_chunks(input_path, zip_code_col, chunksize):
+                with stage('enrich_chunk'):
+                    chunk = enrich_chunk(chunk, zip_code_col, crime_lookup)
+                with stage('write chunk'):
+                    writer.write(chunk)
+    return writer.rows
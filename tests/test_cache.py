@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Tests of the cache of processed tables (SPCrime.cache)."""
+
+# Standard libraries
+import os
+
+# External libraries
+import pandas as pd
+import pytest
+
+# Local modules
+from SPCrime import cache
+
+
+@pytest.fixture(autouse=True)
+def cache_folder(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPCRIME_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.delenv('SPCRIME_CACHE', raising=False)
+    return tmp_path / 'cache'
+
+
+def table(n=3):
+    return pd.DataFrame({'LOCATION': [f'loc {i}' for i in range(n)],
+                         'n': range(n)})
+
+
+def counted_build(df):
+    calls = []
+
+    def build():
+        calls.append(1)
+        return df
+    return build, calls
+
+
+def test_cached_table_builds_once():
+    df = table()
+    build, calls = counted_build(df)
+    first = cache.cached_table('test', build, sources=[df], size=3)
+    second = cache.cached_table('test', build, sources=[df], size=3)
+    assert len(calls) == 1
+    assert list(second['LOCATION']) == list(first['LOCATION'])
+    assert list(second['n']) == list(first['n'])
+
+
+def test_changed_source_or_params_rebuild():
+    df = table()
+    build, calls = counted_build(df)
+    cache.cached_table('test', build, sources=[df], size=3)
+    cache.cached_table('test', build, sources=[table(4)], size=3)
+    cache.cached_table('test', build, sources=[df], size=4)
+    assert len(calls) == 3
+
+
+def test_changed_file_rebuilds(tmp_path):
+    path = tmp_path / 'source.txt'
+    path.write_text('a')
+    build, calls = counted_build(table())
+    cache.cached_table('test', build, sources=[str(path)])
+    path.write_text('ab')
+    cache.cached_table('test', build, sources=[str(path)])
+    assert len(calls) == 2
+
+
+def test_cache_off(monkeypatch):
+    build, calls = counted_build(table())
+    cache.cached_table('test', build, cache=False)
+    monkeypatch.setenv('SPCRIME_CACHE', '0')
+    cache.cached_table('test', build)
+    assert len(calls) == 2
+    assert cache.list_cache().empty
+
+
+def test_invalidate():
+    for kind in ['a', 'a', 'b']:
+        build, _ = counted_build(table())
+        cache.cached_table(kind, build, n=len(cache.list_cache()))
+    assert len(cache.list_cache()) == 3
+
+    key = cache.list_cache().query("kind == 'b'")['key'].iloc[0]
+    assert cache.invalidate('b', key='other') == 0
+    assert cache.invalidate('b', key=key) == 1
+    assert cache.invalidate('a') == 2
+    assert cache.list_cache().empty
+
+
+def test_evict_keeps_most_recent():
+    for i in range(3):
+        key = cache.cache_key('test', [], i=i)
+        cache.store_table('test', key, table(100))
+        path = cache.entry_path('test', key)
+        entry = cache._read_entry(path)
+        entry['last_used'] = i
+        cache._write_entry(path, entry)
+    entries = cache.list_cache()
+    newest = entries['key'].iloc[0]
+
+    assert cache.evict(max_bytes=entries['size'].sum()) == 0
+    assert cache.evict(max_bytes=0) == 2
+    assert list(cache.list_cache()['key']) == [newest]
+    assert os.path.isdir(cache.entry_path('test', newest))
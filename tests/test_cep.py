@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Tests of the postal code checks of SPCrime."""
+
+# External libraries
+import numpy as np
+import pandas as pd
+
+# Local modules
+from SPCrime.SPCrime import validate_cep, wrong_zip
+
+
+def test_validate_cep_status():
+    zip_codes = pd.Series(['01310-100', ' 13083000 ', '1310100', '12345',
+                           '21310100', 'abcdefgh', None, '', 13083000.0,
+                           '13083000.0', np.nan],
+                          index=range(10, 21))
+    checked = validate_cep(zip_codes)
+
+    assert list(checked.index) == list(zip_codes.index)
+    assert list(checked['status']) == ['ok', 'ok', 'wrong length',
+                                       'wrong length', 'wrong region',
+                                       'wrong length', 'missing', 'missing',
+                                       'ok', 'ok', 'missing']
+    assert list(checked['cep'].iloc[:2]) == ['01310100', '13083000']
+    assert checked['cep'].loc[[16, 17, 20]].isna().all()
+
+
+def test_validate_cep_numbers():
+    checked = validate_cep(pd.Series([1310100, 13083000, 5]),
+                           autocorrect=0)
+    assert list(checked['cep']) == ['01310100', '13083000', '5']
+    assert list(checked['status']) == ['corrected', 'ok', 'wrong length']
+
+
+def test_wrong_zip():
+    checked = validate_cep(pd.Series(['01310100', '1310100', '123', None,
+                                      '21310100']),
+                           autocorrect=0)
+    flags = wrong_zip(checked['status'])
+    assert flags.iloc[:3].tolist() == [False, 'Corrected', True]
+    assert pd.isna(flags.iloc[3])
+    assert flags.iloc[4] is True
+    assert list(flags == True) == [False, False, True, False, True]
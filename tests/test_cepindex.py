@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Tests of the compiled CEP index (SPCrime.cepindex)."""
+
+# External libraries
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local modules
+from SPCrime.cepindex import CEPIndex, PrefixResolver, compile_cep_index
+from SPCrime.cepindex import is_cep_index
+
+
+@pytest.fixture(scope='module')
+def index(tmp_path_factory):
+    path = tmp_path_factory.mktemp('cep') / 'cep_index.bin'
+    return CEPIndex(compile_cep_index(str(path)))
+
+
+def small_table():
+    return pd.DataFrame({'rua': ['Rua A', 'Rua B', np.nan],
+                         'cep_info': [np.nan, 'lado par', np.nan],
+                         'bairro': ['Centro', 'Centro', 'Vila Nova'],
+                         'cidade': ['São Paulo', 'São Paulo', 'Campinas'],
+                         'estado': ['26', '26', '26']},
+                        index=['13083000', '01310100', '01001000'])
+
+
+def test_lookup(index):
+    found = index.lookup(pd.Series(['01310100', 1310100, '13083000'],
+                                   index=[5, 6, 7]))
+    assert list(found.index) == [5, 6, 7]
+    assert list(found['rua'][:2]) == ['Avenida Paulista'] * 2
+    assert list(found['cidade']) == ['São Paulo', 'São Paulo', 'Campinas']
+
+
+def test_lookup_missing(index):
+    ceps = ['09999000', 'abc', None, '0131010', 1.5, -1]
+    assert (index.positions(ceps) == -1).all()
+    assert index.lookup(ceps).isna().all().all()
+
+
+def test_compile_table(tmp_path):
+    path = compile_cep_index(str(tmp_path / 'small.bin'), CEP=small_table())
+    assert is_cep_index(path)
+    assert not is_cep_index(str(tmp_path / 'missing.bin'))
+
+    index = CEPIndex(path)
+    assert len(index) == 3
+    assert list(index.keys(['01001000', '1001000', 'x'])) == [1001000,
+                                                               -1, -1]
+    table = index.to_frame()
+    expected = small_table().sort_index()
+    assert list(table.index) == list(expected.index)
+    assert table.fillna('').values.tolist() == \
+        expected.fillna('').values.tolist()
+
+
+def test_prefix_resolver(index):
+    cities = np.asarray(index.codes('cidade'), dtype=np.int64)
+    resolver = PrefixResolver(index, cities)
+    ceps = ['01310100', '09999000', '09000000', '79999999', 'abc', None]
+    value, level = resolver.resolve(ceps)
+    assert list(level) == ['exact', 'sector', 'subregion', 'none', 'none',
+                           'none']
+    assert list(index.decode('cidade', value[:3])) == ['São Paulo',
+                                                       'Diadema',
+                                                       'Santo André']
+    assert (value[3:] == -1).all()
+
+    # resolve_one() is for CEPs missing from the index.
+    for cep, expected, expected_level in zip(ceps[1:4], value[1:4],
+                                             level[1:4]):
+        assert resolver.resolve_one(int(cep)) == (expected, expected_level)
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Tests of the crime rate functions of SPCrime.SPCrime."""
+
+# External libraries
+import pandas as pd
+
+# Local modules
+from SPCrime.SPCrime import multiple_crime_rates
+
+
+def count_table(locations, thefts):
+    counts = pd.DataFrame({'FURTO - OUTROS': thefts},
+                          index=pd.Index(locations, name='LOCATION'))
+    counts.columns.name = 'NATUREZA_APURADA'
+    return counts
+
+
+def test_multiple_crime_rates_cache_depends_on_counts(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPCRIME_CACHE_DIR', str(tmp_path))
+    monkeypatch.setenv('SPCRIME_RESOLUTIONS', '0')
+
+    first = multiple_crime_rates(
+        ['THEFT'], None, counts=count_table(['adamantina', 'agudos'], [1, 2]))
+    second = multiple_crime_rates(
+        ['THEFT'], None, counts=count_table(['aguai'], [5]))
+
+    assert list(first.index) == ['adamantina', 'agudos']
+    assert list(second.index) == ['aguai']
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Tests of the multi-year crime counts (SPCrime.cube)."""
+
+# External libraries
+import pytest
+from openpyxl import Workbook
+
+# Local modules
+from SPCrime.cube import CrimeCube
+
+
+RECORDS = [('CAMPINAS', 'CENTRO', 'FURTO - OUTROS'),
+           ('CAMPINAS', 'CAMBUI', 'ROUBO - OUTROS'),
+           ('SOROCABA', 'CENTRO', 'FURTO - OUTROS'),
+           ('SOROCABA', 'CENTRO', 'ESTUPRO')]
+
+
+def write_ssp(path, records):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['NUM_BO', 'CIDADE', 'BAIRRO', 'NATUREZA_APURADA'])
+    for i, record in enumerate(records):
+        sheet.append([i, *record])
+    workbook.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPCRIME_CACHE', '0')
+    return {2022: write_ssp(tmp_path / 'ssp2022.xlsx', RECORDS),
+            2023: write_ssp(tmp_path / 'ssp2023.xlsx', RECORDS[:2])}
+
+
+def test_update_is_incremental(tmp_path, files):
+    cube = CrimeCube(str(tmp_path / 'cube'))
+    assert cube.update(files) == [2022, 2023]
+    assert cube.update(files) == []
+
+    # A cube opened again reads the manifest.
+    cube = CrimeCube(str(tmp_path / 'cube'))
+    assert cube.years == [2022, 2023]
+    assert cube.update(files) == []
+
+    write_ssp(files[2023], RECORDS[1:])
+    assert cube.update(files) == [2023]
+
+
+def test_counts(tmp_path, files):
+    cube = CrimeCube(str(tmp_path / 'cube'))
+    cube.update(files)
+    counts = cube.counts(['THEFT', 'CVI'])
+    assert list(counts.index.names) == ['LOCATION', 'YEAR']
+    assert counts.loc[('campinas', 2022), 'THEFT'] == 2
+    assert counts.loc[('sorocaba', 2022), 'CVI'] == 1
+    assert counts.xs(2023, level='YEAR')['THEFT'].sum() == 2
+
+    rates = cube.rates(['THEFT'], years=[2022])
+    assert rates.loc[('campinas', 2022), 'THEFT'] > 0
+
+
+def test_remove(tmp_path, files):
+    cube = CrimeCube(str(tmp_path / 'cube'))
+    cube.update(files)
+    cube.remove(2022)
+    assert cube.years == [2023]
+    with pytest.raises(KeyError):
+        cube.year_counts(2022)
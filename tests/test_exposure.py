@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Tests of the crime counts in time windows (SPCrime.exposure)."""
+
+# External libraries
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local modules
+from SPCrime.exposure import CrimeWindows
+from SPCrime.SPCrime import parse_dates
+
+
+@pytest.fixture(scope='module')
+def windows():
+    # Crimes of 'centro' on 10, 11 and 20 January, of 'cambui' on 15.
+    daily = pd.DataFrame({
+        'LOCATION': ['centro', 'centro', 'centro', 'cambui'],
+        'NATUREZA_APURADA': ['FURTO - OUTROS', 'ESTUPRO', 'ROUBO - OUTROS',
+                             'FURTO - OUTROS'],
+        'DATE': pd.to_datetime(['2022-01-10', '2022-01-11', '2022-01-20',
+                                '2022-01-15']),
+        'count': [2, 1, 3, 5]})
+    return CrimeWindows(daily, ['THEFT', 'CVI', 'FURTO - OUTROS'])
+
+
+def count(windows, dates, days, offset=0, location='centro'):
+    return windows.count([location] * len(dates), pd.to_datetime(dates),
+                         days=days, offset=offset)
+
+
+def test_window_edges(windows):
+    # The window [date - days, date) does not include the date itself.
+    counts = count(windows, ['2022-01-11', '2022-01-21', '2022-01-20'],
+                   days=10)
+    assert list(counts['THEFT']) == [2, 3, 2]
+    assert list(counts['CVI']) == [0, 1, 1]
+
+    counts = count(windows, ['2022-01-11'], days=1, offset=-1)
+    assert list(counts['THEFT']) == [0]
+    assert list(counts['CVI']) == [1]
+
+
+def test_windows_cut_at_the_data_period(windows):
+    counts = count(windows, ['2022-01-12', '2022-03-01'], days=365)
+    assert list(counts['THEFT']) == [2, 5]
+
+
+def test_outside_the_data_period(windows):
+    # No data is not the same as no crimes.
+    counts = count(windows, ['2022-01-10', '2022-01-16', '2022-06-01'],
+                   days=4)
+    assert np.isnan(counts['THEFT'][0])
+    assert counts['THEFT'][1] == 0
+    assert np.isnan(counts['THEFT'][2])
+
+
+def test_unknown_location_or_date(windows):
+    counts = windows.count(['centro', 'nowhere', 'cambui'],
+                           pd.to_datetime(['2022-01-21', '2022-01-21', None]),
+                           days=30)
+    assert counts['THEFT'][0] == 5
+    assert counts[['THEFT', 'CVI']].iloc[1:].isna().all().all()
+
+
+def test_parse_dates():
+    dates = parse_dates(['31/12/2022', '05/01/2022', None, 'abc'])
+    assert list(dates[:2]) == [pd.Timestamp('2022-12-31'),
+                               pd.Timestamp('2022-01-05')]
+    assert dates[2:].isna().all()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Tests of SPCrime.matching."""
+
+# Standard libraries
+import random
+from difflib import get_close_matches
+
+# External libraries
+import pytest
+
+# Local modules
+from SPCrime.matching import NameMatcher
+
+
+NAMES = ['se', 'consolacao', 'bela vista', 'vila mariana', 'vila maria',
+         'vila matilde', 'jardim paulista', 'jardim angela', 'jardim helena',
+         'sao mateus', 'sao miguel', 'sao lucas', 'santana', 'santo amaro',
+         'pinheiros', 'perdizes', 'penha', 'pari', 'moema', 'mooca']
+
+
+def misspell(name, rng):
+    chars = list(name)
+    for _ in range(rng.randint(1, 3)):
+        i = rng.randrange(len(chars))
+        action = rng.choice(['drop', 'swap', 'replace'])
+        if action == 'drop' and len(chars) > 1:
+            del chars[i]
+        elif action == 'swap' and i + 1 < len(chars):
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+        else:
+            chars[i] = rng.choice('abcdeilmnorstuv ')
+    return ''.join(chars)
+
+
+def close_match(word, cutoff):
+    found = get_close_matches(word, NAMES, n=1, cutoff=cutoff)
+    return found[0] if found else None
+
+
+@pytest.mark.parametrize('cutoff', [0.0, 0.6, 0.8, 1.0])
+def test_same_match_as_difflib(cutoff):
+    rng = random.Random(0)
+    matcher = NameMatcher(NAMES, cutoff=cutoff)
+    words = [misspell(rng.choice(NAMES), rng) for _ in range(300)]
+    words += ['', 'x', 'vila', 'jardim', 'sao paulo'] + NAMES
+    for word in words:
+        assert matcher.match(word) == close_match(word, cutoff), word
+
+
+def test_no_match_below_cutoff():
+    matcher = NameMatcher(NAMES)
+    assert matcher.match_score('qqqqqqqq') == (None, 0.0)
+    assert matcher.match(float('nan')) is None
+    assert matcher.match_score('moema') == ('moema', 1.0)
+
+
+def test_bad_cutoff():
+    with pytest.raises(ValueError):
+        NameMatcher(NAMES, cutoff=1.5)
+
+
+def test_match_many():
+    matcher = NameMatcher(NAMES + [None, 'se'])
+    assert len(matcher) == len(NAMES)
+    assert matcher.match_many(['pinheros', None, 'pinheros']) == [
+        'pinheiros', None, 'pinheiros']
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Tests of the table writers (SPCrime.output)."""
+
+# External libraries
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local modules
+from SPCrime.output import output_path, split_extension, write_table
+
+
+def table():
+    return pd.DataFrame({'zip_code': ['01310100', '13083000', '01001000'],
+                         'district': ['bela vista', np.nan, 'se'],
+                         'THEFT_rate': [1.5, np.nan, 2.0]})
+
+
+def test_split_extension():
+    assert split_extension('out.csv.gz') == ('csv', 'gzip')
+    assert split_extension('out.xlsx') == ('xlsx', None)
+    assert split_extension('out') == (None, None)
+    assert output_path('out', 'csv', 'gzip') == 'out.csv.gz'
+    assert output_path('out.parquet', 'tsv') == 'out.parquet'
+
+
+@pytest.mark.parametrize('name', ['out.tsv', 'out.csv.gz', 'out.xlsx'])
+def test_write_table(tmp_path, name):
+    path = str(tmp_path / 'folder' / name)
+    assert write_table(table(), path, columns=['zip_code', 'THEFT_rate'],
+                       index=False) == path
+    if name.endswith('.xlsx'):
+        written = pd.read_excel(path, dtype={'zip_code': str})
+    else:
+        written = pd.read_csv(path, sep='\t' if name.endswith('.tsv') else ',',
+                              dtype={'zip_code': str})
+    assert list(written.columns) == ['zip_code', 'THEFT_rate']
+    assert list(written['zip_code']) == list(table()['zip_code'])
+    assert written['THEFT_rate'].isna().sum() == 1
+
+
+def test_write_partitions(tmp_path):
+    path = str(tmp_path / 'out')
+    files = write_table(table(), path, format='tsv', partition_by='district',
+                        index=False)
+    assert len(files) == 3
+    assert (tmp_path / 'out' / 'district=se' / 'part-0.tsv').exists()
+    assert (tmp_path / 'out' / 'district=__HIVE_DEFAULT_PARTITION__'
+            / 'part-0.tsv').exists()
+
+    # Written again, the folder is replaced.
+    files = write_table(table().iloc[:1], path, format='tsv',
+                        partition_by='district', index=False)
+    assert len(files) == 1
+    assert not (tmp_path / 'out' / 'district=se').exists()
+
+
+def test_write_nothing_or_unknown_format(tmp_path):
+    assert write_table(table(), None) is None
+    with pytest.raises(ValueError):
+        write_table(table(), str(tmp_path / 'out.txt'), format='json')
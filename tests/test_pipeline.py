@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Tests of the stage graph (SPCrime.pipeline)."""
+
+# External libraries
+import pandas as pd
+import pytest
+
+# Local modules
+from SPCrime.cache import source_digest
+from SPCrime.pipeline import Pipeline, Stage
+
+
+def graph(calls, table, max_workers=1):
+    def load(inputs, name):
+        calls.append(name)
+        return name
+
+    def join(inputs):
+        calls.append('join')
+        return '+'.join(inputs[name] for name in sorted(inputs))
+
+    return Pipeline([Stage('a', load, sources=[table], params={'name': 'a'}),
+                     Stage('b', load, params={'name': 'b'}),
+                     Stage('join', join, requires=['a', 'b'])],
+                    max_workers=max_workers)
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_rerun_only_changed_stages(max_workers):
+    calls = []
+    pipeline = graph(calls, pd.DataFrame({'x': [1, 2]}), max_workers)
+    pipeline.run()
+    assert sorted(calls) == ['a', 'b', 'join']
+    assert pipeline['join'] == 'a+b'
+
+    calls.clear()
+    assert pipeline.outdated() == []
+    pipeline.run()
+    assert calls == []
+
+    pipeline.stages['a'].sources = [pd.DataFrame({'x': [1, 3]})]
+    assert pipeline.outdated() == ['a', 'join']
+    pipeline.run()
+    assert calls == ['a', 'join']
+
+
+def test_unhashable_sources_are_always_run():
+    table = pd.DataFrame({'tags': [['a', 'b'], []],
+                          'extra': [{'k': 1}, None]})
+    assert source_digest(table) is None
+
+    calls = []
+    pipeline = graph(calls, table)
+    assert pipeline.signatures()['a'] is None
+    pipeline.run()
+    calls.clear()
+    pipeline.run()
+    assert calls == ['a', 'join']
+
+
+def test_unknown_required_stage():
+    with pytest.raises(ValueError):
+        Pipeline([Stage('join', None, requires=['a'])])
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Tests of the table of learned name resolutions (SPCrime.resolutions)."""
+
+# Standard libraries
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# External libraries
+import pytest
+
+# Local modules
+from SPCrime.resolutions import ResolutionTable, file_lock
+
+
+def record_and_save(path, name):
+    table = ResolutionTable(path)
+    table.record('district', name, 'centro', 0.9, 'close', 'key')
+    table.save()
+    return name
+
+
+def test_save_keeps_other_tables(tmp_path):
+    path = str(tmp_path / 'resolutions.tsv')
+    first = ResolutionTable(path)
+    second = ResolutionTable(path)
+    first.record('district', 'sentro', 'centro', 0.9, 'close', 'key')
+    second.record('district', 'centr', 'centro', 0.8, 'close', 'key')
+    first.save()
+    second.save()
+    assert not second.dirty
+
+    table = ResolutionTable(path)
+    assert len(table) == 2
+    assert table.get('district', 'sentro', 'key') == ('centro', 0.9, 'close')
+    assert table.get('district', 'centr', 'key') == ('centro', 0.8, 'close')
+    assert not os.path.exists(f'{path}.lock')
+
+
+def test_save_from_processes(tmp_path):
+    path = str(tmp_path / 'resolutions.tsv')
+    names = [f'bairro {i}' for i in range(8)]
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        list(pool.map(record_and_save, [path] * len(names), names))
+    table = ResolutionTable(path)
+    assert sorted(table.to_frame()['name']) == names
+
+
+def test_file_lock(tmp_path):
+    path = str(tmp_path / 'resolutions.tsv')
+    with file_lock(path):
+        with pytest.raises(TimeoutError):
+            with file_lock(path, timeout=0.1):
+                pass
+    with file_lock(path, timeout=0.1):
+        pass
+
+
+def test_stale_lock(tmp_path):
+    path = str(tmp_path / 'resolutions.tsv')
+    with open(f'{path}.lock', 'w') as f:
+        f.write('0')
+    os.utime(f'{path}.lock', (0, 0))
+    with file_lock(path, timeout=0.1):
+        pass
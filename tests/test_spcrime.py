@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""End to end runs of SPCrime() on synthetic data (see benchmarks.generate)."""
+
+# Standard libraries
+import importlib
+
+# External libraries
+import pandas as pd
+import pytest
+
+# Local modules
+from benchmarks import generate
+from SPCrime.SPCrime import SPCrime
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPCRIME_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.chdir(tmp_path)
+    generate.crime_workbook('crimes.xlsx', 2000)
+    return tmp_path
+
+
+@pytest.mark.parametrize('crime_type', [['THEFT'], ['THEFT', 'CVI']])
+def test_SPCrime(workdir, crime_type):
+    patients = generate.patient_table(200)
+    out = SPCrime(patients.copy(), 'zip_code', crime_type, 'crimes.xlsx',
+                  'patients_crime')
+
+    assert len(out) == len(patients)
+    for name in crime_type:
+        assert out[f'{name}_rate'].notna().any()
+    assert set(out['wrong_zip'].dropna()) <= {False, True, 'Corrected'}
+    written = pd.read_csv('patients_crime.tsv', sep='\t', index_col=0)
+    assert len(written) == len(patients)
+
+
+def test_SPCrime_object_columns(workdir):
+    # Columns that cannot be hashed for the cache or the stage signatures.
+    patients = generate.patient_table(50)
+    patients['tags'] = [['a', 'b']] * len(patients)
+    patients['extra'] = [{'ward': i} for i in range(len(patients))]
+    out = SPCrime(patients.copy(), 'zip_code', 'THEFT', 'crimes.xlsx',
+                  'patients_crime')
+
+    assert len(out) == len(patients)
+    assert list(out['tags']) == list(patients['tags'])
+    assert out['THEFT_rate'].notna().any()
+
+
+@pytest.mark.parametrize('crime_type, excel', [
+    (['THEFT'], 'THEFT_crimes.xlsx.xlsx'),
+    (['THEFT', 'CVI'], 'multiple_crimes_SP.xlsx')])
+def test_SPCrime_intermediates(workdir, crime_type, excel):
+    # crime_db with folders, as an absolute path.
+    crime_db = str(workdir / 'crimes.xlsx')
+    patients = generate.patient_table(50)
+    SPCrime(patients.copy(), 'zip_code', crime_type, crime_db, None)
+    assert sorted(p.name for p in workdir.iterdir()) == ['cache',
+                                                        'crimes.xlsx']
+
+    SPCrime(patients.copy(), 'zip_code', crime_type, crime_db, None,
+            intermediates='tables')
+    rates_name = '_'.join(crime_type)
+    assert sorted(p.name for p in (workdir / 'tables').iterdir()) == sorted(
+        ['crimes_crimes.tsv', f'{rates_name}_rates.tsv', excel])
+    rates = pd.read_excel(workdir / 'tables' / excel, index_col=0)
+    assert len(rates) > 0
+    assert not (workdir / excel).exists()
+
+
+def test_facade_names():
+    facade = importlib.import_module('SPCrime.SPCrime')
+    assert len(set(facade.__all__)) == len(facade.__all__)
+    for name in facade.__all__:
+        assert hasattr(facade, name), name
+    # Every public function and class of the parts is in __all__.
+    for module_name in ['SPCrime.cep', 'SPCrime.crime', 'SPCrime.patients']:
+        module = importlib.import_module(module_name)
+        for name, value in vars(module).items():
+            if (callable(value) and not name.startswith('_')
+                    and getattr(value, '__module__', None) == module_name):
+                assert name in facade.__all__, name
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Tests of the chunked writer of SPCrime.stream."""
+
+# External libraries
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local modules
+from SPCrime.stream import ChunkWriter, read_chunks
+
+
+def objects(*values):
+    return pd.Series(values, dtype=object)
+
+
+def chunks():
+    # The first chunk has no district and only False in wrong_zip, as a
+    # chunk without São Paulo City patients or wrong postal codes would.
+    # wrong_zip() and lookup_many() give object columns.
+    first = pd.DataFrame({'zip_code': ['13083000', '13083001'],
+                          'wrong_zip': objects(False, False),
+                          'district': objects(np.nan, np.nan),
+                          'THEFT_rate': [1.5, np.nan]})
+    second = pd.DataFrame({'zip_code': ['01310100', '0131010'],
+                           'wrong_zip': objects(False, True),
+                           'district': ['bela vista', np.nan],
+                           'THEFT_rate': [2.0, np.nan]})
+    third = pd.DataFrame({'zip_code': ['1310100'],
+                          'wrong_zip': ['Corrected'],
+                          'district': ['bela vista'],
+                          'THEFT_rate': [2.0]})
+    return [first, second, third]
+
+
+def check_written(path):
+    written = pd.concat(list(read_chunks(path, 'zip_code', chunksize=2)),
+                        ignore_index=True)
+    assert len(written) == 5
+    assert list(written['zip_code']) == ['13083000', '13083001', '01310100',
+                                         '0131010', '1310100']
+    assert list(written['district'].iloc[2:].fillna('')) == ['bela vista',
+                                                             '',
+                                                             'bela vista']
+    assert written['district'].iloc[:2].isna().all()
+    assert written['THEFT_rate'].iloc[1:].isna().sum() == 2
+    return written
+
+
+@pytest.mark.parametrize('name', ['out.tsv', 'out.csv'])
+def test_text_chunks(tmp_path, name):
+    path = str(tmp_path / name)
+    with ChunkWriter(path) as writer:
+        for chunk in chunks():
+            writer.write(chunk)
+    assert writer.rows == 5
+    check_written(path)
+
+
+def test_parquet_chunks_keep_one_schema(tmp_path):
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / 'out.parquet')
+    with ChunkWriter(path) as writer:
+        for chunk in chunks():
+            writer.write(chunk)
+    written = check_written(path)
+    assert list(written['wrong_zip']) == ['False', 'False', 'False', 'True',
+                                          'Corrected']